@@ -0,0 +1,172 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the active learning queue that decides which unlabeled ad should be reviewed next.
+              Ads are ranked by how uncertain the AI is about them: the confidence of the label, disagreement between
+              the criteria and the scam label and the density of the cluster the ad belongs to. The ranking is kept in
+              a heap and only the ads of the affected cluster are re-ranked when a label arrives.
+@date: 19-10-2026
+"""
+import heapq
+import math
+import re
+
+# Probability of a scam that belongs to each confidence level of the label
+CONFIDENCE_PROBABILITIES = {'Very unlikely': 0.05, 'Unlikely': 0.25, 'Unsure': 0.5, 'Likely': 0.75, 'Very likely': 0.95}
+SCAM_FLAGS = ['free_crypto', 'giveaway', 'unrealistic', 'bio_link', 'limited_time']
+WEIGHTS = {'uncertainty': 1.0, 'disagreement': 0.6, 'density': 0.4}
+
+
+class ReviewQueue:
+    """
+    This class ranks the unlabeled ads for manual review, the most informative ad first. The heap uses lazy deletion:
+    an ad that is re-ranked is pushed again with a new version and outdated entries are skipped when popped.
+    """
+
+    def __init__(self, ads, clusters=None, weights=None):
+        """
+        :param ads: The ads to rank, ads with a manual label only count towards the labeled part of their cluster.
+        :param clusters: An optional dictionary of ad id -> cluster key, e.g. embedding buckets. By default ads are
+                         clustered on their normalized ad text.
+        :param weights: The weights of the uncertainty, disagreement and density terms.
+        """
+        self.ads = {ad['id']: ad for ad in ads}
+        self.weights = weights or WEIGHTS
+        self.clusters = clusters or {ad_id: self.cluster_key(ad) for ad_id, ad in self.ads.items()}
+        self.members = {}
+        self.unlabeled = {}
+        self.labeled = {}
+        for ad_id, cluster in self.clusters.items():
+            self.members.setdefault(cluster, []).append(ad_id)
+            counts = self.labeled if self.is_labeled(self.ads[ad_id]) else self.unlabeled
+            counts[cluster] = counts.get(cluster, 0) + 1
+        self.largest = max(self.unlabeled.values(), default=1)
+        self.heap = []
+        self.versions = {}
+        for ad_id, ad in self.ads.items():
+            if not self.is_labeled(ad):
+                self.push(ad_id)
+
+    @staticmethod
+    def is_labeled(ad):
+        """
+        :return: Whether the ad has a manual label.
+        """
+        return 'scam' in ad.get('manual_label', {})
+
+    @staticmethod
+    def cluster_key(ad):
+        """
+        Clusters near duplicates of a campaign together: the first 80 letters of the ad text, lowercased and without
+        numbers, links and punctuation, so ads that only differ in amounts or URLs end up in the same cluster.
+        :param ad: The ad.
+        :return: The cluster key.
+        """
+        text = ' '.join(ad.get('ad_creative_bodies') or []) or ad.get('video_transcription') or ad['id']
+        text = re.sub(r'https?://\S+|[\d\W_]+', ' ', text.lower())
+        return ' '.join(text.split())[:80]
+
+    @staticmethod
+    def uncertainty(ad):
+        """
+        :return: 1 if the label is a guess (or missing), 0 if the label is given with the highest confidence.
+        """
+        classification = ad.get('classification', {})
+        probability = CONFIDENCE_PROBABILITIES.get(classification.get('confidence'))
+        if probability is None or 'scam' not in classification:
+            return 1.0
+        return 1 - abs(2 * probability - 1)
+
+    @staticmethod
+    def disagreement(ad):
+        """
+        Compares the scam label with the criteria: the share of red flags the criteria found versus the label and
+        whether the crypto filter rule (about crypto and free crypto or giveaway) agrees with the label.
+        :return: A score between 0 (criteria and label agree) and 1 (they completely disagree).
+        """
+        classification = ad.get('classification', {})
+        if 'scam' not in classification:
+            return 0.0
+        scam = bool(classification['scam'])
+        flags = sum(bool(classification.get(flag)) for flag in SCAM_FLAGS) / len(SCAM_FLAGS)
+        rule = bool(classification.get('about_crypto')) and \
+            bool(classification.get('free_crypto') or classification.get('giveaway'))
+        return (abs(flags - scam) + (rule != scam)) / 2
+
+    def density(self, ad_id):
+        """
+        Ads of large clusters without labels are worth more: their label says something about many other ads.
+        :return: A score between 0 and 1.
+        """
+        cluster = self.clusters[ad_id]
+        unlabeled = self.unlabeled.get(cluster, 0)
+        size = math.log1p(unlabeled) / math.log1p(max(self.largest, 1))
+        return size / (1 + self.labeled.get(cluster, 0))
+
+    def priority(self, ad_id):
+        """
+        :return: The priority of an ad, higher is reviewed earlier.
+        """
+        ad = self.ads[ad_id]
+        return (self.weights['uncertainty'] * self.uncertainty(ad) +
+                self.weights['disagreement'] * self.disagreement(ad) +
+                self.weights['density'] * self.density(ad_id))
+
+    def push(self, ad_id):
+        """
+        (Re-)ranks an unlabeled ad.
+        :param ad_id: The id of the ad.
+        """
+        version = self.versions.get(ad_id, 0) + 1
+        self.versions[ad_id] = version
+        heapq.heappush(self.heap, (-self.priority(ad_id), version, ad_id))
+
+    def pop(self):
+        """
+        Takes the most informative unlabeled ad off the queue. Use push to put it back if it did not get labeled.
+        :return: The id of the ad or None if the queue is empty.
+        """
+        while self.heap:
+            _, version, ad_id = heapq.heappop(self.heap)
+            if self.versions.get(ad_id) == version and not self.is_labeled(self.ads[ad_id]):
+                self.versions.pop(ad_id)
+                return ad_id
+        return None
+
+    def take(self, n):
+        """
+        :return: The ids of the n most informative unlabeled ads, taken off the queue.
+        """
+        result = []
+        while len(result) < n:
+            ad_id = self.pop()
+            if ad_id is None:
+                break
+            result.append(ad_id)
+        return result
+
+    def label(self, ad_id, scam):
+        """
+        Registers a manual label and re-ranks the other ads of the same cluster, as their density changed.
+        An ad of which the label is undone is not queued again, use push for that.
+        :param ad_id: The id of the ad.
+        :param scam: The manual label, None if an earlier label was undone.
+        """
+        ad = self.ads[ad_id]
+        cluster = self.clusters[ad_id]
+        was_labeled = self.is_labeled(ad)
+        if scam is None:
+            ad.pop('manual_label', None)
+        else:
+            ad['manual_label'] = {**ad.get('manual_label', {}), 'scam': scam}
+        if was_labeled == self.is_labeled(ad):
+            return
+        step = 1 if scam is not None else -1
+        self.labeled[cluster] = self.labeled.get(cluster, 0) + step
+        self.unlabeled[cluster] = self.unlabeled.get(cluster, 0) - step
+        self.versions.pop(ad_id, None)
+        for member in self.members[cluster]:
+            if member in self.versions:
+                self.push(member)
+
+    def __len__(self):
+        return len(self.versions)
@@ -0,0 +1,157 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the aggregation tables behind the graphs of the scam ads. The scam ads are read in a
+              single pass into flat row tables (languages, target locations, reach per country, age ranges, gender
+              and duration), after which every histogram is a vectorized pandas/NumPy operation. The AI scams and the
+              manually labeled scams share the same rows, the labeled subset is only a mask over them.
+@date: 19-10-2026
+"""
+import numpy as np
+import pandas as pd
+
+# The upper bounds (exclusive, in days) of the ad duration categories
+DURATION_CATEGORIES = {
+    '< 1 week': 7,
+    '< 2 weeks': 14,
+    '< 1 month': 30,
+    '< 1 quarter': 90,
+    '< 1 half': 180,
+    '< 1 year': 365,
+    '< 2 years': 730,
+    '< 5 years': 1825,
+    'infinite': float('inf')
+}
+UNENDING_DAYS = 1826  # More than 5 years for unending ads
+
+
+class ScamTables:
+    """
+    This class holds the row tables of the scam ads and computes the histograms of the graphs from them. Every method
+    takes `labeled`, which limits the histogram to the ads that are also manually labeled as scam.
+    """
+
+    def __init__(self, scams, labeled=()):
+        """
+        :param scams: The list of scam ads (dictionaries or AdRecords).
+        :param labeled: The ids of the scam ads that are also manually labeled as scam.
+        """
+        labeled = set(labeled)
+        languages, locations, reach = [], [], []
+        low, high, ranges, genders, starts, stops = [], [], [], [], [], []
+        for i, ad in enumerate(scams):
+            languages += [(i, language) for language in ad.get('languages', [])]
+            locations += [(i, location.get('name', 'N/A'), location.get('excluded'))
+                          for location in ad.get('target_locations', [])]
+            reach += [(i, breakdown.get('country'), len(breakdown.get('age_gender_breakdowns', [])))
+                      for breakdown in ad.get('age_country_gender_reach_breakdown', [])]
+            keys = ad.get('target_ages', [])
+            ages = sorted(map(int, keys))
+            # An ad targets the ages between its first two (sorted) ages, or a single age
+            low.append(ages[0] if ages else -1)
+            high.append(ages[1] if len(ages) >= 2 else ages[0] if ages else -1)
+            ranges.append('-'.join(keys) if len(keys) > 1 else keys[0] if len(keys) == 1 else 'N/A')
+            genders.append(ad.get('target_gender', 'Unknown'))
+            starts.append(ad.get('ad_delivery_start_time'))
+            stops.append(ad.get('ad_delivery_stop_time'))
+        self.labeled = np.array([ad['id'] in labeled for ad in scams], dtype=bool)
+        self.languages = pd.DataFrame(languages, columns=['ad', 'language'])
+        self.locations = pd.DataFrame(locations, columns=['ad', 'location', 'excluded'])
+        self.reach = pd.DataFrame(reach, columns=['ad', 'country', 'reach'])
+        self.ads = pd.DataFrame({'low': np.array(low, dtype=np.int64), 'high': np.array(high, dtype=np.int64),
+                                 'age_range': ranges, 'gender': genders})
+        start = pd.to_datetime(pd.Series(starts, dtype=object), format='%Y-%m-%d')
+        stop = pd.to_datetime(pd.Series(stops, dtype=object), format='%Y-%m-%d')
+        days = (stop - start).dt.days.astype('float64')
+        self.ads['duration'] = days.where(stop.notna(), UNENDING_DAYS).where(start.notna())
+
+    def rows(self, table, labeled):
+        """
+        :return: The rows of a table, only of the labeled ads if labeled is True.
+        """
+        return table[self.labeled[table['ad'].to_numpy(dtype=np.int64)]] if labeled else table
+
+    def ad_rows(self, labeled):
+        """
+        :return: The table with one row per ad, only the labeled ads if labeled is True.
+        """
+        return self.ads[self.labeled] if labeled else self.ads
+
+    @staticmethod
+    def counts(values, name, column='count'):
+        """
+        :return: A dataframe with the counts of the values, the most common first.
+        """
+        counts = values.value_counts().reset_index()
+        counts.columns = [name, column]
+        return counts
+
+    def language_counts(self, labeled=False):
+        """
+        :return: The amount of scam ads per language.
+        """
+        return self.counts(self.rows(self.languages, labeled)['language'], 'language')
+
+    def location_counts(self, labeled=False, excluded=False):
+        """
+        :return: The amount of scam ads per included (or excluded) target location, all locations are listed.
+        """
+        rows = self.rows(self.locations, labeled)
+        counts = (rows['excluded'] == excluded).groupby(rows['location'], sort=False).sum().reset_index()
+        counts.columns = ['location', 'count']
+        return counts.sort_values(by='count', ascending=False)
+
+    def country_reach(self, labeled=False):
+        """
+        :return: The reach (amount of age and gender breakdowns) of the scam ads per country.
+        """
+        rows = self.rows(self.reach, labeled)
+        return rows.groupby('country')['reach'].sum().reset_index().sort_values(by='reach', ascending=False)
+
+    def country_counts(self, labeled=False):
+        """
+        :return: The amount of reach breakdowns of the scam ads per country.
+        """
+        rows = self.rows(self.reach, labeled)
+        counts = rows.groupby('country').size().reset_index()
+        counts.columns = ['country', 'scam_count']
+        return counts.sort_values(by='scam_count', ascending=False)
+
+    def accumulated_ages(self, labeled=False):
+        """
+        Counts for every age how many scam ads target it, with a difference array over the age ranges.
+        :return: The amount of scam ads per age, from the lowest to the highest targeted age.
+        """
+        rows = self.ad_rows(labeled)
+        rows = rows[rows['low'] >= 0]
+        if rows.empty:
+            return pd.DataFrame({'age': [], 'count': []})
+        low, high = rows['low'].to_numpy(), rows['high'].to_numpy()
+        difference = np.zeros(high.max() + 2, dtype=np.int64)
+        np.add.at(difference, low, 1)
+        np.add.at(difference, high + 1, -1)
+        counts = np.cumsum(difference)[low.min():high.max() + 1]
+        return pd.DataFrame({'age': np.arange(low.min(), high.max() + 1), 'count': counts.astype(float)})
+
+    def age_range_counts(self, labeled=False):
+        """
+        :return: The amount of scam ads per targeted age range.
+        """
+        return self.counts(self.ad_rows(labeled)['age_range'], 'age')
+
+    def gender_counts(self, labeled=False):
+        """
+        :return: The amount of scam ads per targeted gender.
+        """
+        return self.counts(self.ad_rows(labeled)['gender'], 'gender')
+
+    def duration_counts(self, labeled=False):
+        """
+        Bins the durations of the scam ads in the DURATION_CATEGORIES.
+        :return: The amount of scam ads per duration category.
+        """
+        durations = self.ad_rows(labeled)['duration'].dropna().to_numpy()
+        bounds = np.array(list(DURATION_CATEGORIES.values()))
+        # The category of a duration is the first one of which the bound is larger than the duration
+        categories = np.searchsorted(bounds, durations, side='right')
+        counts = np.bincount(categories, minlength=len(bounds))[:len(bounds)]
+        return pd.DataFrame({'Duration': list(DURATION_CATEGORIES), 'Count': counts})
@@ -10,18 +10,30 @@ import os
 import json
 import datetime
 import re
+import threading
+import time
 import warnings
 
-import ollama
-from moviepy.editor import VideoFileClip
-import whisper
-from pydub import AudioSegment
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+from archive import dump_ads, is_ads_file, load_ads, media_path
+from filter import Filter
+from jobs import Worker, open_queue
+from pipeline import Manifest
+from pool import OllamaPool
+from prefilter import PreFilter
+from parsing import JsonExtractor, CRITERIA_KEYS, CRITERIA_ORDER, CRITERIA_SCHEMA, CONSTRAINED_CRITERIA_SCHEMA, \
+    LABEL_SCHEMA
+from metrics import Metrics, format_duration
+from prompts import PromptBuilder
+
 # Suppress specific warnings from moviepy
 warnings.filterwarnings("ignore", category=UserWarning, module="moviepy")
 logging.getLogger("httpx").setLevel(logging.WARNING)
+DECIDED = re.compile(r'"(\w+)"\s*:\s*(true|false)')  # A criterion of which the value is completely generated
 
 
 class AIToolBox:
@@ -29,14 +41,135 @@ class AIToolBox:
         load_dotenv()
         os.environ['HSA_OVERRIDE_GFX_VERSION'] = '10.3.0'
         self.max_video_length = int(os.getenv('MAX_VIDEO_LENGTH')) or 150
-        self.model = whisper.load_model("turbo")
+        self.whisper_models = {}  # Loaded on first use, labeling and criteria generation do not need Whisper
+        self.whisper_name = "turbo"
+        # Two-phase transcription: a small model detects the language, English goes to an English-only model
+        self.language_routing = os.getenv('LANGUAGE_ROUTING', 'false').lower() == 'true'
+        self.language_id_model = os.getenv('LANGUAGE_ID_MODEL', 'tiny')
+        self.english_model = os.getenv('ENGLISH_MODEL', 'small.en')
+        self.language_confidence = float(os.getenv('LANGUAGE_ID_CONFIDENCE', 0.8))
+        self.languages = {language.strip() for language in os.getenv('TRANSCRIBE_LANGUAGES', '').split(',')
+                          if language.strip()}  # Empty means all languages are transcribed
         self.criteria_model = "llama3.2"
         self.classifier_model = "qwen2.5:32b"
-        self.client = ollama.Client()  # Using this we can get responses faster, we still need to keep message memory
+        # Using this we can get responses faster, we still need to keep message memory
+        self.ollama_client = None
+        self.client_lock = threading.Lock()
         self.max_ollama_history = int(os.getenv('MAX_OLLAMA_HISTORY')) or 2
         self.top_k = int(os.getenv('TOP_K')) or 1
         self.top_p = float(os.getenv('TOP_P')) or 0.2
         self.temp = float(os.getenv('TEMPERATURE')) or 0.1
+        self.manifest = Manifest()
+        self.json = JsonExtractor()
+        self.metrics = Metrics('ai')
+        self.criteria_prompts = PromptBuilder(self.criteria_model)
+        self.label_prompts = PromptBuilder(self.classifier_model)
+        # Constrained criteria: the answer follows CONSTRAINED_CRITERIA_SCHEMA with at most CRITERIA_NUM_PREDICT tokens
+        # and the generation stops as soon as the criteria make the filter reject the ad
+        self.constrained = os.getenv('CONSTRAINED_CRITERIA', 'false').lower() == 'true'
+        self.criteria_num_predict = int(os.getenv('CRITERIA_NUM_PREDICT', 64))
+        self.prefilter = PreFilter() if os.getenv('PREFILTER', 'false').lower() == 'true' else None
+        self.vad = None
+        if os.getenv('VAD', 'false').lower() == 'true':
+            from vad import VoiceActivityDetector
+            self.vad = VoiceActivityDetector()
+        self.cascade = None
+        if os.getenv('CASCADE', 'false').lower() == 'true':
+            from cascade import Cascade  # scikit-learn is only imported when the cascade is used
+            self.cascade = Cascade.load()
+        # With JOB_QUEUE the ads are processed by workers that pull them from the queue, see jobs.py
+        self.queue = open_queue(os.getenv('JOB_QUEUE'))
+        self.local_workers = int(os.getenv('JOB_LOCAL_WORKERS', 1 if os.getenv('JOB_QUEUE') == 'memory' else 0))
+        # With CAMPAIGNS only one ad per campaign is labeled and its label is copied to the others, see campaigns.py
+        self.campaigns = os.getenv('CAMPAIGNS', 'false').lower() == 'true'
+
+    @property
+    def model(self):
+        """
+        :return: The multilingual Whisper model, which is loaded the first time it is needed.
+        """
+        return self.whisper(self.whisper_name)
+
+    @property
+    def client(self):
+        """
+        :return: The Ollama client, which is created the first time it is needed. With OLLAMA_ENDPOINTS the requests
+                 are spread over several Ollama hosts instead of the local one.
+        """
+        with self.client_lock:
+            if self.ollama_client is None:
+                self.ollama_client = OllamaPool.from_env()
+                if self.ollama_client is None:
+                    import ollama  # Most of the import time of this module, so only when the LLMs are used
+                    self.ollama_client = ollama.Client()
+            return self.ollama_client
+
+    def whisper(self, name):
+        """
+        :param name: The name of the Whisper model, e.g. 'turbo', 'small.en' or 'tiny'.
+        :return: The Whisper model, which is loaded the first time it is needed.
+        """
+        if name not in self.whisper_models:
+            import whisper  # Imports torch, so only when transcribing
+            self.whisper_models[name] = whisper.load_model(name)
+        return self.whisper_models[name]
+
+    def criteria_signature(self):
+        """
+        :return: The signature of the criteria model and its parameters, stored in classification['model'].
+        """
+        return f"m:{self.criteria_model};t:{self.temp};k:{self.top_k};p:{self.top_p}"
+
+    def classifier_signature(self):
+        """
+        :return: The signature of the classifier model and its parameters, stored in classification['classifier'].
+        """
+        return f"m:{self.classifier_model};t:{self.temp};k:{self.top_k};p:{self.top_p}"
+
+    def transcription_signature(self, model=None):
+        """
+        :param model: The Whisper model that transcribed the ad, the multilingual model by default.
+        :return: The signature of the transcription parameters, stored in ad['transcription_model'].
+        """
+        return f"m:{model or self.whisper_name};l:{self.max_video_length}"
+
+    def transcription_signatures(self):
+        """
+        :return: The signatures the current transcription parameters can produce. With language routing an ad is
+                 transcribed by the English-only or the multilingual model, or only passed through language detection.
+        """
+        signatures = {self.transcription_signature()}
+        if self.language_routing:
+            signatures |= {self.transcription_signature(self.english_model),
+                           self.transcription_signature(self.language_id_model)}
+        return signatures
+
+    def job_signature(self, kind):
+        """
+        :param kind: The kind of job, 'transcribe', 'criteria' or 'label'.
+        :return: The signature of the parameters that influence the result of a job, part of its key. A worker only
+                 runs a job if its own parameters have the same signature.
+        """
+        if kind == 'transcribe':
+            return f"{self.transcription_signature()};r:{self.language_routing and self.english_model};" \
+                   f"s:{sorted(self.languages)};v:{self.vad is not None}"
+        cascade = self.cascade.confidence if self.cascade else None
+        if kind == 'criteria':
+            return f"{self.criteria_signature()};f:{self.prefilter.threshold if self.prefilter else None};c:{cascade};" \
+                   f"s:{self.constrained and self.criteria_num_predict}"
+        return f"{self.classifier_signature()};c:{cascade}"
+
+    def params(self):
+        """
+        :return: All parameters that influence the output of the AI stages, used by the pipeline manifest.
+        """
+        return {'criteria_model': self.criteria_model, 'classifier_model': self.classifier_model,
+                'temperature': self.temp, 'top_k': self.top_k, 'top_p': self.top_p,
+                'max_video_length': self.max_video_length,
+                'prefilter': self.prefilter.threshold if self.prefilter else None,
+                'constrained_criteria': self.criteria_num_predict if self.constrained else None,
+                'cascade': self.cascade.confidence if self.cascade else None,
+                'campaigns': os.getenv('CAMPAIGN_LINKS', 'default') if self.campaigns else None}
 
     def transcribe_all(self):
         """
@@ -45,9 +178,12 @@ class AIToolBox:
         """
         output_dir = 'output'
         start_time = datetime.datetime.now()
+        self.metrics = Metrics('transcribe')
         print(f'[{start_time.strftime("%H:%M")}] » Starting complex speech to text...')
         # Loop over all folders in the output directory
         count = 0
+        routes = {}
+        tasks = {}  # Only used with a job queue: key -> (payload, (ad, path of its JSON file, data of that file))
         for folder in os.listdir(output_dir):
             # Skip if the folder is not a directory
             if not os.path.isdir(f'{output_dir}/{folder}/json'):
@@ -57,124 +193,312 @@ class AIToolBox:
                 continue
             # Loop over JSON files in the folder/json directory
             for json_file in os.listdir(f'{output_dir}/{folder}/json'):
-                if not json_file.endswith('.json'):
+                if not is_ads_file(json_file):
                     continue
-                with open(f'{output_dir}/{folder}/json/{json_file}', 'r') as f:
-                    ad_data = json.load(f)
+                with self.metrics.timer('transcribe.read_json'):
+                    ad_data = load_ads(f'{output_dir}/{folder}/json/{json_file}')
+                queued = time.perf_counter()
                 # Loop over all ads in the JSON file
                 for ad in tqdm(ad_data['data'], desc=f'[{folder}] » transcribing {json_file}'):
                     ad_id = ad['id']
-                    if 'video_transcription' in ad:
+                    if self.has_transcription(ad):
                         continue
-                    video_path = f'{output_dir}/{folder}/ads_videos/ad_{ad_id}_video.mp4'
-                    # Check if the video file exists and convert it to text
-                    if f'ad_{ad_id}_video.mp4' in os.listdir(f'{output_dir}/{folder}/ads_videos'):
+                    # Check if the video file (or its archived audio) exists and convert it to text
+                    video_path = media_path(f'{output_dir}/{folder}', ad_id)
+                    if video_path is not None:
                         count += 1
-                        text, language = self.transcribe(video_path)
-                        if text:
-                            ad['video_transcription'] = text
-                        if language:
-                            ad['detected_language'] = language
-                        with open(f'{output_dir}/{folder}/json/{json_file}', 'w') as w:
-                            json.dump(ad_data, w, indent=4)
+                        # The time the ad waited since its JSON file was loaded
+                        self.metrics.record('transcribe.queue_wait', time.perf_counter() - queued, ad_id)
+                        if self.queue is not None:
+                            key = f'transcribe:{ad_id}:{self.job_signature("transcribe")}'
+                            tasks[key] = ({'id': ad_id, 'video_path': video_path,
+                                           'signature': self.job_signature('transcribe')},
+                                          (ad, f'{output_dir}/{folder}/json/{json_file}', ad_data))
+                            continue
+                        with self.metrics.timer('transcribe.ad', ad_id):
+                            text, language, speech, model = self.transcribe(video_path, ad_id)
+                        routes[model] = routes.get(model, 0) + 1
+                        self.apply_transcription(ad, text, language, speech, model)
+                        with self.metrics.timer('transcribe.write_json', ad_id):
+                            dump_ads(ad_data, f'{output_dir}/{folder}/json/{json_file}')
+                        queued = time.perf_counter()
+        if tasks:
+            changed = {}
+
+            def apply(target, result):
+                ad, path, data = target
+                self.apply_transcription(ad, result['text'], result['language'], result['speech'], result['model'])
+                routes[result['model']] = routes.get(result['model'], 0) + 1
+                changed[path] = data
+
+            def save():
+                for path, data in changed.items():
+                    dump_ads(data, path)
+                changed.clear()
+
+            self.distribute('transcribe', tasks, apply, save)
         end_time = datetime.datetime.now()
-        total_time = (end_time - start_time).seconds / 60
-        print(f'[{end_time.strftime("%H:%M")}] » Finished complex speech to text within {total_time:.2f} minutes! '
+        total_time = format_duration((end_time - start_time).total_seconds())
+        print(f'[{end_time.strftime("%H:%M")}] » Finished complex speech to text within {total_time}! '
               f'({count} ads)')
+        speech = [record for record in self.metrics.records if record['stage'] == 'transcribe.vad']
+        if speech:
+            audio_seconds = sum(record['audio_seconds'] for record in speech)
+            kept = sum(record['speech_seconds'] for record in speech)
+            print(f'\t» Voice activity detection: {kept:.0f} of {audio_seconds:.0f} audio seconds sent to Whisper '
+                  f'({(1 - kept / max(audio_seconds, 1e-9)) * 100:.1f}% saved, '
+                  f'{sum(record["speech_seconds"] == 0 for record in speech)} videos without speech)')
+        if self.language_routing:
+            skipped = routes.pop(self.language_id_model, 0)
+            routed = [f'{n} ads with {m}' for m, n in routes.items() if m]
+            print(f'\t» Language routing: {", ".join(routed) or "no ads transcribed"}, {skipped} ads skipped as out '
+                  f'of scope')
+        self.metrics.report()
+
+    def apply_transcription(self, ad, text, language, speech, model):
+        """
+        Stores the result of a transcription in the ad.
+        :param ad: The ad.
+        :param text: The transcription, None if there is none.
+        :param language: The detected language, None if unknown.
+        :param speech: The seconds of speech, None if the voice activity detection is disabled.
+        :param model: The Whisper model that handled the ad, None if the video could not be decoded or transcribed.
+        """
+        if model is None:
+            return  # Nothing is recorded, so the ad is transcribed again on the next run
+        if speech is not None:
+            ad['speech_seconds'] = speech
+        if text:
+            ad['video_transcription'] = text
+        if language:
+            ad['detected_language'] = language
+        ad['transcription_model'] = self.transcription_signature(model)
+
+    def distribute(self, kind, tasks, apply, save):
+        """
+        Enqueues tasks on the job queue and applies their results as the workers finish them. The results are saved
+        and then removed from the queue, so after a crash the finished tasks are picked up instead of redone.
+        With JOB_LOCAL_WORKERS this process runs workers as well, e.g. with the in-process queue (JOB_QUEUE=memory).
+        :param kind: The kind of the tasks, 'transcribe', 'criteria' or 'label'.
+        :param tasks: A dictionary of key -> (payload, target), the target is passed to apply.
+        :param apply: The function that applies a result to its target: apply(target, result).
+        :param save: The function that writes the applied results to disk.
+        :return: Tuple of (the amount of succeeded tasks, the amount of failed tasks).
+        """
+        added = self.queue.enqueue_many(kind, [(key, payload) for key, (payload, _) in tasks.items()])
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Enqueued {added} {kind} tasks '
+              f'({len(tasks) - added} were already queued)')
+        workers = [Worker(self.queue, [kind], self, f'{kind}-local-{i}') for i in range(self.local_workers)]
+        for worker in workers:
+            worker.start()
+        outstanding = list(tasks)
+        applied = []  # Keys of which the result is applied but not saved yet
+        success, failed = 0, 0
+        last_save = time.perf_counter()
+        with tqdm(total=len(tasks), desc=f'Waiting for {kind} workers') as bar:
+            while outstanding:
+                finished = self.queue.results(outstanding)
+                if not finished:
+                    time.sleep(1)
+                    continue
+                for key, task in finished.items():
+                    if task['status'] == 'done':
+                        apply(tasks[key][1], task['result'])
+                        success += 1
+                    else:
+                        failed += 1
+                        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » {kind} task `{key}` failed: '
+                              f'{task["error"]}')
+                    applied.append(key)
+                outstanding = [key for key in outstanding if key not in finished]
+                bar.update(len(finished))
+                if not outstanding or time.perf_counter() - last_save > 30:
+                    save()
+                    self.queue.remove(applied)  # Failed tasks are removed as well, so the next run retries them
+                    applied = []
+                    last_save = time.perf_counter()
+        for worker in workers:
+            worker.stop()
+        return success, failed
+
+    def decode_audio(self, video_path, ad_id=None):
+        """
+        Extracts the first max_video_length seconds of the audio of a video as 16 kHz mono samples.
+        :param video_path: The path of the video, or of the audio extract of an archived video (see archive.py).
+        :param ad_id: The id of the ad, used to attribute the timings.
+        :return: The audio as float32 NumPy array, None if the video does not exist or has no audio.
+        """
+        from moviepy.editor import VideoFileClip
+        import whisper
+        if not os.path.exists(video_path):
+            return None
+        if video_path.endswith('.opus'):
+            with self.metrics.timer('transcribe.audio_decode', ad_id):
+                return whisper.load_audio(video_path)[:self.max_video_length * whisper.audio.SAMPLE_RATE]
+        audio_path = video_path.replace('.mp4', '.wav')
+        try:
+            with self.metrics.timer('transcribe.audio_decode', ad_id):
+                video = VideoFileClip(video_path)
+                if video.duration > self.max_video_length:
+                    video = video.subclip(0, self.max_video_length)
+                if video.audio is None:
+                    video.close()
+                    return None
+                video.audio.write_audiofile(audio_path, verbose=False, logger=None)
+                video.close()
+                return whisper.load_audio(audio_path)
+        finally:
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
 
-    def transcribe(self, video_path):
+    def detect_language(self, audio, ad_id=None):
+        """
+        Detects the spoken language in the first 30 seconds of the audio with the small language identification model.
+        :param audio: The audio as float32 NumPy array.
+        :param ad_id: The id of the ad, used to attribute the timings.
+        :return: Tuple of (the most likely language code, its probability).
+        """
+        import whisper
+        model = self.whisper(self.language_id_model)
+        with self.metrics.timer('transcribe.language_id', ad_id):
+            mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio), n_mels=model.dims.n_mels).to(model.device)
+            _, probabilities = model.detect_language(mel)
+        language = max(probabilities, key=probabilities.get)
+        return language, probabilities[language]
+
+    def transcribe(self, video_path, ad_id=None):
         """
         This method converts a video to text using the Whisper library. DO NOTE that you require to download:
         1. the ffmpeg library: https://ffmpeg.org/download.html
         2. the ffmpeg-python package: pip install ffmpeg-python
+        With VAD=true only the speech regions of the audio are transcribed and videos without speech are skipped.
+        With LANGUAGE_ROUTING=true the language is detected first: English is transcribed with the English-only model,
+        other languages with the multilingual model and languages outside TRANSCRIBE_LANGUAGES are skipped. When the
+        detection is not confident enough the multilingual model detects the language itself.
         :param video_path:
-        :return:
+        :param ad_id: The id of the ad, used to attribute the timings.
+        :return: Tuple of (text, language, seconds of speech or None if the voice activity detection is disabled,
+                 the Whisper model that handled the ad or None if the video could not be decoded or transcribed).
         """
-        audio_path = video_path.replace('.mp4', '.wav')
-        text = None
-        language = None
+        from vad import SAMPLE_RATE
+        text, language, speech, model = None, None, None, None
         try:
-            if not os.path.exists(video_path):
-                return text, language
-            # Extract audio from video
-            video = VideoFileClip(video_path)
-            if video.duration > self.max_video_length:
-                video = video.subclip(0, self.max_video_length)
-            if video.audio is None:
-                return text, language
-            video.audio.write_audiofile(audio_path, verbose=False, logger=None)
-            video.close()
-            audio = AudioSegment.from_wav(audio_path)
-            audio.export(audio_path, format='wav')
+            audio = self.decode_audio(video_path, ad_id)
+            if audio is None:
+                return text, language, speech, model
+            audio_seconds = len(audio) / SAMPLE_RATE
+            model = self.whisper_name
+            if self.vad is not None:
+                start = time.perf_counter()
+                audio, speech = self.vad.trim(audio)
+                # The seconds of a record are the duration of the stage, the length of the speech is an extra field
+                self.metrics.record('transcribe.vad', time.perf_counter() - start, ad_id, audio_seconds=audio_seconds,
+                                    speech_seconds=speech)
+                if audio is None:
+                    print(f'[{datetime.datetime.now().strftime("%H:%M")}] » No speech in `{video_path}`, skipping...')
+                    return text, language, speech, model
+            options, stage = {}, 'transcribe.whisper'
+            if self.language_routing:
+                detected, probability = self.detect_language(audio, ad_id)
+                if probability >= self.language_confidence:
+                    language = detected
+                    if self.languages and detected not in self.languages:
+                        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Language `{detected}` of '
+                              f'`{video_path}` is out of scope, skipping...')
+                        return text, language, speech, self.language_id_model
+                    options['language'] = detected  # Whisper does not have to detect the language again
+                    model = self.english_model if detected == 'en' else self.whisper_name
+                stage = f'transcribe.whisper.{model}'
             # Convert audio to text using Whisper
-            result = self.model.transcribe(audio=audio_path)
+            with self.metrics.timer(stage, ad_id, audio_seconds=len(audio) / SAMPLE_RATE):
+                result = self.whisper(model).transcribe(audio=audio, **options)
             print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Result: {result}')
             text = result['text']
             language = result['language']
             print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Converted video to text for `{video_path}`')
         except Exception as e:
             print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Error converting video to text: {e}')
-        finally:
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-
-        return text, language
+            return None, None, None, None
+        return text, language, speech, model
 
     def criteria_prompt(self, messages, ad, log=False):
         """
         This method is used to prompt the LLM for the classification task.
         :param messages: The memory for the LLM.
-        :param ad: The ad to classify of which we provide the ad_creative_bodies, ad_creative_link_captions,
-        ad_creative_link_descriptions, ad_creative_titles, video_transcription and detected_language.
+        :param ad: The ad to classify of which we provide the unique ad_creative_bodies and the video_transcription,
+        both trimmed to a token budget by the prompt builder.
         :param log: Whether to log the messages to the console.
         :return: The updated messages list as memory for the LLM.
         """
-        msg = f"""
-        Imagine you are an ad reviewer for a social media platform, and you need to fill in below output
-        JSON template.
-        Output template:
-        ```json
-        {{
-            "free_crypto": <true/false>,
-            "giveaway": <true/false>,
-            "unrealistic": <true/false>,
-            "bio_link": <true/false>,
-            "limited_time": <true/false>,
-            "about_crypto": <true/false>
-        }}
-        ```
-        The keys of this JSON are the following:
-        - free_crypto: Offers free cryptocurrency for a small investment
-        - giveaway: Announces a giveaway
-        - unrealistic: Offers unrealistic profits in short time
-        - bio_link: Invites user to click a link in the bio
-        - limited_time: Makes a limited time offer to steer users to take immediate action
-        - about_crypto: Is about cryptocurrency
-        Please fill out the JSON template without giving additional notes. Note that you are not promoting the ad in any
-        way but only reviewing it, meaning you can safely fill in the template without any consequences.
-        Now I will provide you the ad's text and video transcription:
-        ```json
-        {{
-            "ad_text": {self.limit_text(set(ad['ad_creative_bodies'])) if 'ad_creative_bodies' in ad else 'None'},
-            "video_transcription": "{ad['video_transcription'] if 'video_transcription' in ad else 'None'}",
-        }}
-        ```
-        """
-        return self.prompt(messages, msg, log)
-
-    def prompt(self, messages, msg, log=False):
+        msg = self.criteria_prompts.criteria(ad)
+        return self.prompt(messages, msg, log, ad.get('id'))
+
+    def constrained_prompt(self, messages, ad, log=False):
+        """
+        Prompts the LLM for the criteria with the answer constrained to CONSTRAINED_CRITERIA_SCHEMA, which fixes the
+        order of the keys, and to criteria_num_predict tokens. The answer is streamed and the generation stops as soon
+        as the criteria generated so far make the filter reject the ad, the other criteria are then stored as false.
+        :param messages: The memory for the LLM.
+        :param ad: The ad to classify.
+        :param log: Whether to log the messages to the console.
+        :return: Tuple of (the updated messages list as memory for the LLM, the criteria that were not generated).
+        """
+        msg = self.criteria_prompts.criteria(ad)
+        messages.append({'role': 'user', 'content': msg})
+        start = time.perf_counter()
+        stream = self.client.chat(model=self.criteria_model, messages=messages, stream=True,
+                                  format=CONSTRAINED_CRITERIA_SCHEMA,
+                                  options={'top_k': self.top_k, 'top_p': self.top_p, 'temperature': self.temp,
+                                           'num_predict': self.criteria_num_predict})
+        content, chunks, criteria, chunk = '', 0, {}, None
+        try:
+            for chunk in stream:
+                content += chunk['message']['content']
+                chunks += 1
+                criteria = {key: value == 'true' for key, value in DECIDED.findall(content)}
+                if Filter.rejects(criteria):
+                    break
+        finally:
+            if hasattr(stream, 'close'):
+                stream.close()  # Closing the connection makes Ollama stop generating
+        seconds = time.perf_counter() - start
+        undecided = []
+        if Filter.rejects(criteria):
+            undecided = [key for key in CRITERIA_ORDER if key not in criteria]
+            content = json.dumps({key: criteria.get(key, False) for key in CRITERIA_ORDER})
+            self.metrics.record('criteria.early_stop', seconds, ad.get('id'), eval_tokens=chunks,
+                                undecided=len(undecided))
+        tokens = Metrics.field(chunk, 'eval_count') if Metrics.field(chunk, 'done') else None
+        if tokens is not None:
+            # The final chunk of a finished stream has the exact token counts and durations
+            self.metrics.record_ollama('criteria.llm', chunk, seconds, ad.get('id'))
+        else:
+            # A stopped stream has no final chunk, Ollama streams about a token per chunk
+            tokens = chunks
+            self.metrics.record('criteria.llm', seconds, ad.get('id'), eval_tokens=chunks)
+        if log:
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » User: {msg}')
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » LLM: ({seconds:.2f} s, {tokens} tokens, '
+                  f'{len(undecided)} criteria undecided)\n{content}')
+        messages.append({'role': 'assistant', 'content': content})
+        return ([] if self.max_ollama_history == 0 else messages[-self.max_ollama_history:]), undecided
+
+    def prompt(self, messages, msg, log=False, ad_id=None):
         """
         This method is used to prompt the LLM for the classification task. It will use the
         messages list as memory for the LLM.
         :param messages: The memory for the LLM.
         :param msg: The message to prompt the LLM with.
         :param log: Whether to log the messages to the console.
+        :param ad_id: The id of the ad, used to attribute the timings.
         :return: The updated messages list as memory for the LLM.
         """
         start_time = datetime.datetime.now()
         messages.append({'role': 'user', 'content': msg})
+        start = time.perf_counter()
         classification = self.client.chat(model=self.criteria_model, messages=messages, stream=False,
                                           options={'top_k': self.top_k, 'top_p': self.top_p, 'temperature': self.temp})
+        self.metrics.record_ollama('criteria.llm', classification, time.perf_counter() - start, ad_id)
         full_classification = classification['message']['content']
         response_time = datetime.datetime.now()
         if log:
@@ -200,6 +524,7 @@ class AIToolBox:
         start_time = datetime.datetime.now()
         processed = 0
         success = 0
+        self.metrics = Metrics('criteria')
         print(f'[{start_time.strftime("%H:%M")}] » Starting criteria generation...')
         # Loop over all folders in the output directory
         for folder in os.listdir(output_dir):
@@ -210,11 +535,23 @@ class AIToolBox:
             print(f'[{datetime.datetime.now().strftime("%H:%M")}] » generating in folder: `{folder}`')
             # Loop over JSON files in the folder/json directory
             for json_file in os.listdir(f'{output_dir}/{folder}/{json_folder}'):
-                self.generate_criteria_json(f'{output_dir}/{folder}/{json_folder}/{json_file}', log)
+                file_success, file_processed = \
+                    self.generate_criteria_json(f'{output_dir}/{folder}/{json_folder}/{json_file}', log)
+                success += file_success
+                processed += file_processed
         end_time = datetime.datetime.now()
-        total_time = (end_time - start_time).seconds / 60
-        print(f'[{end_time.strftime("%H:%M")}] » Finished criteria generation within {total_time:.2f} minutes! '
+        total_time = format_duration((end_time - start_time).total_seconds())
+        print(f'[{end_time.strftime("%H:%M")}] » Finished criteria generation within {total_time}! '
               f'({success} / {processed} ads successfully classified)')
+        if self.constrained:
+            answers = [record for record in self.metrics.records if record['stage'] == 'criteria.llm']
+            stopped = sum(record['stage'] == 'criteria.early_stop' for record in self.metrics.records)
+            tokens = sum(record.get('eval_tokens', 0) for record in answers)
+            print(f'\t» Constrained criteria: {stopped} of {len(answers)} answers stopped early, '
+                  f'{tokens / max(len(answers), 1):.1f} generated tokens per ad')
+        self.metrics.report()
+        if isinstance(self.ollama_client, OllamaPool):
+            self.client.report()
 
     def generate_criteria_json(self, path: str, log=False):
         """
@@ -230,73 +567,141 @@ class AIToolBox:
         start_time = datetime.datetime.now()
         processed = 0
         success = 0
-        if not os.path.exists(path) or not path.endswith('.json'):
+        if not os.path.exists(path) or not is_ads_file(path):
             print(f'[{start_time.strftime("%H:%M")}] » Could not find JSON file: `{path}`')
             return success, processed
+        # Skip the file entirely if neither its content nor the parameters changed since the last complete run
+        if not self.manifest.is_stale(f'criteria:{path}', [path], self.params()):
+            return success, processed
 
         # Loop over JSON files in the folder/json directory
-        with open(path, 'r', encoding='utf-8') as f:
-            ad_data = json.load(f)
-        amount_to_update = len([ad for ad in ad_data["data"] if not self.has_criteria(ad)])
-        if amount_to_update == 0:
+        ad_data = load_ads(path)
+        todo = [ad for ad in ad_data['data'] if not self.has_criteria(ad)]
+        if len(todo) == 0:
+            self.manifest.record(f'criteria:{path}', [path], self.params())
             return success, processed
         print(f'[{start_time.strftime("%H:%M")}] » Starting criteria generation for `{path}`...'
-              f'({amount_to_update} ads to classify)')
-        # Loop over all ads in the JSON file
-        messages = []
-        for ad in ad_data['data']:
-            if self.has_criteria(ad):
-                continue
-            processed += 1
+              f'({len(todo)} ads to classify)')
+        processed = len(todo)
+        if self.queue is not None:
+            tasks = {f'criteria:{ad["id"]}:{self.job_signature("criteria")}:{Manifest.ad_hash(ad)}':
+                     ({'ad': ad, 'signature': self.job_signature('criteria')}, ad) for ad in todo}
+
+            def apply(ad, classification):
+                ad['classification'] = classification
+
+            def save():
+                dump_ads(ad_data, path)
+
+            success, _ = self.distribute('criteria', tasks, apply, save)
+        else:
+            # Loop over all ads in the JSON file
+            messages = []
+            for ad in todo:
+                classification, messages = self.criteria(ad, messages, log)
+                if classification is not None:
+                    ad['classification'] = classification
+                    success += 1
+        dump_ads(ad_data, path)
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Updated JSON file: `{path}`')
+        if success == processed:  # Failed ads have to be retried on the next run
+            self.manifest.record(f'criteria:{path}', [path], self.params())
+        end_time = datetime.datetime.now()
+        total_time = format_duration((end_time - start_time).total_seconds())
+        print(f'[{end_time.strftime("%H:%M")}] » Finished criteria generation within {total_time}! '
+              f'({success} / {processed} ads successfully classified, {self.json.stats()}, '
+              f'{self.criteria_prompts.report()})')
+        return success, processed
+
+    def criteria(self, ad, messages=None, log=False):
+        """
+        Generates the criteria of a single ad with the pre-filter, the cascade or the LLM.
+        :param ad: The ad.
+        :param messages: The memory for the LLM, a new memory if None.
+        :param log: Whether to log the messages to the console.
+        :return: Tuple of (the classification dictionary or None if the answer of the LLM could not be used,
+                 the updated messages list as memory for the LLM).
+        """
+        messages = [] if messages is None else messages
+        ad_start = time.perf_counter()
+        if self.prefilter:
+            score, _ = self.prefilter.score(ad)
+            if score < self.prefilter.threshold:
+                # Not plausibly about crypto, so we do not bother the LLM with it
+                classification = {key: False for key in CRITERIA_KEYS}
+                classification['model'] = self.criteria_signature()
+                classification['input'] = Manifest.ad_hash(ad)
+                classification['prefilter'] = score
+                return classification, messages
+        criteria = self.cascade.predict_criteria(ad) if self.cascade else None
+        if criteria is not None:
+            criteria['model'] = self.criteria_signature()
+            criteria['input'] = Manifest.ad_hash(ad)
+            criteria['source'] = 'cascade'
+            return criteria, messages
+        undecided = []
+        if self.constrained:
+            messages, undecided = self.constrained_prompt(messages, ad, log)
+        else:
             messages = self.criteria_prompt(messages, ad, log)
+        try:
             try:
-                ad['classification'] = self.try_to_json(messages[-1]['content'])
-                ad['classification']['model'] = f"m:{self.criteria_model};t:{self.temp};k:{self.top_k};p:{self.top_p}"
-                success += 1
-            except Exception as e:
-                print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Could not generate criteria for ad: {ad["id"]}'
-                      f'\n{e}\nin\n\t{messages[-1]["content"]}')
+                classification = self.try_to_json(messages[-1]['content'], CRITERIA_SCHEMA)
+            except ValueError:
+                # Only on failure we ask again, constrained to the schema, without the broken answer in memory
                 messages.pop()
-                messages.pop()  # Pop twice for prompt & response
-        with open(path, 'w', encoding='utf-8') as w:
-            json.dump(ad_data, w, indent=4)
-            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Updated JSON file: `{path}`')
-        end_time = datetime.datetime.now()
-        total_time = (end_time - start_time).seconds / 60
-        print(f'[{end_time.strftime("%H:%M")}] » Finished criteria generation within {total_time:.2f} minutes! '
-              f'({success} / {processed} ads successfully classified)')
-        return success, processed
+                messages = self.reask(messages, self.criteria_model, CRITERIA_SCHEMA)
+                classification = self.try_to_json(messages[-1]['content'], CRITERIA_SCHEMA)
+            classification['model'] = self.criteria_signature()
+            classification['input'] = Manifest.ad_hash(ad)
+            if undecided:
+                classification['undecided'] = undecided
+            self.metrics.record('criteria.ad', time.perf_counter() - ad_start, ad['id'])
+            return classification, messages
+        except Exception as e:
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Could not generate criteria for ad: {ad["id"]}'
+                  f'\n{e}\nin\n\t{messages[-1]["content"]}')
+            del messages[-2:]  # Remove the prompt & response
+            return None, messages
 
-    def try_to_json(self, msg):
+    def try_to_json(self, msg, schema=None):
         """
-        This method tries to parse a string into JSON format. If failing it will try to get the JSON part only if
-        possibly by:\n
-        1. To get the JSON part only with regex: r'{.*}'
-        2. To remove any commas that are not inside a string
+        This method extracts the first JSON object from a response of the LLM in a single pass, tolerating single
+        quotes and trailing commas, and validates it against the expected schema.
         :param msg: The message to try to parse
+        :param schema: The schema to validate against, CRITERIA_SCHEMA or LABEL_SCHEMA. None to skip validation.
         :return: The from-JSON loaded ad
+        :raises ValueError: If the message does not contain a valid JSON object.
+        """
+        return self.json.parse(msg, schema)
+
+    def reask(self, messages, model, schema):
+        """
+        This method asks the LLM the last user message again, but now constrains the output to the JSON schema using
+        the Ollama `format`. It is only used after parsing the unconstrained answer failed.
+        :param messages: The memory for the LLM, ending with the user message to ask again.
+        :param model: The model to ask.
+        :param schema: The JSON schema the answer has to follow.
+        :return: The updated messages list with the new answer.
         """
-        # Try to get the JSON part only
+        self.json.count('retries')
+        start = time.perf_counter()
+        response = self.client.chat(model=model, messages=messages, stream=False, format=schema,
+                                    options={'top_k': self.top_k, 'top_p': self.top_p, 'temperature': self.temp})
+        self.metrics.record_ollama('reask.llm', response, time.perf_counter() - start)
+        messages.append({'role': 'assistant', 'content': response['message']['content']})
         try:
-            return json.loads(msg)
-        except Exception as _:
-            # Find all JSON-like parts
-            json_parts = re.findall(r'\{.*?}', msg, re.DOTALL)
-            # Concatenate all JSON parts
-            concatenated_json = ''.join(json_parts)
-            concatenated_json = concatenated_json.replace('\\n', '').replace('\\t', '').replace("'", '"')
-            # Remove any commas that are not inside a string
-            concatenated_json = re.sub(r',\s*([}\]])', r'\1', concatenated_json)
-            concatenated_json = concatenated_json.lower()  # lower False to work with json
-            # load as JSON and replace any value to False if it is not a boolean which is true
-            concatenated_json = re.sub(r':\s*(?!true|false)\w+', ': false', concatenated_json)
-            return json.loads(concatenated_json)
-
-    def label_all(self, path='output/filtered-unique.json'):
+            self.json.extract(messages[-1]['content'])
+        except ValueError:
+            self.json.count('retry_failures')
+        return messages
+
+    def label_all(self, path='output/filtered-unique.json', concurrency=None):
         """
         This method is used to label all ads as scam or not scam. It will internally use the prompt method AFTER
         the generate_criteria method is used on the data to provide the LLM the text AND the criteria.
         :param path: The path to the JSON file with the ads to label.
+        :param concurrency: The amount of concurrent label requests, LABEL_CONCURRENCY or 1 by default.
         :return: Puts the labels in the JSON file specified at the path.
         """
         start_time = datetime.datetime.now()
@@ -304,46 +709,136 @@ class AIToolBox:
         if not os.path.exists(path) or not path.endswith('.json'):
             print(f'[{start_time.strftime("%H:%M")}] » Could not find JSON file: `{path}`')
             return
+        self.metrics = Metrics('label')
+        concurrency = int(os.getenv('LABEL_CONCURRENCY', 1)) if concurrency is None else concurrency
         print(f'[{start_time.strftime("%H:%M")}] » Starting labeling...')
         # Load the JSON file
         with open(path, 'r') as f:
             data = json.load(f)
-        for i, ad in enumerate(tqdm(data['data'], desc=f'Labeling {path}')):
-            if i % 50 == 0:
+        if not self.manifest.is_stale(f'labels:{path}', [path], self.params()):
+            print(f'[{start_time.strftime("%H:%M")}] » All ads in `{path}` are already labeled, skipping...')
+            return data
+        failed = 0
+        todo = [ad for ad in data['data'] if not self.has_label(ad)]
+        followers = {}
+        if self.campaigns and todo:
+            from campaigns import Campaigns
+            campaigns = Campaigns(data['data'])
+            campaigns.report()
+            by_id = {ad['id']: ad for ad in data['data']}
+            followers = {representative: (by_id[representative], ads)
+                         for representative, ads in campaigns.followers(todo).items()
+                         if representative not in campaigns.conflicts}
+            # A representative needs a label of its own, not one that was copied from an earlier representative, and
+            # the ads of a campaign with conflicting labels are all labeled on their own
+            todo = [ad for ad, _ in followers.values() if not self.has_label(ad) or
+                    ad['classification'].get('label_source') == 'campaign'] + \
+                [by_id[ad_id] for representative in campaigns.conflicts for ad_id in campaigns.members[representative]
+                 if not self.has_label(by_id[ad_id]) or
+                 by_id[ad_id]['classification'].get('label_source') == 'campaign']
+        if self.queue is not None:
+            tasks = {f'label:{ad["id"]}:{self.job_signature("label")}:{Manifest.ad_hash(ad)}':
+                     ({'ad': ad, 'signature': self.job_signature('label')}, ad) for ad in todo}
+
+            def apply(ad, label):
+                ad['classification'].update(label)
+
+            def save():
                 with open(path, 'w') as w:
                     json.dump(data, w, indent=4)
-            if self.has_label(ad):
-                continue
-            try:
-                label = self.generate_label(ad)
-                ad['classification']['scam'] = label['scam']
-                ad['classification']['reason'] = label['reason']
-                ad['classification']['confidence'] = label['confidence']
-                ad['classification']['classifier'] = f"m:{self.classifier_model};t:{self.temp};k:{self.top_k};p:{self.top_p}"
-            except Exception as e:
-                print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Could not label ad: {e}')
+
+            _, failed = self.distribute('label', tasks, apply, save)
+        else:
+            with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+                futures = {executor.submit(self.label, ad): ad for ad in todo}
+                for i, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc=f'Labeling {path}')):
+                    try:
+                        # Applied here instead of in the workers, so the JSON is never written while an ad changes
+                        futures[future]['classification'].update(future.result())
+                    except Exception as e:
+                        failed += 1
+                        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Could not label ad: {e}')
+                    if i % 50 == 49:
+                        with open(path, 'w') as w:
+                            json.dump(data, w, indent=4)
+        if followers:
+            copied = sum(self.propagate(representative, ads) for representative, ads in followers.values())
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Labeled {len(todo)} campaign representatives '
+                  f'and copied their labels to {copied} ads')
         with open(path, 'w') as w:
             json.dump(data, w, indent=4)
             print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Updated JSON file: `{path}`')
+        if failed == 0:
+            self.manifest.record(f'labels:{path}', [path], self.params())
         end_time = datetime.datetime.now()
-        total_time = (end_time - start_time).seconds / 60
-        print(f'[{end_time.strftime("%H:%M")}] » Finished labeling within {total_time:.2f} minutes!')
+        total_time = format_duration((end_time - start_time).total_seconds())
+        print(f'[{end_time.strftime("%H:%M")}] » Finished labeling within {total_time}! ({self.json.stats()}, '
+              f'{self.label_prompts.report()})')
+        self.metrics.report()
+        if isinstance(self.ollama_client, OllamaPool):
+            self.client.report()
         return data
 
+    def label(self, ad):
+        """
+        Labels a single ad with the cascade or the LLM.
+        :param ad: The ad to label.
+        :return: The label fields to store in the 'classification' dictionary of the ad.
+        """
+        classification = ad.get('classification', {})
+        if 'undecided' in classification and Filter.rejects(classification):
+            # The criteria generation already stopped because the ad is not a crypto giveaway, so no LLM is needed
+            return {'scam': False, 'reason': 'The criteria rule out a crypto giveaway', 'confidence': 'Very unlikely',
+                    'label_source': 'criteria', 'classifier': self.classifier_signature(),
+                    'label_input': Manifest.ad_hash(ad)}
+        label = self.cascade.predict_label(ad) if self.cascade else None
+        source = 'cascade' if label is not None else 'llm'
+        with self.metrics.timer('label.ad', ad['id']):
+            label = label if label is not None else self.generate_label(ad)
+        return {'scam': label['scam'], 'reason': label['reason'], 'confidence': label['confidence'],
+                'label_source': source, 'classifier': self.classifier_signature(), 'label_input': Manifest.ad_hash(ad)}
+
+    def propagate(self, representative, ads):
+        """
+        Copies the label of the representative of a campaign to the other ads of the campaign.
+        :param representative: The labeled representative.
+        :param ads: The ads of the campaign that need a label.
+        :return: The amount of ads that received the label, 0 if the representative could not be labeled.
+        """
+        if not self.has_label(representative):
+            return 0
+        label = {key: representative['classification'][key] for key in ['scam', 'reason', 'confidence', 'classifier']}
+        copied = 0
+        for ad in ads:
+            if ad is representative:
+                continue
+            ad.setdefault('classification', {}).update(label, label_source='campaign', campaign=representative['id'],
+                                                       label_input=Manifest.ad_hash(ad))
+            copied += 1
+        return copied
+
     def has_criteria(self, ad):
         """
         This method checks if an ad has ALL the criteria in the 'classification' dictionary.
         It also checks if the 'model' key is present in the 'classification' dictionary.
         And if the 'model' key is present, it checks if the model is the same as the current model parameters.
         :param ad: The ad to check.
+        When the 'input' hash is present, the text of the ad must not have changed since the criteria were generated.
+        Criteria that were set by the pre-filter are only valid as long as the pre-filter would still reject the ad,
+        criteria set by the cascade only as long as the cascade is enabled and criteria of which the generation stopped
+        early only as long as the constrained criteria mode is enabled.
         :return: True if the ad has all the criteria: about_crypto, free_crypto, giveaway, unrealistic, bio_link, and
         limited_time.
         """
         return 'classification' in ad and all(key in ad['classification'] for key in
                                               ['about_crypto', 'free_crypto', 'giveaway', 'unrealistic', 'bio_link',
                                                'limited_time']) and \
-               'model' in ad['classification'] and ad['classification']['model'] == \
-               f"m:{self.criteria_model};t:{self.temp};k:{self.top_k};p:{self.top_p}"
+               ad['classification'].get('model') == self.criteria_signature() and \
+               ad['classification'].get('input', Manifest.ad_hash(ad)) == Manifest.ad_hash(ad) and \
+               ('prefilter' not in ad['classification'] or
+                (self.prefilter is not None and ad['classification']['prefilter'] < self.prefilter.threshold)) and \
+               (ad['classification'].get('source') != 'cascade' or self.cascade is not None) and \
+               ('undecided' not in ad['classification'] or self.constrained)
 
     def has_label(self, ad):
         """
@@ -351,11 +846,31 @@ class AIToolBox:
         It also checks if the 'model' key is present in the 'classification' dictionary.
         And if the 'model' key is present, it checks if the model is the same as the current model parameters.
         :param ad: The ad to check.
+        When the 'label_input' hash is present, the text of the ad must not have changed since it was labeled.
+        Labels copied from the representative of a campaign are only valid as long as campaigns are used, labels
+        derived from early stopped criteria only as long as those criteria are kept.
         :return: True if the ad has a 'scam' label in the 'classification' dictionary.
         """
         return 'classification' in ad and 'scam' in ad['classification'] and \
-                'model' in ad['classification'] and ad['classification']['classifier'] == \
-                f"m:{self.classifier_model};t:{self.temp};k:{self.top_k};p:{self.top_p};"
+                ad['classification'].get('classifier') == self.classifier_signature() and \
+                ad['classification'].get('label_input', Manifest.ad_hash(ad)) == Manifest.ad_hash(ad) and \
+                (ad['classification'].get('label_source') != 'cascade' or self.cascade is not None) and \
+                (ad['classification'].get('label_source') != 'campaign' or self.campaigns) and \
+                (ad['classification'].get('label_source') != 'criteria' or 'undecided' in ad['classification'])
+
+    def has_transcription(self, ad):
+        """
+        This method checks if an ad has a video transcription made with the current transcription parameters.
+        Transcriptions without a 'transcription_model' were made before it was tracked and are kept as is.
+        Videos in which the voice activity detection found no speech do not have to be transcribed either, nor do
+        videos of which the language detection found a language outside TRANSCRIBE_LANGUAGES.
+        :param ad: The ad to check.
+        :return: True if the ad does not have to be transcribed (again).
+        """
+        out_of_scope = bool(self.languages) and ad.get('detected_language') not in self.languages and \
+            ad.get('transcription_model') == self.transcription_signature(self.language_id_model)
+        return ('video_transcription' in ad or ad.get('speech_seconds') == 0 or out_of_scope) and \
+            ad.get('transcription_model', self.transcription_signature()) in self.transcription_signatures()
 
     def limit_text(self, text_set, limit=4000):
         """
@@ -383,39 +898,21 @@ class AIToolBox:
         :param ad: The ad to generate a label for.
         :return: The label as JSON: {"scam": <true/false>}
         """
-        template = '''{
-            "scam": <true/false>,
-            "reason": "",
-            "confidence": ""
-        }'''
-        prompt = f"""
-        Please classify whether the ad is a "crypto scam" (true if scam, false if not scam) 
-        based on the following information:
-        {{
-            "ad_creative_bodies": {self.limit_text(set(ad['ad_creative_bodies']), 3000) if 'ad_creative_bodies' in ad else 'None'},
-            "video_transcription": "{self.limit_text(ad['video_transcription'], 2000) if 'video_transcription' in ad else 'None'}"
-        }}
-        Note that we consider something a "crypto scam" only if it is a scam related to cryptocurrency. 
-        Trying to take anything other than cryptocurrency is not a crypto scam.
-        Something like "Claim your FREE <amount> <crypto> now!" is a scam as 'claiming' implies getting it for free
-        but "Join our community to learn more about <crypto>!" is not. Even though
-        the latter might take your crypto or offers unrealistic profits after joining the community.
-        So be sure you do NOT label ads as scam when:
-        - They try to teach you about cryptocurrency
-        - They offer you to join a community
-        - They want to share information about cryptocurrency
-        - They explain how they did grow their crypto
-        - They offer you techniques or ways to grow your crypto
-        Please provide a very short reason for the label as well as a confidence score which is either:
-        - Very unlikely: meaning the ad is very unlikely a scam
-        - Unlikely: meaning the ad is unlikely a scam
-        - Unsure: meaning it would be a guess to say if it is a scam
-        - Likely: meaning the ad is likely a scam
-        - Very likely: meaning the ad is very likely a scam
-        Use the following template to fill in the label:
-        {template}
-        """
-        return self.try_to_json(
-            self.client.generate(model=self.classifier_model, prompt=prompt, format='json',
-                                 options={'temperature': self.temp, 'top_k': self.top_k, 'top_p': self.top_p})['response'])
+        prompt = self.label_prompts.label(ad)
+        start = time.perf_counter()
+        response = self.client.generate(model=self.classifier_model, prompt=prompt, format='json',
+                                        options={'temperature': self.temp, 'top_k': self.top_k, 'top_p': self.top_p})
+        self.metrics.record_ollama('label.llm', response, time.perf_counter() - start, ad.get('id'))
+        try:
+            return self.try_to_json(response['response'], LABEL_SCHEMA)
+        except ValueError:
+            self.json.count('retries')
+            response = self.client.generate(model=self.classifier_model, prompt=prompt, format=LABEL_SCHEMA,
+                                            options={'temperature': self.temp, 'top_k': self.top_k,
+                                                     'top_p': self.top_p})
+            try:
+                return self.try_to_json(response['response'], LABEL_SCHEMA)
+            except ValueError:
+                self.json.count('retry_failures')
+                raise
 
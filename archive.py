@@ -0,0 +1,262 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the archive mode of the collected data. The JSON files of the ads are stored as zstd
+              compressed JSONL (one ad per line) instead of pretty-printed JSON and after transcription the videos are
+              replaced by a 16 kHz mono Opus extract of their audio, or dropped, depending on ARCHIVE_VIDEOS. The
+              readers of the pipeline use load_ads / dump_ads and media_path, so they work on both formats. Run
+              `python archive.py` to archive the output folder and report the bytes saved and the read throughput.
+              zstd requires the zstandard package (pip install zstandard) and the audio extract requires ffmpeg.
+@date: 19-10-2026
+"""
+import datetime
+import json
+import os
+import subprocess
+import time
+
+JSONL_SUFFIX = '.jsonl.zst'
+VIDEO_POLICIES = ('keep', 'audio', 'drop')
+
+
+def enabled():
+    """
+    :return: Whether new files are written in the archive format (ARCHIVE=true).
+    """
+    return os.getenv('ARCHIVE', 'false').lower() == 'true'
+
+
+def zstd():
+    """
+    Imports the zstandard package only when a compressed file is read or written.
+    """
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError('Reading and writing .jsonl.zst files requires the zstandard package: '
+                          'pip install zstandard') from e
+    return zstandard
+
+
+def is_ads_file(name):
+    """
+    :return: Whether a file name is a JSON file of ads, in either format.
+    """
+    return name.endswith('.json') or name.endswith(JSONL_SUFFIX)
+
+
+def archived_path(path):
+    """
+    :return: The path of the compressed JSONL variant of a JSON file, e.g. output/filtered.jsonl.zst.
+    """
+    return path[:-len('.json')] + JSONL_SUFFIX if path.endswith('.json') else path
+
+
+def resolve(path):
+    """
+    Finds the file to read for a JSON path: the compressed variant if it exists and archive mode is on or the JSON file
+    does not exist.
+    :param path: The path of the JSON file.
+    :return: The path to read.
+    """
+    archived = archived_path(path)
+    if archived != path and os.path.exists(archived) and (enabled() or not os.path.exists(path)):
+        return archived
+    return path
+
+
+def output_path(path):
+    """
+    :return: The path to write a JSON file of ads to, the compressed variant in archive mode.
+    """
+    return archived_path(path) if enabled() else path
+
+
+def read_bytes(path):
+    """
+    :return: The content of a file of ads, decompressed if it is a compressed JSONL file.
+    """
+    with open(path, 'rb') as f:
+        if path.endswith(JSONL_SUFFIX):
+            return zstd().ZstdDecompressor().stream_reader(f).read()
+        return f.read()
+
+
+def load_ads(path):
+    """
+    Reads a JSON file of ads ({"data": [ad, ...]}) or a compressed JSONL file of ads.
+    :param path: The path of the file.
+    :return: The data as {"data": [ad, ...]}, like json.load on the JSON file.
+    """
+    if not path.endswith(JSONL_SUFFIX):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'data': [json.loads(line) for line in read_bytes(path).splitlines() if line.strip()]}
+
+
+def dump_ads(data, path, level=None):
+    """
+    Writes the ads in the format of the path, compressed JSONL files are replaced atomically.
+    :param data: The data as {"data": [ad, ...]}.
+    :param path: The path of the file.
+    :param level: The zstd level, ARCHIVE_LEVEL or 10 by default.
+    """
+    if not path.endswith(JSONL_SUFFIX):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4)
+        return
+    level = int(os.getenv('ARCHIVE_LEVEL', 10)) if level is None else level
+    compressor = zstd().ZstdCompressor(level=level, threads=-1)
+    with open(f'{path}.tmp', 'wb') as f:
+        with compressor.stream_writer(f, closefd=False) as writer:
+            for ad in data['data']:
+                writer.write(json.dumps(ad, ensure_ascii=False).encode('utf-8') + b'\n')
+    os.replace(f'{path}.tmp', path)
+
+
+def media_path(folder, ad_id):
+    """
+    Finds the media of an ad: the video, or the audio extract once the video is archived.
+    :param folder: The folder of the search term, e.g. output/ads_crypto.
+    :param ad_id: The id of the ad.
+    :return: The path of the video or audio, None if the ad has no media (anymore).
+    """
+    for path in (f'{folder}/ads_videos/ad_{ad_id}_video.mp4', f'{folder}/ads_videos/ad_{ad_id}_audio.opus'):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class Archiver:
+    """
+    This class converts the output folder to the archive format. JSON files become compressed JSONL files once the
+    round trip is verified, videos of transcribed ads are converted or dropped according to the retention policy.
+    Videos of ads that do not have to be transcribed anymore are the only ones that are touched.
+    """
+
+    def __init__(self, output_dir='output', videos=None, transcribed=None):
+        """
+        :param output_dir: The output folder of the pipeline.
+        :param videos: The retention policy of transcribed videos: 'keep', 'audio' (replace them by an Opus extract)
+                       or 'drop', ARCHIVE_VIDEOS or 'audio' by default.
+        :param transcribed: The function that tells whether an ad does not have to be transcribed (again),
+                            AIToolBox.has_transcription by default.
+        """
+        self.output_dir = output_dir
+        self.videos = (os.getenv('ARCHIVE_VIDEOS', 'audio') if videos is None else videos).lower()
+        if self.videos not in VIDEO_POLICIES:
+            raise ValueError(f'ARCHIVE_VIDEOS must be one of {", ".join(VIDEO_POLICIES)}, not `{self.videos}`')
+        if transcribed is None and self.videos != 'keep':
+            from ai import AIToolBox  # Only needed when videos are archived
+            transcribed = AIToolBox().has_transcription
+        self.transcribed = transcribed
+        self.bitrate = os.getenv('ARCHIVE_AUDIO_BITRATE', '24k')
+        self.totals = {kind: {'files': 0, 'before': 0, 'after': 0} for kind in ('json', 'video')}
+
+    def count(self, kind, before, after):
+        """
+        Adds the sizes of an archived file to the totals of its kind.
+        """
+        self.totals[kind]['files'] += 1
+        self.totals[kind]['before'] += before
+        self.totals[kind]['after'] += after
+
+    def folders(self):
+        """
+        :return: The folders of the search terms.
+        """
+        return [f'{self.output_dir}/{folder}' for folder in sorted(os.listdir(self.output_dir))
+                if os.path.isdir(f'{self.output_dir}/{folder}/json')]
+
+    def archive_json(self, path):
+        """
+        Converts a JSON file of ads into a compressed JSONL file and removes the JSON file.
+        :param path: The path of the JSON file.
+        :return: The ads of the file.
+        """
+        data = load_ads(path)
+        target = archived_path(path)
+        dump_ads(data, target)
+        if len(load_ads(target)['data']) != len(data['data']):
+            os.remove(target)
+            raise ValueError(f'The archive of `{path}` does not contain all ads, the JSON file is kept')
+        self.count('json', os.path.getsize(path), os.path.getsize(target))
+        os.remove(path)
+        return data['data']
+
+    def archive_video(self, folder, ad):
+        """
+        Applies the retention policy to the video of an ad that does not have to be transcribed (again): it has a
+        transcription, the voice activity detection found no speech or its language is out of scope.
+        :param folder: The folder of the search term.
+        :param ad: The ad.
+        """
+        video = f'{folder}/ads_videos/ad_{ad["id"]}_video.mp4'
+        if self.videos == 'keep' or not os.path.exists(video) or not self.transcribed(ad):
+            return
+        before, after = os.path.getsize(video), 0
+        if self.videos == 'audio':
+            audio = f'{folder}/ads_videos/ad_{ad["id"]}_audio.opus'
+            result = subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', video, '-vn', '-ac', '1', '-ar',
+                                     '16000', '-c:a', 'libopus', '-b:a', self.bitrate, audio], capture_output=True)
+            if result.returncode != 0:
+                if os.path.exists(audio):
+                    os.remove(audio)
+                # Videos without an audio stream have nothing worth keeping for the transcription
+                if b'does not contain any stream' not in result.stderr:
+                    print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Could not extract the audio of `{video}`: '
+                          f'{result.stderr.decode("utf-8", "replace").strip()}')
+                    return
+            else:
+                after = os.path.getsize(audio)
+        os.remove(video)
+        self.count('video', before, after)
+
+    def run(self):
+        """
+        Archives every search term folder and prints the report.
+        :return: The report, see report.
+        """
+        start_time = datetime.datetime.now()
+        print(f'[{start_time.strftime("%H:%M")}] » Archiving `{self.output_dir}` (videos: {self.videos})...')
+        for folder in self.folders():
+            for name in sorted(os.listdir(f'{folder}/json')):
+                path = f'{folder}/json/{name}'
+                ads = self.archive_json(path) if name.endswith('.json') else \
+                    load_ads(path)['data'] if name.endswith(JSONL_SUFFIX) else []
+                if os.path.isdir(f'{folder}/ads_videos'):
+                    for ad in ads:
+                        self.archive_video(folder, ad)
+        return self.report()
+
+    def throughput(self):
+        """
+        Reads all archived JSONL files of the ads once.
+        :return: Tuple of (ads, decompressed bytes, seconds).
+        """
+        ads, size, start = 0, 0, time.perf_counter()
+        for folder in self.folders():
+            for name in os.listdir(f'{folder}/json'):
+                if name.endswith(JSONL_SUFFIX):
+                    content = read_bytes(f'{folder}/json/{name}')
+                    ads += sum(1 for line in content.splitlines() if line.strip() and json.loads(line))
+                    size += len(content)
+        return ads, size, time.perf_counter() - start
+
+    def report(self):
+        """
+        Prints the bytes saved per kind of file and the read throughput of the archive.
+        :return: A dictionary with the totals per kind and the read throughput.
+        """
+        ads, size, seconds = self.throughput()
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Archive report:')
+        for kind, total in self.totals.items():
+            saved = total['before'] - total['after']
+            print(f'\t» {kind}: {total["files"]} files, {total["before"] / 1e6:.1f} MB -> {total["after"] / 1e6:.1f} '
+                  f'MB ({saved / 1e6:.1f} MB saved, {saved / max(total["before"], 1) * 100:.1f}%)')
+        print(f'\t» Reading the archived ads: {ads} ads, {size / 1e6:.1f} MB decompressed within {seconds:.2f} seconds '
+              f'({size / 1e6 / max(seconds, 1e-9):.1f} MB/s, {ads / max(seconds, 1e-9):.0f} ads/s)')
+        return {**self.totals, 'read': {'ads': ads, 'bytes': size, 'seconds': seconds}}
+
+
+if __name__ == '__main__':
+    Archiver().run()
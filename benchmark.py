@@ -0,0 +1,591 @@
+"""
+@author: Luuk Kablan
+@description: This file contains a reproducible benchmark harness for the pipeline. It generates a synthetic ad corpus
+              shaped like the Ad Library FIELDS schema, serves a fake Ollama HTTP API with a configurable latency and
+              token throughput and runs the stages in a temporary directory, so results can be compared across commits
+              on machines without a GPU. Per stage it reports the throughput, peak RSS and bytes read and written.
+              Usage: python benchmark.py --ads 10000 --latency 0.01 --stages criteria,filter,unique,label,stats
+              The fake LLM reads 20000 and generates 1000 tokens per second by default, so the default run of 1k ads
+              takes about a minute. --prefill-tps 2000 --eval-tps 50 is closer to a local GPU, but then the criteria
+              stage alone takes over 10 minutes for 1k ads.
+              The startup time of main.py is measured with: python benchmark.py --startup
+              The Ollama endpoint pool is measured against three fake hosts with: python benchmark.py --pool
+              Constrained and unconstrained criteria are compared with: python benchmark.py --constrained
+@date: 19-10-2026
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SEARCH_TERMS = ['crypto', 'bitcoin', 'ethereum', 'scam', 'giveaway', 'profit', 'invest', 'airdrop', 'elon', 'musk']
+COUNTRIES = ['US', 'CA', 'GB', 'DE', 'FR', 'NL', 'ES', 'IT', 'PL', 'BR', 'IN', 'AU']
+LANGUAGES = ['en', 'de', 'fr', 'nl', 'es', 'it', 'pt', 'pl']
+AGE_RANGES = ['13-17', '18-24', '25-34', '35-44', '45-54', '55-64', '65+']
+SCAM_BODIES = [
+    'Claim your FREE {amount} {coin} now! Only today, link in bio.',
+    'Elon Musk is giving away {amount} {coin} to celebrate. Send 0.1 {coin} and receive {amount} back!',
+    'Last chance for the presale! Join the giveaway and get a 5000x return at listing.',
+]
+OTHER_BODIES = [
+    'Learn how {coin} works in our free online course about blockchain technology.',
+    'Join our community to learn more about investing in {coin} safely.',
+    'Summer sale! 20% off all running shoes this week only.',
+    'Win a year of free fitness in our gym giveaway, register at the front desk.',
+]
+COINS = ['BTC', 'ETH', 'bitcoin', 'ethereum', 'SOL', 'USDT']
+STAGES = ['criteria', 'filter', 'unique', 'label', 'stats']
+
+
+def estimate_tokens(text):
+    """
+    :return: A rough token count of a text (4 characters per token), used by the fake Ollama server.
+    """
+    return max(1, len(text) // 4)
+
+
+class SyntheticCorpus:
+    """
+    This class generates deterministic synthetic ads with all fields of the Ad Library FIELDS schema.
+    """
+
+    def __init__(self, seed=42, scam_fraction=0.2):
+        self.random = random.Random(seed)
+        self.scam_fraction = scam_fraction
+
+    def ad(self, index, term):
+        """
+        Generates a single ad.
+        :param index: The index of the ad, used for its id.
+        :param term: The search term the ad was collected with.
+        :return: The ad as dictionary.
+        """
+        r = self.random
+        scam = r.random() < self.scam_fraction
+        template = r.choice(SCAM_BODIES if scam else OTHER_BODIES)
+        body = template.format(amount=r.choice([100, 500, 1000, 5000]), coin=r.choice(COINS))
+        start = datetime.date(2024, 5, 1) + datetime.timedelta(days=r.randint(0, 180))
+        page_id = str(100000000000000 + r.randint(0, 5000))
+        countries = r.sample(COUNTRIES, r.randint(1, 3))
+        ages = sorted(r.sample(range(18, 66), 2))
+        ad = {
+            'id': str(1000000000000000 + index),
+            'ad_creation_time': start.isoformat(),
+            'ad_creative_bodies': [body] * r.randint(1, 3),
+            'ad_creative_link_captions': [r.choice(['linktr.ee', 'example.com', f'page{page_id[-4:]}.com'])],
+            'ad_creative_link_descriptions': [body[:40]],
+            'ad_creative_link_titles': [body[:25]],
+            'ad_delivery_start_time': start.isoformat(),
+            'ad_snapshot_url': f'https://www.facebook.com/ads/archive/render_ad/?id={1000000000000000 + index}',
+            'age_country_gender_reach_breakdown': [
+                {'country': country, 'age_gender_breakdowns': [
+                    {'age_range': age_range, 'male': r.randint(0, 5000), 'female': r.randint(0, 5000),
+                     'unknown': r.randint(0, 50)} for age_range in r.sample(AGE_RANGES, r.randint(1, 5))]}
+                for country in countries],
+            'beneficiary_payers': [{'payer': f'Payer {page_id[-3:]}', 'beneficiary': f'Payer {page_id[-3:]}',
+                                    'current': True}],
+            'br_total_reach': r.randint(0, 100000),
+            'bylines': f'Payer {page_id[-3:]}',
+            'currency': 'EUR',
+            'delivery_region': [],
+            'demographic_distribution': [{'percentage': 0.5, 'age': age_range, 'gender': 'male'}
+                                         for age_range in AGE_RANGES],
+            'estimated_audience_size': {'lower_bound': 1000, 'upper_bound': 5000},
+            'eu_total_reach': r.randint(0, 100000),
+            'impressions': {'lower_bound': 1000, 'upper_bound': 5000},
+            'languages': [r.choice(LANGUAGES)],
+            'page_id': page_id,
+            'page_name': f'Page {page_id[-4:]}',
+            'publisher_platforms': ['facebook', 'instagram'],
+            'spend': {'lower_bound': 0, 'upper_bound': 100},
+            'target_ages': [str(ages[0]), str(ages[1])],
+            'target_gender': r.choice(['All', 'Male', 'Female']),
+            'target_locations': [{'name': country, 'num_obfuscated': 0, 'type': 'countries', 'excluded': False}
+                                 for country in countries],
+        }
+        if r.random() < 0.9:
+            ad['ad_delivery_stop_time'] = (start + datetime.timedelta(days=r.randint(1, 400))).isoformat()
+        if r.random() < 0.3:
+            ad['video_transcription'] = ' '.join([body] * r.randint(1, 10))
+            ad['detected_language'] = 'en'
+        return ad
+
+    def write(self, directory, amount, per_file=5000):
+        """
+        Writes the corpus as output/ads_<term>/json/<n>.json files like the Collector does.
+        :param directory: The directory to write the output folder in.
+        :param amount: The total amount of ads.
+        :param per_file: The maximum amount of ads per JSON file.
+        :return: The paths of the written files.
+        """
+        paths = []
+        per_term = max(1, amount // len(SEARCH_TERMS))
+        index = 0
+        for t, term in enumerate(SEARCH_TERMS):
+            count = per_term if t < len(SEARCH_TERMS) - 1 else amount - index
+            os.makedirs(f'{directory}/output/ads_{term}/json', exist_ok=True)
+            for chunk in range(0, count, per_file):
+                ads = [self.ad(index + i, term) for i in range(min(per_file, count - chunk))]
+                index += len(ads)
+                path = f'{directory}/output/ads_{term}/json/{term}_{chunk // per_file}.json'
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump({'data': ads}, f)
+                paths.append(path)
+        return paths
+
+
+class FakeOllamaServer:
+    """
+    This class serves the parts of the Ollama HTTP API the pipeline uses (/api/chat, /api/generate, /api/embed and
+    /api/tags). Responses are deterministic and take base latency + prompt tokens / prefill speed + eval tokens /
+    eval speed seconds, so the timings of the pipeline are realistic without a GPU.
+    """
+
+    def __init__(self, latency=0.0, prefill_tps=20000.0, eval_tps=1000.0, models=None, fail_rate=0.0, port=0):
+        self.latency = latency
+        self.prefill_tps = prefill_tps
+        self.eval_tps = eval_tps
+        self.models = models
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """
+        :return: The base URL of the server, to be used as OLLAMA_HOST.
+        """
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        """
+        Starts serving in a background thread.
+        :return: The server itself, so it can be used as `server = FakeOllamaServer().start()`.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and releases the port.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def answer(prompt, body):
+        """
+        Generates a deterministic answer from the hash of the prompt: criteria for chat requests and a label for
+        generate requests. About 60% of the ads is about crypto and 20% is a scam, independent of the prompt format.
+        The criteria follow the order of the keys of the format, if the request has a JSON schema as format.
+        :param prompt: The text of the prompt.
+        :param body: The request body.
+        :return: The content of the answer.
+        """
+        digest = int(hashlib.sha1(prompt.encode('utf-8')).hexdigest(), 16)
+        about_crypto, scam = digest % 10 < 6, digest % 10 < 2
+        if 'messages' in body:
+            criteria = {'free_crypto': scam, 'giveaway': scam or bool(digest & 16), 'unrealistic': bool(digest & 32),
+                        'bio_link': bool(digest & 64), 'limited_time': bool(digest & 128), 'about_crypto': about_crypto}
+            schema = body.get('format')
+            if isinstance(schema, dict):
+                criteria = {key: criteria.get(key, False) for key in schema.get('properties', criteria)}
+            return json.dumps(criteria)
+        return json.dumps({'scam': scam, 'reason': 'Synthetic label',
+                           'confidence': 'Very likely' if scam else 'Very unlikely'})
+
+    def handler(self):
+        """
+        :return: The request handler class bound to this server.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def stream(self, payload, content, key, seconds):
+                # Ollama streams newline delimited JSON, a chunk per generated token and a final chunk with the counts
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+                try:
+                    for piece in pieces:
+                        time.sleep(seconds / len(pieces))
+                        chunk = {'model': payload['model'], 'created_at': payload['created_at'], 'done': False}
+                        chunk.update({'message': {'role': 'assistant', 'content': piece}} if key == 'message'
+                                     else {'response': piece})
+                        self.wfile.write(json.dumps(chunk).encode('utf-8') + b'\n')
+                        self.wfile.flush()
+                    payload.update({'message': {'role': 'assistant', 'content': ''}} if key == 'message'
+                                   else {'response': ''})
+                    self.wfile.write(json.dumps(payload).encode('utf-8') + b'\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client stopped the generation early
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    self.send(200, {'models': [{'name': model, 'model': model} for model in server.models or []]})
+                else:
+                    self.send(200, {'version': '0.0.0-fake'})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                model = body.get('model', '')
+                with server.lock:
+                    server.requests += 1
+                    fail = server.random.random() < server.fail_rate
+                if fail:
+                    return self.send(500, {'error': 'synthetic failure'})
+                if server.models is not None and model not in server.models:
+                    return self.send(404, {'error': f'model "{model}" not found, try pulling it first'})
+                if self.path == '/api/embed':
+                    inputs = body.get('input', [])
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    time.sleep(server.latency)
+                    embeddings = [[((int(hashlib.sha1(f'{text}{i}'.encode('utf-8')).hexdigest(), 16) % 2000) - 1000)
+                                   / 1000 for i in range(32)] for text in inputs]
+                    return self.send(200, {'model': model, 'embeddings': embeddings})
+                if self.path == '/api/chat':
+                    prompt = '\n'.join(message.get('content', '') for message in body.get('messages', []))
+                elif self.path == '/api/generate':
+                    prompt = body.get('prompt', '')
+                else:
+                    return self.send(404, {'error': f'unknown endpoint {self.path}'})
+                content = server.answer(prompt, body)
+                prompt_tokens, eval_tokens = estimate_tokens(prompt), estimate_tokens(content)
+                prefill, evaluation = prompt_tokens / server.prefill_tps, eval_tokens / server.eval_tps
+                time.sleep(server.latency + prefill + (0 if body.get('stream') else evaluation))
+                payload = {
+                    'model': model, 'created_at': datetime.datetime.utcnow().isoformat() + 'Z', 'done': True,
+                    'done_reason': 'stop', 'total_duration': int((server.latency + prefill + evaluation) * 1e9),
+                    'load_duration': int(server.latency * 1e9), 'prompt_eval_count': prompt_tokens,
+                    'prompt_eval_duration': int(prefill * 1e9), 'eval_count': eval_tokens,
+                    'eval_duration': int(evaluation * 1e9),
+                }
+                key = 'message' if self.path == '/api/chat' else 'response'
+                if body.get('stream'):
+                    return self.stream(payload, content, key, evaluation)
+                payload[key] = {'role': 'assistant', 'content': content} if key == 'message' else content
+                self.send(200, payload)
+
+        return Handler
+
+
+def io_counters():
+    """
+    :return: Tuple of (bytes read, bytes written) of this process, (0, 0) if the platform does not report them.
+             These include reads served from the page cache, as the benchmark corpus is small enough to stay cached.
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def run_stage(stage, directory, results):
+    """
+    Runs a single stage inside a child process, so the peak RSS and I/O are measured per stage.
+    :param stage: The name of the stage.
+    :param directory: The working directory with the synthetic output folder.
+    :param results: A multiprocessing queue to put the measurement in.
+    """
+    os.chdir(directory)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    extra = {}
+    read_before, write_before = io_counters()
+    start = time.perf_counter()
+    if stage == 'criteria':
+        from ai import AIToolBox
+        classifier = AIToolBox()
+        classifier.generate_criteria()
+        ads = classifier.metrics.summary().get('criteria.ad', {}).get('count', 0)
+        answers = [record for record in classifier.metrics.records if record['stage'] == 'criteria.llm']
+        extra = {'eval_tokens_per_ad': sum(record.get('eval_tokens', 0) for record in answers) / max(len(answers), 1),
+                 'early_stops': sum(record['stage'] == 'criteria.early_stop' for record in classifier.metrics.records)}
+    elif stage == 'filter':
+        from filter import Filter
+        crypto_filter = Filter()
+        crypto_filter.filter()
+        ads = sum(record['ads'] for record in crypto_filter.metrics.records if record['stage'] == 'filter.keep')
+    elif stage == 'unique':
+        from manual import Inspector
+        ads = len(Inspector().unique_data)
+    elif stage == 'label':
+        from ai import AIToolBox
+        ads = len(AIToolBox().label_all()['data'])
+    elif stage == 'stats':
+        from manual import Inspector
+        inspector = Inspector()
+        inspector.print_stats()
+        ads = len(inspector.data)
+    else:
+        raise ValueError(f'Unknown stage `{stage}`')
+    seconds = time.perf_counter() - start
+    read_after, write_after = io_counters()
+    results.put({'stage': stage, 'ads': ads, 'seconds': seconds, 'ads_per_second': ads / seconds if seconds else 0,
+                 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                 'read_mb': (read_after - read_before) / 2 ** 20, 'write_mb': (write_after - write_before) / 2 ** 20,
+                 **extra})
+
+
+STARTUP = {
+    # What main.py imported and created before the menu was shown, before the subsystems were created lazily
+    'eager': 'import whisper, moviepy.editor, pydub, ollama, pandas, matplotlib.pyplot, seaborn\n'
+             'from collect import Collector\nfrom filter import Filter\nfrom ai import AIToolBox\n'
+             'from manual import Inspector\nCollector(); Filter(); AIToolBox(); Inspector()',
+    'menu': 'import main\nmain.Subsystems()',
+    'stats': 'import main\nmain.Subsystems().inspector',
+    'ai': 'import main\nmain.Subsystems().classifier',
+}
+
+
+def startup(repeat=5):
+    """
+    Measures the time from starting Python until the menu can be shown (and until the statistics can be printed),
+    each in a fresh interpreter, compared to the eager imports and construction main.py did before.
+    :param repeat: The amount of runs per variant, the best run counts.
+    :return: A dictionary of variant -> seconds, None if the variant failed (e.g. a dependency is not installed).
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for variant, code in STARTUP.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True)
+            if process.returncode != 0:
+                times = []
+                print(f'\t» `{variant}` failed: {process.stderr.strip().splitlines()[-1:]}')
+                break
+            times.append(time.perf_counter() - start)
+        results[variant] = min(times) if times else None
+    print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Startup times (best of {repeat}):')
+    for variant, seconds in results.items():
+        print(f'\t{variant:<6} {f"{seconds:.3f} s" if seconds is not None else "-":>9}')
+    return results
+
+
+def pool(requests=200, latency=0.05, concurrency=8):
+    """
+    Sends label requests through an OllamaPool of three fake hosts: a fast one, a slow one that fails 30% of the
+    requests and one that does not serve the classifier model. Every request has to succeed and the fast host should
+    handle most of them.
+    :param requests: The amount of requests.
+    :param latency: The base latency of the fast host, the slow host has twice this latency.
+    :param concurrency: The amount of requests sent at once.
+    :return: The statistics per endpoint.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from pool import Endpoint, OllamaPool
+    model = 'qwen2.5:32b'
+    servers = [FakeOllamaServer(latency=latency).start(), FakeOllamaServer(latency=latency * 2, fail_rate=0.3).start(),
+               FakeOllamaServer(latency=latency, models=['llama3.2']).start()]
+    endpoints = [Endpoint(servers[0].url, [model], 2), Endpoint(servers[1].url, [model], 4),
+                 Endpoint(servers[2].url, ['llama3.2'], 4)]
+    ollama_pool = OllamaPool(endpoints, retries=2, cooldown=latency)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            responses = list(executor.map(lambda i: ollama_pool.generate(model, prompt=f'Label ad {i}', format='json'),
+                                          range(requests)))
+    finally:
+        for server in servers:
+            server.stop()
+    seconds = time.perf_counter() - start
+    print(f'[{datetime.datetime.now().strftime("%H:%M")}] » {len(responses)} / {requests} requests through the pool '
+          f'in {seconds:.2f} s ({requests / seconds:.1f} per second)')
+    ollama_pool.report()
+    return ollama_pool.stats()
+
+
+def constrained(ads=1000, latency=0.0, prefill_tps=20000.0, eval_tps=1000.0, seed=42):
+    """
+    Runs the criteria stage with CONSTRAINED_CRITERIA=false and =true on the same corpus and compares the generated
+    tokens per ad. The fake LLM gives the same criteria in both modes, so the difference comes from the early stops.
+    :return: A dictionary of mode -> the result of the criteria stage.
+    """
+    results = {}
+    for mode in ['false', 'true']:
+        stage = Benchmark(ads, latency, prefill_tps, eval_tps, ['criteria'], seed,
+                          {'CONSTRAINED_CRITERIA': mode}).run()
+        results['constrained' if mode == 'true' else 'unconstrained'] = stage[0] if stage else None
+    print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Criteria generation ({ads} ads):')
+    print(f'\t{"mode":<14} {"seconds":>9} {"tokens/ad":>10} {"early stops":>12}')
+    for mode, r in results.items():
+        if r is not None:
+            print(f'\t{mode:<14} {r["seconds"]:>9.2f} {r["eval_tokens_per_ad"]:>10.1f} {r["early_stops"]:>12}')
+    return results
+
+
+class Benchmark:
+    """
+    This class runs the benchmark: generate the corpus, start the fake Ollama server and run every stage.
+    """
+
+    def __init__(self, ads=1000, latency=0.0, prefill_tps=20000.0, eval_tps=1000.0, stages=None, seed=42,
+                 environment=None):
+        self.ads = ads
+        self.latency = latency
+        self.prefill_tps = prefill_tps
+        self.eval_tps = eval_tps
+        self.stages = stages or STAGES
+        self.seed = seed
+        self.environment = environment or {}  # Extra environment variables of the stages, e.g. CONSTRAINED_CRITERIA
+
+    @staticmethod
+    def commit():
+        """
+        :return: The current git commit, so results can be compared across commits.
+        """
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or 'unknown'
+        except OSError:
+            return 'unknown'
+
+    def samples(self, directory, paths):
+        """
+        Draws 100 samples from the corpus ads and gives them AI and manual labels, as the statistics need them. The
+        other ads get a manual label in output/labels.jsonl, like the labels of the labeling app.
+        :param directory: The working directory with the synthetic output folder.
+        :param paths: The JSON files of the corpus, see SyntheticCorpus.write.
+        """
+        r = random.Random(self.seed + 1)
+        ads, bodies = [], set()
+        for path in paths:
+            term = os.path.basename(os.path.dirname(os.path.dirname(path)))
+            with open(path, 'r', encoding='utf-8') as f:
+                for ad in json.load(f)['data']:
+                    body = ad['ad_creative_bodies'][0]
+                    ads.append((dict(ad, search_term=term), body in bodies))
+                    bodies.add(body)
+        # Samples are excluded from the unique data, so they are drawn from the ads with a body that occurred before
+        candidates = [ad for ad, duplicate in ads if duplicate] or [ad for ad, _ in ads]
+        samples = r.sample(candidates, min(100, len(candidates)))
+        for ad in samples:
+            scam = r.random() < 0.4
+            ad['classification'] = json.loads(FakeOllamaServer.answer(ad['ad_creative_bodies'][0], {'messages': []}))
+            ad['classification'].update({'scam': scam, 'reason': 'Synthetic label',
+                                         'confidence': 'Very likely' if scam else 'Very unlikely'})
+            # The manual label disagrees with the AI for about 10% of the samples
+            ad['manual_label'] = {'scam': scam != (r.random() < 0.1)}
+        with open(f'{directory}/output/samples.json', 'w', encoding='utf-8') as f:
+            json.dump({'data': samples}, f)
+        sample_ids = {ad['id'] for ad in samples}
+        scam_bodies = tuple(template.split('{')[0] for template in SCAM_BODIES)
+        with open(f'{directory}/output/labels.jsonl', 'w', encoding='utf-8') as f:
+            for ad, _ in ads:
+                if ad['id'] not in sample_ids:
+                    f.write(json.dumps({'id': ad['id'], 'scam': ad['ad_creative_bodies'][0].startswith(scam_bodies),
+                                        'reviewer': 'benchmark', 'at': ad['ad_creation_time']}) + '\n')
+
+    def run(self):
+        """
+        Runs the benchmark and writes the results to output/benchmarks/<commit>-<time>.json.
+        :return: The list of results per stage.
+        """
+        directory = tempfile.mkdtemp(prefix='mad-benchmark-')
+        server = FakeOllamaServer(self.latency, self.prefill_tps, self.eval_tps).start()
+        environment = {'OLLAMA_HOST': server.url, 'MAX_VIDEO_LENGTH': '150', 'MAX_OLLAMA_HISTORY': '2',
+                       'TOP_K': '1', 'TOP_P': '0.2', 'TEMPERATURE': '0.1', 'MPLBACKEND': 'Agg', **self.environment}
+        previous = {key: os.environ.get(key) for key in environment}
+        os.environ.update(environment)
+        results = []
+        try:
+            start = time.perf_counter()
+            paths = SyntheticCorpus(self.seed).write(directory, self.ads)
+            self.samples(directory, paths)
+            os.makedirs(f'{directory}/output/graphs', exist_ok=True)
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Generated {self.ads} synthetic ads in '
+                  f'{time.perf_counter() - start:.1f} seconds at `{directory}`')
+            context = multiprocessing.get_context('fork' if hasattr(os, 'fork') else 'spawn')
+            for stage in self.stages:
+                queue = context.Queue()
+                process = context.Process(target=run_stage, args=(stage, directory, queue))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Stage `{stage}` failed')
+                    continue
+                results.append(queue.get())
+        finally:
+            server.stop()
+            for key, value in previous.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+            shutil.rmtree(directory, ignore_errors=True)
+        self.report(results, server.requests)
+        return results
+
+    def report(self, results, requests):
+        """
+        Prints the results and stores them with the benchmark parameters and commit.
+        """
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Benchmark results ({self.ads} ads, '
+              f'{requests} LLM requests, commit {self.commit()}):')
+        print(f'\t{"stage":<10} {"ads":>9} {"seconds":>9} {"ads/s":>10} {"peak RSS":>10} {"read":>9} {"written":>9}')
+        for r in results:
+            print(f'\t{r["stage"]:<10} {r["ads"]:>9} {r["seconds"]:>9.2f} {r["ads_per_second"]:>10.1f} '
+                  f'{r["peak_rss_mb"]:>8.1f}MB {r["read_mb"]:>7.1f}MB {r["write_mb"]:>7.1f}MB')
+        os.makedirs('output/benchmarks', exist_ok=True)
+        path = f'output/benchmarks/{self.commit()}-{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}.json'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'commit': self.commit(), 'ads': self.ads, 'latency': self.latency,
+                       'prefill_tps': self.prefill_tps, 'eval_tps': self.eval_tps, 'seed': self.seed,
+                       'environment': self.environment, 'results': results}, f, indent=4)
+        print(f'\t» Stored results in `{path}`')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline on a synthetic corpus with a fake Ollama.')
+    parser.add_argument('--ads', type=int, default=1000, help='Amount of synthetic ads (1k to 1M)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Base latency of an LLM request in seconds')
+    parser.add_argument('--prefill-tps', type=float, default=20000.0, help='Prompt tokens per second')
+    parser.add_argument('--eval-tps', type=float, default=1000.0, help='Generated tokens per second')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f'Comma separated subset of {STAGES}')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--startup', action='store_true', help='Only measure the startup time of main.py')
+    parser.add_argument('--pool', action='store_true', help='Only measure the Ollama endpoint pool')
+    parser.add_argument('--constrained', action='store_true',
+                        help='Only compare the generated tokens per ad of constrained and unconstrained criteria')
+    args = parser.parse_args()
+    if args.startup:
+        startup()
+        sys.exit(0)
+    if args.pool:
+        pool(latency=args.latency or 0.05)
+        sys.exit(0)
+    if args.constrained:
+        constrained(args.ads, args.latency, args.prefill_tps, args.eval_tps, args.seed)
+        sys.exit(0)
+    Benchmark(args.ads, args.latency, args.prefill_tps, args.eval_tps, args.stages.split(','), args.seed).run()
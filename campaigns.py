@@ -0,0 +1,234 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the grouping of ads into scam campaigns. Ads are linked when they share a landing
+              page (ad_creative_link_captions), a body cluster (the normalized ad text of the review queue) or a video
+              fingerprint, and optionally a page or a payer (beneficiary_payers and bylines), which also run unrelated
+              ads. The links are merged with a union-find, so grouping is a single pass over the ads that scales
+              linearly with their amount. The AI toolbox labels one representative per campaign (CAMPAIGNS=true) and
+              reviewers can label a campaign in bulk in the labeling app. Campaigns of which the ads already have
+              conflicting labels are not labeled through a representative. Run `python campaigns.py` to group the
+              unique ads into output/campaigns.json.
+@date: 19-10-2026
+"""
+import datetime
+import hashlib
+import json
+import os
+import re
+
+from active import ReviewQueue
+
+LINK_KINDS = ('page', 'payer', 'caption', 'body', 'video')
+# Pages and payers often run both scams and legitimate ads, so by default ads are only linked by their content
+DEFAULT_LINKS = ('caption', 'body', 'video')
+# Landing pages that many unrelated advertisers share, they do not link ads
+GENERIC_CAPTIONS = {'facebook.com', 'fb.me', 'fb.com', 'instagram.com', 'youtube.com', 'youtu.be', 'bit.ly',
+                    'linktr.ee', 't.me', 'telegram.org', 'wa.me', 'whatsapp.com', 'google.com', 'apple.com',
+                    'play.google.com', 'apps.apple.com', 'tiktok.com', 'x.com', 'twitter.com', 'amazon.com'}
+MIN_BODY_KEY = 24  # Shorter body clusters (e.g. "learn more") are too generic to link ads
+
+
+class UnionFind:
+    """
+    This class is a disjoint set forest over the numbers 0..n-1, with union by size and path halving.
+    """
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, i):
+        """
+        :return: The root of the set of i.
+        """
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """
+        Merges the sets of i and j.
+        :return: True if they were different sets.
+        """
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return False
+        if self.size[i] < self.size[j]:
+            i, j = j, i
+        self.parent[j] = i
+        self.size[i] += self.size[j]
+        return True
+
+
+def video_fingerprint(ad):
+    """
+    Fingerprints the video of an ad by its size and the hash of its first megabyte, so re-uploads of the same video
+    match without reading whole files.
+    :param ad: The ad.
+    :return: The fingerprint, None if the ad has no downloaded video.
+    """
+    path = f'output/{ad.get("search_term")}/ads_videos/ad_{ad["id"]}_video.mp4'
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f'{os.path.getsize(path)}:{hashlib.sha1(f.read(1 << 20)).hexdigest()}'
+
+
+def link_keys(ad, kinds=LINK_KINDS):
+    """
+    Determines the values through which an ad links to other ads.
+    :param ad: The ad.
+    :param kinds: The kinds of links to use, see LINK_KINDS.
+    :return: A set of (kind, value) tuples.
+    """
+    keys = set()
+    if 'page' in kinds and ad.get('page_id'):
+        keys.add(('page', str(ad['page_id'])))
+    if 'payer' in kinds:
+        payers = [payer.get('payer') for payer in ad.get('beneficiary_payers') or []] + [ad.get('bylines')]
+        keys |= {('payer', ' '.join(payer.lower().split())) for payer in payers if isinstance(payer, str)
+                 and payer.strip()}
+    if 'caption' in kinds:
+        for caption in ad.get('ad_creative_link_captions') or []:
+            domain = re.sub(r'^(https?://)?(www\.)?', '', caption.strip().lower()).split('/')[0]
+            if domain and domain not in GENERIC_CAPTIONS:
+                keys.add(('caption', domain))
+    if 'body' in kinds and any(ad.get('ad_creative_bodies') or []):
+        key = ReviewQueue.cluster_key(ad)
+        if len(key) >= MIN_BODY_KEY:
+            keys.add(('body', key))
+    if 'video' in kinds:
+        fingerprint = video_fingerprint(ad)
+        if fingerprint:
+            keys.add(('video', fingerprint))
+    return keys
+
+
+class Campaigns:
+    """
+    This class groups ads into campaigns. The first ad with a link value owns it and every later ad with the same value
+    is merged into its set, so every ad and link is visited once. The representative of a campaign is the member with
+    the most text, as the LLM and reviewers judge it best. A campaign conflicts when its ads already have both scam
+    and non-scam labels of the same kind (manual or AI), its label is then not copied from a representative.
+    """
+
+    def __init__(self, ads, kinds=None):
+        """
+        :param ads: The ads to group (dictionaries with at least the linked fields).
+        :param kinds: The kinds of links to use, CAMPAIGN_LINKS or DEFAULT_LINKS by default.
+        """
+        if kinds is None:
+            kinds = [kind.strip() for kind in os.getenv('CAMPAIGN_LINKS', ','.join(DEFAULT_LINKS)).split(',')
+                     if kind.strip()]
+        self.kinds = tuple(kind for kind in kinds if kind in LINK_KINDS)
+        self.ids = [ad['id'] for ad in ads]
+        forest = UnionFind(len(self.ids))
+        owners = {}  # (kind, value) -> index of the first ad with it
+        self.links = dict.fromkeys(self.kinds, 0)  # The amount of merges per kind of link
+        for i, ad in enumerate(ads):
+            for key in link_keys(ad, self.kinds):
+                owner = owners.setdefault(key, i)
+                if owner != i and forest.union(owner, i):
+                    self.links[key[0]] += 1
+        self.members = {}  # representative id -> ids of the campaign
+        self.campaign = {}  # ad id -> representative id
+        weights = [self.weight(ad) for ad in ads]
+        roots = [forest.find(i) for i in range(len(self.ids))]
+        best = {}
+        for i, root in enumerate(roots):
+            if root not in best or weights[i] > weights[best[root]]:
+                best[root] = i
+        labels = {}  # representative id -> the (kind, scam) labels of its ads
+        for i, root in enumerate(roots):
+            representative = self.ids[best[root]]
+            self.campaign[self.ids[i]] = representative
+            self.members.setdefault(representative, []).append(self.ids[i])
+            labels.setdefault(representative, set()).update(self.labels(ads[i]))
+        self.conflicts = {representative for representative, found in labels.items()
+                          if any((kind, True) in found and (kind, False) in found for kind in ('manual', 'ai'))}
+
+    @staticmethod
+    def weight(ad):
+        """
+        :return: The amount of text of an ad, the representative of a campaign has the most.
+        """
+        return sum(len(body or '') for body in ad.get('ad_creative_bodies') or []) + \
+            len(ad.get('video_transcription') or '')
+
+    @staticmethod
+    def labels(ad):
+        """
+        :return: The manual and AI labels of an ad as a set of (kind, scam) tuples, labels copied from a campaign
+                 representative are not labels of the ad itself.
+        """
+        labels = set()
+        if 'scam' in ad.get('manual_label', {}):
+            labels.add(('manual', bool(ad['manual_label']['scam'])))
+        classification = ad.get('classification', {})
+        if 'scam' in classification and classification.get('label_source') != 'campaign':
+            labels.add(('ai', bool(classification['scam'])))
+        return labels
+
+    def representative(self, ad_id):
+        """
+        :return: The id of the representative of the campaign of an ad.
+        """
+        return self.campaign[ad_id]
+
+    def siblings(self, ad_id):
+        """
+        :return: The ids of all ads in the campaign of an ad, including the ad itself.
+        """
+        return self.members[self.campaign[ad_id]]
+
+    def followers(self, ads):
+        """
+        Groups ads by the representative of their campaign.
+        :param ads: The ads, e.g. those that still have to be labeled.
+        :return: A dictionary of representative id -> the given ads of its campaign.
+        """
+        result = {}
+        for ad in ads:
+            result.setdefault(self.campaign[ad['id']], []).append(ad)
+        return result
+
+    def stats(self):
+        """
+        :return: A dictionary with the amount of ads, campaigns, the size of the largest campaign, the amount of ads
+                 in campaigns of more than one ad, the amount of conflicting campaigns and the merges per kind of link.
+        """
+        sizes = [len(members) for members in self.members.values()]
+        return {'ads': len(self.ids), 'campaigns': len(sizes), 'largest': max(sizes, default=0),
+                'grouped': sum(size for size in sizes if size > 1), 'conflicting': len(self.conflicts),
+                'links': self.links}
+
+    def report(self):
+        """
+        Prints the statistics of the campaigns.
+        """
+        s = self.stats()
+        links = ', '.join(f'{kind}: {amount}' for kind, amount in s['links'].items())
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Grouped {s["ads"]} ads into {s["campaigns"]} '
+              f'campaigns ({s["grouped"]} ads share a campaign, the largest has {s["largest"]} ads, '
+              f'{s["conflicting"]} have conflicting labels; merges by {links})')
+
+    def save(self, path='output/campaigns.json'):
+        """
+        Writes the campaigns of more than one ad, the largest first.
+        :param path: The path of the JSON file.
+        """
+        campaigns = sorted(((representative, members) for representative, members in self.members.items()
+                            if len(members) > 1), key=lambda campaign: -len(campaign[1]))
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'data': [{'representative': representative, 'size': len(members),
+                                 'conflicting': representative in self.conflicts, 'ids': members}
+                                for representative, members in campaigns]}, f, indent=4)
+
+
+if __name__ == '__main__':
+    with open('output/filtered-unique.json', 'r', encoding='utf-8') as file:
+        result = Campaigns(json.load(file)['data'])
+    result.report()
+    result.save()
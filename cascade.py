@@ -0,0 +1,215 @@
+"""
+@author: Luuk Kablan
+@description: This file contains a lightweight local classifier that is trained on the criteria and labels the LLMs
+              already produced. It runs on the CPU in front of the LLMs as the first stage of a cascade: predictions
+              it is very confident about are accepted directly and only uncertain ads are sent to the LLMs.
+@date: 19-10-2026
+"""
+import datetime
+import json
+import os
+import pickle
+import time
+
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_union
+
+from archive import is_ads_file, load_ads
+
+CRITERIA = ['free_crypto', 'giveaway', 'unrealistic', 'bio_link', 'limited_time', 'about_crypto']
+
+
+class Cascade:
+    """
+    This class trains one logistic regression per criterion and one for the scam label on hashed word and character
+    n-grams of the ad text. The hashing vectorizer is stateless, so only the linear models have to be stored.
+    """
+
+    def __init__(self, path='output/models/cascade.pkl', confidence=None):
+        self.path = path
+        self.confidence = float(os.getenv('CASCADE_CONFIDENCE', 0.95)) if confidence is None else confidence
+        self.vectorizer = make_union(
+            HashingVectorizer(n_features=2 ** 18, ngram_range=(1, 2), alternate_sign=False, norm='l2'),
+            HashingVectorizer(n_features=2 ** 18, analyzer='char_wb', ngram_range=(3, 5), alternate_sign=False,
+                              norm='l2'),
+        )
+        self.models = {}
+
+    @staticmethod
+    def ad_text(ad):
+        """
+        Returns the text of an ad which the LLMs also get to see: the unique ad bodies and the video transcription.
+        :param ad: The ad to get the text from.
+        :return: The text of the ad.
+        """
+        bodies = list(dict.fromkeys(ad.get('ad_creative_bodies') or []))
+        return ' '.join(bodies + [ad.get('video_transcription') or ''])
+
+    @staticmethod
+    def from_llm(classification, key):
+        """
+        Checks whether a value in the classification was produced by an LLM, so we never train on our own predictions.
+        :param classification: The classification dictionary of an ad.
+        :param key: The criterion or 'scam'.
+        :return: True if the value is present and was not set by the cascade, the pre-filter or an early stop.
+        """
+        if key not in classification or 'prefilter' in classification or key in classification.get('undecided', []):
+            return False
+        source = classification.get('label_source' if key == 'scam' else 'source')
+        return source != 'cascade'
+
+    def train(self, output_dir='output'):
+        """
+        Trains the models on all collected ads with LLM criteria and on the labeled unique ads. The samples are left out
+        of the training data so they can be used to measure the agreement with the LLM.
+        """
+        start_time = datetime.datetime.now()
+        print(f'[{start_time.strftime("%H:%M")}] » Training the cascade classifier...')
+        samples = set()
+        if os.path.exists(f'{output_dir}/samples.json'):
+            with open(f'{output_dir}/samples.json', 'r', encoding='utf-8') as f:
+                samples = {ad['id'] for ad in json.load(f)['data']}
+        ads = {}
+        for folder in sorted(os.listdir(output_dir)):
+            if not os.path.isdir(f'{output_dir}/{folder}/json'):
+                continue
+            for json_file in sorted(os.listdir(f'{output_dir}/{folder}/json')):
+                if is_ads_file(json_file):
+                    ads.update({ad['id']: ad for ad in load_ads(f'{output_dir}/{folder}/json/{json_file}')['data']
+                                if ad['id'] not in samples})
+        labeled = []
+        if os.path.exists(f'{output_dir}/filtered-unique.json'):
+            with open(f'{output_dir}/filtered-unique.json', 'r', encoding='utf-8') as f:
+                labeled = [ad for ad in json.load(f)['data'] if ad['id'] not in samples]
+        for key in CRITERIA + ['scam']:
+            train_ads = [ad for ad in (labeled if key == 'scam' else ads.values())
+                         if self.from_llm(ad.get('classification', {}), key)]
+            targets = [bool(ad['classification'][key]) for ad in train_ads]
+            if len(set(targets)) < 2:
+                print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Not enough data to train `{key}` '
+                      f'({len(train_ads)} ads)')
+                continue
+            model = LogisticRegression(C=4.0, max_iter=1000, class_weight='balanced')
+            model.fit(self.vectorizer.transform([self.ad_text(ad) for ad in train_ads]), targets)
+            self.models[key] = model
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Trained `{key}` on {len(train_ads)} ads '
+                  f'({sum(targets)} positive)')
+        self.save()
+        end_time = datetime.datetime.now()
+        print(f'[{end_time.strftime("%H:%M")}] » Finished training within '
+              f'{(end_time - start_time).total_seconds() / 60:.2f} minutes!')
+
+    def save(self):
+        """
+        Stores the trained models at the path of the cascade.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'wb') as f:
+            pickle.dump(self.models, f)
+
+    @classmethod
+    def load(cls, path='output/models/cascade.pkl', confidence=None):
+        """
+        Loads the trained models, call train() first if they do not exist yet.
+        :return: The cascade with the loaded models.
+        """
+        cascade = cls(path, confidence)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                cascade.models = pickle.load(f)
+        else:
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » No cascade classifier at `{path}`, '
+                  f'all ads will be sent to the LLM')
+        return cascade
+
+    def probabilities(self, ads, keys):
+        """
+        Predicts the probability of each key being true for a batch of ads.
+        :param ads: The ads to predict.
+        :param keys: The criteria and/or 'scam'.
+        :return: A dictionary of key -> list of probabilities, keys without a trained model are left out.
+        """
+        features = self.vectorizer.transform([self.ad_text(ad) for ad in ads])
+        return {key: self.models[key].predict_proba(features)[:, 1].tolist() for key in keys if key in self.models}
+
+    def is_confident(self, probability):
+        """
+        :return: True if the probability is far enough from 0.5 to accept the prediction without the LLM.
+        """
+        return probability >= self.confidence or probability <= 1 - self.confidence
+
+    def predict_criteria(self, ad):
+        """
+        Predicts all criteria of an ad. The prediction is only returned if the cascade is confident about every
+        criterion, or if it is confident the ad is not about crypto at all (then the Filter drops it anyway).
+        :param ad: The ad to predict.
+        :return: The criteria dictionary or None if the ad has to go to the LLM.
+        """
+        if 'about_crypto' not in self.models:
+            return None
+        probabilities = {key: values[0] for key, values in self.probabilities([ad], CRITERIA).items()}
+        if probabilities['about_crypto'] <= 1 - self.confidence:
+            return {key: False for key in CRITERIA} | {'cascade': round(probabilities['about_crypto'], 4)}
+        if len(probabilities) < len(CRITERIA) or not all(self.is_confident(p) for p in probabilities.values()):
+            return None
+        return {key: p >= self.confidence for key, p in probabilities.items()} | \
+            {'cascade': round(min(max(p, 1 - p) for p in probabilities.values()), 4)}
+
+    def predict_label(self, ad):
+        """
+        Predicts the scam label of an ad if the cascade is confident about it.
+        :param ad: The ad to predict.
+        :return: The label as {"scam", "reason", "confidence"} or None if the ad has to go to the LLM.
+        """
+        if 'scam' not in self.models:
+            return None
+        probability = self.probabilities([ad], ['scam'])['scam'][0]
+        if not self.is_confident(probability):
+            return None
+        return {
+            'scam': probability >= self.confidence,
+            'reason': f'Predicted by the local cascade classifier (p={probability:.3f})',
+            'confidence': 'Very likely' if probability >= self.confidence else 'Very unlikely',
+        }
+
+    def evaluate(self, path='output/samples.json'):
+        """
+        Reports the throughput of the cascade, the fraction of LLM calls it would avoid and how well its confident
+        predictions agree with the LLM (and with the manual labels) on the samples.
+        :param path: The path to the samples.
+        :return: A dictionary with the results per key.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            samples = json.load(f)['data']
+        start = time.perf_counter()
+        probabilities = self.probabilities(samples, CRITERIA + ['scam'])
+        elapsed = time.perf_counter() - start
+        results = {'ads': len(samples), 'ads_per_second': len(samples) / elapsed if elapsed else 'NaN'}
+        if all(key in probabilities for key in CRITERIA):
+            accepted = [probabilities['about_crypto'][i] <= 1 - self.confidence or
+                        all(self.is_confident(probabilities[key][i]) for key in CRITERIA)
+                        for i in range(len(samples))]
+            results['criteria_llm_calls_avoided'] = sum(accepted) / len(samples) if samples else 'NaN'
+        for key, values in probabilities.items():
+            confident = [(ad, p >= self.confidence) for ad, p in zip(samples, values) if self.is_confident(p)]
+            agree = [prediction == bool(ad['classification'][key]) for ad, prediction in confident
+                     if key in ad.get('classification', {})]
+            manual = [prediction == ad['manual_label']['scam'] for ad, prediction in confident
+                      if key == 'scam' and 'scam' in ad.get('manual_label', {})]
+            results[key] = {
+                'llm_calls_avoided': len(confident) / len(samples) if samples else 'NaN',
+                'llm_agreement': sum(agree) / len(agree) if agree else 'NaN',
+            }
+            if key == 'scam':
+                results[key]['manual_agreement'] = sum(manual) / len(manual) if manual else 'NaN'
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Cascade evaluation (confidence {self.confidence}):')
+        for key, value in results.items():
+            print(f'\t- {key}: {value}')
+        return results
+
+
+if __name__ == '__main__':
+    cascade = Cascade()
+    cascade.train()
+    cascade.evaluate()
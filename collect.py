@@ -12,6 +12,8 @@ from dotenv import load_dotenv
 import requests
 from tqdm import tqdm
 
+from metrics import Metrics, format_duration
+
 class Collector:
     """
     This class is used to collect the data from the Meta API.
@@ -27,6 +29,7 @@ class Collector:
         self.project_name = 'ads' if os.getenv('PROJECT_NAME') is None else os.getenv('PROJECT_NAME')
         self.fields = os.getenv('FIELDS')
         self.api = None
+        self.metrics = Metrics('collect')
 
     def get_token(self):
         """
@@ -67,6 +70,7 @@ class Collector:
         :return: The collected ads.
         """
         start_time = datetime.datetime.now()
+        self.metrics.reset()
         print(f'» [{start_time.strftime("%H:%M")}] Starting data collection...')
         # Split the search terms and collect the data for each term
         for term in tqdm(self.search_terms.split(';'), desc='Collecting ads'):
@@ -74,8 +78,9 @@ class Collector:
             using_project = self.project_name if project_name is None else project_name
             using_project = f'{using_project}_{term}'
             # If the token is expired, get a new token from the user
-            if self.is_token_expired():
-                self.access_token = self.get_token()
+            with self.metrics.timer('collect.token'):
+                if self.is_token_expired():
+                    self.access_token = self.get_token()
             self.api = adlib_api.AdLibAPI(self.access_token, project_name=using_project)
             self.api.add_parameters(fields=self.fields,
                                     ad_reached_countries=self.countries,
@@ -83,14 +88,17 @@ class Collector:
                                     search_terms=term)
             self.api.get_parameters()
             # Start the download of the data
-            data = self.api.start_download()
+            with self.metrics.timer('collect.api', term=term):
+                data = self.api.start_download()
             if data is None or len(data) == 0:
                 print(f'» [{datetime.datetime.now().strftime("%H:%M")}] No data found for `{term}`...')
                 continue
             # Start the media download
             print(f'» [{datetime.datetime.now().strftime("%H:%M")}] Starting download for `{term}`... ({len(data)})')
-            start_media_download(project_name=using_project, nr_ads=self.limit, data=data)
+            with self.metrics.timer('collect.media', ads=len(data)):
+                start_media_download(project_name=using_project, nr_ads=self.limit, data=data)
             print(f'» [{datetime.datetime.now().strftime("%H:%M")}] Finished download for `{term}`!')
         end_time = datetime.datetime.now()
-        total_time = (end_time - start_time).seconds / 60
-        print(f'\n» [{end_time.strftime("%H:%M")}] Finished data collection! ({total_time:.2f} minutes)')
+        total_time = format_duration((end_time - start_time).total_seconds())
+        print(f'\n» [{end_time.strftime("%H:%M")}] Finished data collection! ({total_time})')
+        self.metrics.report()
@@ -0,0 +1,218 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the model comparison harness. It labels the manually labeled samples with a grid of
+              classifier models and sampling options, stores the labels of every configuration side by side and
+              reports F1/MCC next to the latency and generation speed, so the cheapest model that meets the accuracy
+              bar can be picked. Labels are appended to a JSONL file as they come in, an interrupted run resumes.
+@date: 19-10-2026
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ai import AIToolBox
+from metrics import Metrics, percentile
+from prompts import PromptBuilder
+from tqdm import tqdm
+
+
+def grid(models, temperatures, top_ks, top_ps):
+    """
+    :return: The list of all combinations of the models and sampling options as configuration dictionaries.
+    """
+    return [{'model': model, 'temperature': temperature, 'top_k': top_k, 'top_p': top_p}
+            for model, temperature, top_k, top_p in itertools.product(models, temperatures, top_ks, top_ps)]
+
+
+def scores(manual, predicted):
+    """
+    Calculates the classification scores of the predicted labels against the manual labels.
+    :param manual: The list of manual labels.
+    :param predicted: The list of predicted labels, in the same order.
+    :return: A dictionary with tp, fp, fn, tn, precision, recall, f1 and mcc (None when undefined).
+    """
+    tp = sum(m and p for m, p in zip(manual, predicted))
+    fp = sum(not m and p for m, p in zip(manual, predicted))
+    fn = sum(m and not p for m, p in zip(manual, predicted))
+    tn = sum(not m and not p for m, p in zip(manual, predicted))
+    denominator = ((tp + fp) * (tp + fn) * (tn + fp) * (tn + fn)) ** 0.5
+    return {'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+            'precision': tp / (tp + fp) if tp + fp else None,
+            'recall': tp / (tp + fn) if tp + fn else None,
+            'f1': 2 * tp / (2 * tp + fp + fn) if 2 * tp + fp + fn else None,
+            'mcc': (tp * tn - fp * fn) / denominator if denominator else None}
+
+
+class ModelComparison:
+    """
+    This class runs the label prompt of every configuration over the samples. All requests go through one pool of
+    workers, submitted configuration by configuration, so Ollama mostly serves one model at a time instead of swapping
+    models between requests.
+    """
+
+    def __init__(self, samples_path='output/samples.json', directory='output/comparisons', concurrency=None):
+        with open(samples_path, 'r', encoding='utf-8') as f:
+            self.samples = [ad for ad in json.load(f)['data'] if 'scam' in ad.get('manual_label', {})]
+        self.directory = directory
+        self.path = f'{directory}/labels.jsonl'
+        self.concurrency = int(os.getenv('RELABEL_CONCURRENCY', 4)) if concurrency is None else concurrency
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def signature(config):
+        """
+        :return: The classifier signature of a configuration, the same as AIToolBox.classifier_signature.
+        """
+        return f"m:{config['model']};t:{config['temperature']};k:{config['top_k']};p:{config['top_p']}"
+
+    @staticmethod
+    def toolbox(config):
+        """
+        Creates a toolbox that labels with the model and options of a configuration. The cascade is disabled, so
+        every label comes from the model itself.
+        :param config: The configuration.
+        :return: The AIToolBox.
+        """
+        ai = AIToolBox()
+        ai.classifier_model = config['model']
+        ai.temp, ai.top_k, ai.top_p = config['temperature'], config['top_k'], config['top_p']
+        ai.label_prompts = PromptBuilder(config['model'])
+        ai.metrics = Metrics('compare')
+        ai.cascade = None
+        return ai
+
+    def load(self):
+        """
+        :return: The stored results as a dictionary of signature -> ad id -> result.
+        """
+        results = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        result = json.loads(line)
+                        results.setdefault(result['config'], {})[result['id']] = result
+        return results
+
+    def label(self, ai, config, ad):
+        """
+        Labels a single ad with a configuration and appends the result to the JSONL file.
+        :return: The result with the label, latency and token statistics.
+        """
+        start = time.perf_counter()
+        try:
+            label = ai.generate_label(ad)
+            result = {'scam': bool(label['scam']), 'confidence': label.get('confidence'), 'reason': label.get('reason')}
+        except Exception as e:
+            result = {'error': str(e)}
+        result = {'config': self.signature(config), 'id': ad['id'], **result,
+                  'seconds': time.perf_counter() - start, **self.tokens(ai.metrics, ad['id'])}
+        with self.lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result) + '\n')
+        return result
+
+    @staticmethod
+    def tokens(metrics, ad_id):
+        """
+        :return: The eval tokens and eval seconds of the last label request of an ad.
+        """
+        with metrics.lock:
+            for record in reversed(metrics.records):
+                if record['stage'] == 'label.llm.eval' and record['ad_id'] == ad_id:
+                    return {'eval_tokens': record['tokens'], 'eval_seconds': record['seconds']}
+        return {}
+
+    def run(self, configs, bar=None):
+        """
+        Labels the samples with every configuration that has not labeled them yet and reports the results.
+        :param configs: The list of configurations, see grid.
+        :param bar: The minimum F1 score, the fastest configuration that reaches it is recommended.
+        :return: The report per configuration.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        results = self.load()
+        start_time = datetime.datetime.now()
+        print(f'[{start_time.strftime("%H:%M")}] » Comparing {len(configs)} configurations on {len(self.samples)} '
+              f'samples ({self.concurrency} concurrent requests)...')
+        with ThreadPoolExecutor(max_workers=max(self.concurrency, 1)) as executor:
+            futures = []
+            for config in configs:
+                done = results.get(self.signature(config), {})
+                todo = [ad for ad in self.samples if ad['id'] not in done or 'error' in done[ad['id']]]
+                if todo:
+                    ai = self.toolbox(config)
+                    futures += [executor.submit(self.label, ai, config, ad) for ad in todo]
+            for future in tqdm(futures, desc='Comparing models'):
+                result = future.result()
+                results.setdefault(result['config'], {})[result['id']] = result
+        report = [self.evaluate(config, results.get(self.signature(config), {})) for config in configs]
+        self.write(configs, results)
+        self.report(report, bar)
+        return report
+
+    def evaluate(self, config, results):
+        """
+        Scores the labels of a configuration against the manual labels.
+        :param config: The configuration.
+        :param results: The results of the configuration by ad id.
+        :return: The scores, latency and generation speed of the configuration.
+        """
+        labeled = [(ad['manual_label']['scam'], results[ad['id']]) for ad in self.samples
+                   if 'scam' in results.get(ad['id'], {})]
+        seconds = [result['seconds'] for _, result in labeled]
+        eval_tokens = sum(result.get('eval_tokens', 0) for _, result in labeled)
+        eval_seconds = sum(result.get('eval_seconds', 0) for _, result in labeled)
+        return {'config': self.signature(config), **config,
+                **scores([manual for manual, _ in labeled], [result['scam'] for _, result in labeled]),
+                'labeled': len(labeled), 'failed': len(self.samples) - len(labeled),
+                'p50': percentile(seconds, 0.5), 'p95': percentile(seconds, 0.95),
+                'tokens_per_second': eval_tokens / eval_seconds if eval_seconds else None}
+
+    def write(self, configs, results):
+        """
+        Writes the labels of all configurations side by side per sample to comparison.json.
+        """
+        rows = [{'id': ad['id'], 'manual': ad['manual_label']['scam'],
+                 'labels': {self.signature(config): results.get(self.signature(config), {}).get(ad['id'], {})
+                            .get('scam') for config in configs}} for ad in self.samples]
+        with open(f'{self.directory}/comparison.json', 'w', encoding='utf-8') as f:
+            json.dump({'data': rows}, f, indent=4)
+
+    def report(self, report, bar=None):
+        """
+        Prints the report and stores it with a timestamp.
+        """
+        def number(value, digits=3):
+            return f'{value:.{digits}f}' if value is not None else '-'
+
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Model comparison:')
+        print(f'\t{"configuration":<40} {"F1":>6} {"MCC":>6} {"failed":>6} {"p50 (s)":>8} {"p95 (s)":>8} {"tok/s":>7}')
+        for r in report:
+            print(f'\t{r["config"]:<40} {number(r["f1"]):>6} {number(r["mcc"]):>6} {r["failed"]:>6} '
+                  f'{r["p50"]:>8.2f} {r["p95"]:>8.2f} {number(r["tokens_per_second"], 1):>7}')
+        if bar is not None:
+            passing = [r for r in report if r['f1'] is not None and r['f1'] >= bar]
+            best = min(passing, key=lambda r: r['p50'], default=None)
+            print(f'\t» Fastest configuration with F1 >= {bar}: {best["config"] if best else "none"}')
+        path = f'{self.directory}/report-{datetime.datetime.now().strftime("%Y%m%d-%H%M%S")}.json'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'samples': len(self.samples), 'bar': bar, 'results': report}, f, indent=4)
+        print(f'\t» Stored the labels in `{self.directory}` and the report in `{path}`')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare classifier models and sampling options on the samples.')
+    parser.add_argument('--models', nargs='+', default=['qwen2.5:32b'], help='Ollama models to compare')
+    parser.add_argument('--temperature', nargs='+', type=float, default=[0.1])
+    parser.add_argument('--top-k', nargs='+', type=int, default=[1])
+    parser.add_argument('--top-p', nargs='+', type=float, default=[0.2])
+    parser.add_argument('--concurrency', type=int, default=None, help='Concurrent requests (RELABEL_CONCURRENCY)')
+    parser.add_argument('--min-f1', type=float, default=None, help='Accuracy bar for the recommendation')
+    args = parser.parse_args()
+    ModelComparison(concurrency=args.concurrency).run(grid(args.models, args.temperature, args.top_k, args.top_p),
+                                                      args.min_f1)
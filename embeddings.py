@@ -0,0 +1,231 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the embedding index used to find ads that are semantically similar to each other.
+              The ad bodies and transcriptions are encoded in batches on the CPU with a multilingual sentence
+              transformer, stored in a memory-mapped NumPy matrix and indexed with random hyperplane LSH for
+              approximate nearest neighbor search. The manual labels are propagated to unlabeled ads with kNN.
+@date: 19-10-2026
+"""
+import datetime
+import hashlib
+import json
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+
+class EmbeddingIndex:
+    """
+    This class stores one normalized embedding per ad. The vectors live in output/embeddings/vectors.npy which is
+    memory-mapped, so only the rows that are used are read from disk.
+    """
+
+    def __init__(self, directory='output/embeddings', model_name=None, tables=8, bits=12, seed=42):
+        self.directory = directory
+        self.model_name = model_name or os.getenv('EMBEDDING_MODEL', 'paraphrase-multilingual-MiniLM-L12-v2')
+        self.batch_size = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))
+        self.tables = tables
+        self.bits = bits
+        self.seed = seed
+        self.model = None
+        self.ids = []
+        self.hashes = []
+        self.rows = {}
+        self.vectors = None
+        self.planes = None
+        self.buckets = []
+        self.load()
+
+    @staticmethod
+    def ad_text(ad):
+        """
+        :return: The unique ad bodies and the video transcription of an ad as one string.
+        """
+        bodies = list(dict.fromkeys(ad.get('ad_creative_bodies') or []))
+        return '\n'.join(bodies + [ad.get('video_transcription') or '']).strip()
+
+    def encoder(self):
+        """
+        Loads the sentence transformer on the first use, so loading and querying the index itself is cheap.
+        """
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer  # Only needed when ads are encoded
+            self.model = SentenceTransformer(self.model_name, device='cpu')
+        return self.model
+
+    def encode(self, texts):
+        """
+        Encodes texts in batches into L2 normalized float32 vectors.
+        :param texts: The list of texts to encode.
+        :return: A matrix with one row per text.
+        """
+        return self.encoder().encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                     convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+
+    def load(self):
+        """
+        Loads the ids and memory-maps the vectors if the index was built before.
+        """
+        meta_path = f'{self.directory}/ids.json'
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('model') != self.model_name:
+            return
+        self.ids = meta['ids']
+        self.hashes = meta['hashes']
+        self.rows = {ad_id: row for row, ad_id in enumerate(self.ids)}
+        self.vectors = np.load(f'{self.directory}/vectors.npy', mmap_mode='r')
+        self.build_lsh()
+
+    def build(self, ads):
+        """
+        (Re)builds the index for the given ads. Vectors of ads of which the text did not change are copied from the
+        previous index, so only new or changed ads are encoded and the model is only loaded if there are any.
+        :param ads: The ads to index.
+        """
+        start_time = datetime.datetime.now()
+        os.makedirs(self.directory, exist_ok=True)
+        ads = list({ad['id']: ad for ad in ads}.values())
+        texts = [self.ad_text(ad) for ad in ads]
+        hashes = [hashlib.sha1(text.encode('utf-8')).hexdigest()[:16] for text in texts]
+        copies, todo = {}, []  # The previous index has the same model, see load
+        for row, (ad, text_hash) in enumerate(zip(ads, hashes)):
+            old_row = self.rows.get(ad['id'])
+            if old_row is not None and self.hashes[old_row] == text_hash:
+                copies[row] = old_row
+            else:
+                todo.append(row)
+        chunks = [todo[i:i + self.batch_size * 16] for i in range(0, len(todo), self.batch_size * 16)]
+        # The dimension comes from the first encoded chunk or the previous index
+        encoded = self.encode([texts[row] for row in chunks[0]]) if chunks else None
+        dim = encoded.shape[1] if encoded is not None else self.vectors.shape[1] if self.vectors is not None else 0
+        tmp_path = f'{self.directory}/vectors.tmp.npy'
+        vectors = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(ads), dim))
+        for row, old_row in copies.items():
+            vectors[row] = self.vectors[old_row]
+        for i, chunk in enumerate(tqdm(chunks, desc='Encoding ads')):
+            vectors[chunk] = encoded if i == 0 else self.encode([texts[row] for row in chunk])
+        vectors.flush()
+        del vectors
+        self.vectors = None
+        os.replace(tmp_path, f'{self.directory}/vectors.npy')
+        with open(f'{self.directory}/ids.json', 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model_name, 'ids': [ad['id'] for ad in ads], 'hashes': hashes}, f)
+        self.load()
+        end_time = datetime.datetime.now()
+        print(f'[{end_time.strftime("%H:%M")}] » Indexed {len(ads)} ads ({len(todo)} encoded) within '
+              f'{(end_time - start_time).total_seconds():.1f} seconds')
+
+    def build_lsh(self):
+        """
+        Hashes every vector with random hyperplanes into a bucket per table. Ads in the same bucket have a high
+        cosine similarity with each other, so only these have to be compared at query time.
+        """
+        rng = np.random.default_rng(self.seed)
+        self.planes = rng.standard_normal((self.tables, self.vectors.shape[1], self.bits)).astype(np.float32)
+        weights = 1 << np.arange(self.bits)
+        self.buckets = []
+        codes = np.empty((self.tables, len(self.ids)), dtype=np.int64)
+        for start in range(0, len(self.ids), 65536):
+            block = np.asarray(self.vectors[start:start + 65536])
+            for table in range(self.tables):
+                codes[table, start:start + len(block)] = ((block @ self.planes[table]) > 0) @ weights
+        for table in range(self.tables):
+            order = np.argsort(codes[table], kind='stable')
+            keys, starts = np.unique(codes[table][order], return_index=True)
+            self.buckets.append({int(key): rows for key, rows in zip(keys, np.split(order, starts[1:]))})
+
+    def query_vector(self, vector, k=10, exclude=None):
+        """
+        Finds the approximate k nearest ads of a vector. Falls back to an exact search when the buckets do not contain
+        enough candidates.
+        :param vector: The normalized query vector.
+        :param k: The amount of neighbors.
+        :param exclude: An optional ad id to leave out of the results (the query ad itself).
+        :return: A list of (ad id, cosine similarity) tuples, most similar first.
+        """
+        if self.vectors is None or len(self.ids) == 0:
+            return []
+        weights = 1 << np.arange(self.bits)
+        empty = np.empty(0, dtype=np.int64)  # An empty list would turn the concatenation into float64
+        candidates = [self.buckets[table].get(int(((vector @ self.planes[table]) > 0) @ weights), empty)
+                      for table in range(self.tables)]
+        candidates = np.unique(np.concatenate(candidates)).astype(np.int64) if candidates else empty
+        if len(candidates) <= k:
+            candidates = np.arange(len(self.ids))
+        similarities = np.asarray(self.vectors[candidates]) @ vector
+        order = np.argsort(-similarities)
+        result = []
+        for i in order:
+            ad_id = self.ids[candidates[i]]
+            if ad_id != exclude:
+                result.append((ad_id, float(similarities[i])))
+            if len(result) == k:
+                break
+        return result
+
+    def query_by_id(self, ad_id, k=10):
+        """
+        Finds the ads most similar to an indexed ad.
+        :param ad_id: The id of the ad.
+        :param k: The amount of neighbors.
+        :return: A list of (ad id, cosine similarity) tuples, most similar first.
+        """
+        if ad_id not in self.rows:
+            raise KeyError(f'Ad `{ad_id}` is not in the embedding index')
+        return self.query_vector(np.asarray(self.vectors[self.rows[ad_id]]), k, exclude=ad_id)
+
+    def query_by_text(self, text, k=10):
+        """
+        Finds the ads most similar to a free text, e.g. 'claim your free bitcoin'.
+        :param text: The text to search for.
+        :param k: The amount of neighbors.
+        :return: A list of (ad id, cosine similarity) tuples, most similar first.
+        """
+        return self.query_vector(self.encode([text])[0], k)
+
+    def propagate(self, labeled, k=10):
+        """
+        Propagates the manual labels to all unlabeled indexed ads: the scam score of an ad is the similarity weighted
+        vote of its k most similar manually labeled ads.
+        :param labeled: A dictionary of ad id -> manual scam label (True/False).
+        :param k: The amount of labeled neighbors that vote.
+        :return: A list of (ad id, scam score between 0 and 1) tuples of the unlabeled ads, most likely scams first.
+        """
+        labeled_rows = [self.rows[ad_id] for ad_id in labeled if ad_id in self.rows]
+        if not labeled_rows:
+            return []
+        labeled_vectors = np.asarray(self.vectors[labeled_rows])
+        labels = np.array([labeled[self.ids[row]] for row in labeled_rows], dtype=np.float32)
+        k = min(k, len(labeled_rows))
+        scores = []
+        for start in range(0, len(self.ids), 4096):
+            similarities = np.asarray(self.vectors[start:start + 4096]) @ labeled_vectors.T
+            nearest = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+            weights = np.clip(np.take_along_axis(similarities, nearest, axis=1), 0, None)
+            votes = (weights * labels[nearest]).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-6)
+            scores += [(self.ids[start + i], float(vote)) for i, vote in enumerate(votes)
+                       if self.ids[start + i] not in labeled]
+        return sorted(scores, key=lambda item: item[1], reverse=True)
+
+    @staticmethod
+    def manual_labels(ads):
+        """
+        :return: A dictionary of ad id -> manual scam label for all ads that were labeled manually.
+        """
+        return {ad['id']: bool(ad['manual_label']['scam']) for ad in ads if 'scam' in ad.get('manual_label', {})}
+
+
+if __name__ == '__main__':
+    ads = []
+    for path in ['output/filtered-unique.json', 'output/samples.json']:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                ads += json.load(f)['data']
+    index = EmbeddingIndex()
+    index.build(ads)
+    for ad_id, score in index.propagate(EmbeddingIndex.manual_labels(ads))[:25]:
+        print(f'\t- {ad_id}: {score:.3f}')
@@ -1,7 +1,9 @@
 import datetime
-import json
 import os
 
+from archive import dump_ads, is_ads_file, load_ads, output_path
+from pipeline import Manifest
+from metrics import Metrics, format_duration
 
 class Filter:
     """
@@ -13,6 +15,20 @@ class Filter:
     def __init__(self):
         self.keys = ['about_crypto', 'free_crypto', 'giveaway', 'unrealistic', 'bio_link', 'limited_time']
         self.data = []
+        self.manifest = Manifest()
+        self.metrics = Metrics('filter')
+
+    def input_files(self):
+        """
+        :return: All collected JSON files the filter reads from, these are the inputs of the filter stage.
+        """
+        files = []
+        for term in sorted(os.listdir('output')):
+            if not os.path.isdir(f'output/{term}/json'):
+                continue
+            files += [f'output/{term}/json/{file}' for file in sorted(os.listdir(f'output/{term}/json'))
+                      if is_ads_file(file)]
+        return files
 
     def filter(self):
         """
@@ -24,19 +40,33 @@ class Filter:
         :return:
         """
         start_time = datetime.datetime.now()
+        inputs = self.input_files()
+        params = {'keys': self.keys}
+        output = output_path('output/filtered.json')  # output/filtered.jsonl.zst in archive mode
+        if not self.manifest.is_stale('filter', inputs, params, outputs=[output]):
+            print(f'[{start_time.strftime("%H:%M")}] » Filtered ads are up to date, skipping...')
+            return
         print(f'[{start_time.strftime("%H:%M")}] » Filtering the ads...')
-        for term in os.listdir('output'):
-            for file in os.listdir(f'output/{term}/json'):
-                with open(f'output/{term}/json/{file}', 'r') as f:
-                    ads = json.load(f)['data']
-                    ads = [ad for ad in ads if self.keep(ad)]
-                    for ad in ads:
-                        ad['search_term'] = term
-                    self.data.extend(ads)
+        self.metrics.reset()
+        self.data = []
+        for path in inputs:
+            term = path.split('/')[1]
+            with self.metrics.timer('filter.read'):
+                ads = load_ads(path)['data']
+            with self.metrics.timer('filter.keep', ads=len(ads)):
+                ads = [ad for ad in ads if self.keep(ad)]
+            for ad in ads:
+                ad['search_term'] = term
+            self.data.extend(ads)
         self.data.sort(key=self.count, reverse=True)
         print(f'» Found {len(self.data)} crypto-related ads.')
-        with open('output/filtered.json', 'w') as f:
-            json.dump({"data": self.data}, f, indent=4)
+        with self.metrics.timer('filter.write', ads=len(self.data)):
+            dump_ads({"data": self.data}, output)
+        self.manifest.record('filter', inputs, params, outputs=[output])
+        end_time = datetime.datetime.now()
+        print(f'[{end_time.strftime("%H:%M")}] » Finished filtering within '
+              f'{format_duration((end_time - start_time).total_seconds())}!')
+        self.metrics.report()
 
     def keep(self, ad):
         """
@@ -47,6 +77,16 @@ class Filter:
         return ('classification' in ad and ad['classification'].get('about_crypto', False) and
                 any(ad['classification'].get(key, False) for key in ['free_crypto', 'giveaway']))
 
+    @staticmethod
+    def rejects(criteria):
+        """
+        Checks whether the criteria decided so far already make keep return False, whatever the missing criteria are.
+        :param criteria: The (partial) criteria of an ad.
+        :return: True if the ad will not be kept.
+        """
+        return criteria.get('about_crypto') is False or \
+            (criteria.get('free_crypto') is False and criteria.get('giveaway') is False)
+
     def count(self, ad):
         """
         This method counts the number of criteria that are True in the 'classification' dictionary.
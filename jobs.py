@@ -0,0 +1,414 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the job queue that spreads transcription, criteria generation and labeling over
+              worker processes on any number of machines. The pipeline enqueues one task per ad and applies the results
+              to the JSON files itself, the workers only pull tasks and return results. A claimed task is leased, a
+              task of a crashed worker is handed out again once its lease expires and failing tasks are retried a few
+              times. Finished results stay in the queue until the pipeline has stored them, so nothing is redone after
+              a crash of either side. The queue is an SQLite file (':memory:' for an in-process queue), other machines
+              reach it through the small HTTP server in this file:
+                  python jobs.py serve --host 0.0.0.0 --port 8010                (on the machine with the output)
+                  python jobs.py work --queue http://<host>:8010 --kinds label    (on every worker machine)
+              The server has no authentication and only listens on 127.0.0.1 by default, only bind it to other
+              interfaces (--host 0.0.0.0) on a trusted network.
+@date: 19-10-2026
+"""
+import argparse
+import datetime
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+KINDS = ('transcribe', 'criteria', 'label')
+
+
+def open_queue(spec):
+    """
+    Opens the queue described by JOB_QUEUE.
+    :param spec: 'memory' for an in-process queue, an http(s) URL of a QueueServer or the path of an SQLite file.
+    :return: The queue, None if the spec is empty.
+    """
+    if not spec:
+        return None
+    if spec == 'memory':
+        return JobQueue(':memory:')
+    if spec.startswith(('http://', 'https://')):
+        return RemoteQueue(spec)
+    return JobQueue(spec)
+
+
+class JobQueue:
+    """
+    This class is the queue itself, stored in SQLite. Every task has a unique key (kind, ad id and the parameters that
+    influence the result), so enqueueing the same work twice is a no-op and a finished result is picked up again.
+    """
+
+    def __init__(self, path='output/jobs.sqlite', lease_seconds=None, max_attempts=None):
+        """
+        :param path: The path of the SQLite file, ':memory:' for a queue that only lives in this process.
+        :param lease_seconds: How long a worker may work on a task before it is handed out again, JOB_LEASE_SECONDS
+                              or 600 by default. It has to be longer than the slowest task.
+        :param max_attempts: How many times a task is tried before it fails, JOB_MAX_ATTEMPTS or 3 by default.
+        """
+        self.path = path
+        self.lease_seconds = float(os.getenv('JOB_LEASE_SECONDS', 600)) if lease_seconds is None else lease_seconds
+        self.max_attempts = int(os.getenv('JOB_MAX_ATTEMPTS', 3)) if max_attempts is None else max_attempts
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        # Autocommit mode, the transactions are started explicitly where needed
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        if path != ':memory:':
+            self.db.execute('PRAGMA journal_mode=WAL')  # Workers on this machine read while the pipeline writes
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, kind TEXT NOT NULL, '
+                        'payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT \'pending\', attempts INTEGER NOT NULL '
+                        'DEFAULT 0, worker TEXT, lease_until REAL, result TEXT, error TEXT, created REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_kind_status ON jobs (kind, status)')
+
+    def enqueue(self, kind, key, payload):
+        """
+        Adds a task, unless a task with the same key exists.
+        :param kind: The kind of task, one of KINDS.
+        :param key: The unique key of the task.
+        :param payload: The JSON serializable input of the task.
+        :return: True if the task was added.
+        """
+        return self.enqueue_many(kind, [(key, payload)]) == 1
+
+    def enqueue_many(self, kind, tasks):
+        """
+        Adds tasks in one transaction, existing keys are skipped.
+        :param kind: The kind of the tasks.
+        :param tasks: A list of (key, payload) tuples.
+        :return: The amount of added tasks.
+        """
+        now = time.time()
+        with self.lock:
+            before = self.db.total_changes
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.executemany('INSERT OR IGNORE INTO jobs (key, kind, payload, created) VALUES (?, ?, ?, ?)',
+                                [(key, kind, json.dumps(payload), now) for key, payload in tasks])
+            self.db.execute('COMMIT')
+            return self.db.total_changes - before
+
+    def claim(self, worker, kinds=KINDS):
+        """
+        Leases the oldest pending task, or a task of which the lease expired.
+        :param worker: The name of the worker.
+        :param kinds: The kinds of tasks the worker handles.
+        :return: A dictionary with the key, kind, payload and attempts of the task, None if there is nothing to do.
+        """
+        now = time.time()
+        marks = ','.join('?' * len(kinds))
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                # Tasks that used up their attempts while leased (e.g. the worker crashed every time) fail for good
+                self.db.execute(f'UPDATE jobs SET status = \'failed\', error = COALESCE(error, \'lease expired\') '
+                                f'WHERE status = \'leased\' AND lease_until < ? AND attempts >= ? '
+                                f'AND kind IN ({marks})', (now, self.max_attempts, *kinds))
+                row = self.db.execute(f'SELECT key, kind, payload, attempts FROM jobs WHERE kind IN ({marks}) AND '
+                                      f'(status = \'pending\' OR (status = \'leased\' AND lease_until < ?)) '
+                                      f'ORDER BY created LIMIT 1', (*kinds, now)).fetchone()
+                if row is not None:
+                    self.db.execute('UPDATE jobs SET status = \'leased\', worker = ?, lease_until = ?, '
+                                    'attempts = attempts + 1 WHERE key = ?', (worker, now + self.lease_seconds, row[0]))
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return {'key': row[0], 'kind': row[1], 'payload': json.loads(row[2]), 'attempts': row[3] + 1}
+
+    def complete(self, key, result):
+        """
+        Stores the result of a task. A result that comes in after the lease expired is still accepted, the work is
+        done after all.
+        :param key: The key of the task.
+        :param result: The JSON serializable result.
+        """
+        with self.lock:
+            self.db.execute('UPDATE jobs SET status = \'done\', result = ?, lease_until = NULL, error = NULL '
+                            'WHERE key = ? AND status != \'done\'', (json.dumps(result), key))
+
+    def fail(self, key, error):
+        """
+        Releases a task after an error, it is retried until it used up its attempts.
+        :param key: The key of the task.
+        :param error: The error message.
+        """
+        with self.lock:
+            self.db.execute('UPDATE jobs SET status = CASE WHEN attempts >= ? THEN \'failed\' ELSE \'pending\' END, '
+                            'error = ?, lease_until = NULL WHERE key = ? AND status = \'leased\'',
+                            (self.max_attempts, str(error), key))
+
+    def results(self, keys):
+        """
+        :param keys: The keys of the tasks.
+        :return: A dictionary of key -> {status, result, error} of the tasks that are done or failed.
+        """
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):  # SQLite limits the amount of parameters of a query
+                chunk = keys[i:i + 500]
+                for key, status, result, error in self.db.execute(
+                        f'SELECT key, status, result, error FROM jobs WHERE key IN ({",".join("?" * len(chunk))}) '
+                        f'AND status IN (\'done\', \'failed\')', chunk):
+                    found[key] = {'status': status, 'result': json.loads(result) if result else None, 'error': error}
+        return found
+
+    def remove(self, keys):
+        """
+        Removes tasks, once their results are stored or their failures reported.
+        :param keys: The keys of the tasks.
+        """
+        with self.lock:
+            self.db.executemany('DELETE FROM jobs WHERE key = ?', [(key,) for key in keys])
+
+    def counts(self):
+        """
+        :return: A dictionary of kind -> status -> amount of tasks.
+        """
+        counts = {}
+        with self.lock:
+            for kind, status, amount in self.db.execute('SELECT kind, status, COUNT(*) FROM jobs '
+                                                        'GROUP BY kind, status'):
+                counts.setdefault(kind, {})[status] = amount
+        return counts
+
+
+class RemoteQueue:
+    """
+    This class is the client of a QueueServer, it has the same methods as the JobQueue.
+    """
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def call(self, method, **arguments):
+        """
+        Calls a method of the queue on the server.
+        :return: The return value of the method.
+        """
+        request = urllib.request.Request(f'{self.url}/api/{method}', data=json.dumps(arguments).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def enqueue(self, kind, key, payload):
+        return self.call('enqueue', kind=kind, key=key, payload=payload)
+
+    def enqueue_many(self, kind, tasks):
+        return self.call('enqueue_many', kind=kind, tasks=tasks)
+
+    def claim(self, worker, kinds=KINDS):
+        return self.call('claim', worker=worker, kinds=list(kinds))
+
+    def complete(self, key, result):
+        return self.call('complete', key=key, result=result)
+
+    def fail(self, key, error):
+        return self.call('fail', key=key, error=str(error))
+
+    def results(self, keys):
+        return self.call('results', keys=list(keys))
+
+    def remove(self, keys):
+        return self.call('remove', keys=list(keys))
+
+    def counts(self):
+        return self.call('counts')
+
+
+class QueueServer:
+    """
+    This class serves a JobQueue over HTTP, so workers on other machines can use it. Every method of the queue is a
+    POST /api/<method> with the arguments as JSON object, GET /api/counts shows the progress.
+    """
+    METHODS = ('enqueue', 'enqueue_many', 'claim', 'complete', 'fail', 'results', 'remove', 'counts')
+
+    def __init__(self, queue, host='127.0.0.1', port=8010):
+        self.queue = queue
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        """
+        :return: The URL of the queue, to be used as JOB_QUEUE.
+        """
+        return f'http://{self.server.server_address[0]}:{self.server.server_address[1]}'
+
+    def serve(self):
+        """
+        Serves the queue until the user presses Ctrl+C.
+        """
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Job queue `{self.queue.path}` running at {self.url} '
+              f'(press Ctrl+C to stop)')
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+
+    def handler(self):
+        """
+        :return: The request handler class bound to this server.
+        """
+        app = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if urlparse(self.path).path == '/api/counts':
+                    return self.send(200, app.queue.counts())
+                self.send(404, {'error': 'not found'})
+
+            def do_POST(self):
+                method = urlparse(self.path).path.removeprefix('/api/')
+                if method not in QueueServer.METHODS:
+                    return self.send(404, {'error': 'not found'})
+                arguments = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                try:
+                    self.send(200, getattr(app.queue, method)(**arguments))
+                except (TypeError, sqlite3.Error) as e:
+                    self.send(400, {'error': str(e)})
+
+        return Handler
+
+
+class Worker:
+    """
+    This class pulls tasks from the queue and runs them with an AIToolBox. The workers need the same parameters
+    (.env) as the pipeline, a task made with other parameters fails instead of returning a result the pipeline would
+    not accept. Transcription workers also need the videos, e.g. on a shared drive mounted at the same path.
+    """
+
+    def __init__(self, queue, kinds=KINDS, ai=None, name=None, poll_seconds=None):
+        """
+        :param queue: The JobQueue or RemoteQueue.
+        :param kinds: The kinds of tasks to run.
+        :param ai: The AIToolBox, a new one by default.
+        :param name: The name of the worker, host name and process id by default.
+        :param poll_seconds: How long to wait when there is nothing to do, JOB_POLL_SECONDS or 2 by default.
+        """
+        if ai is None:
+            from ai import AIToolBox
+            ai = AIToolBox()
+        self.queue = queue
+        self.kinds = tuple(kinds)
+        self.ai = ai
+        self.name = name or f'{socket.gethostname()}-{os.getpid()}'
+        self.poll_seconds = float(os.getenv('JOB_POLL_SECONDS', 2)) if poll_seconds is None else poll_seconds
+        self.stopped = threading.Event()
+        self.done = 0
+        self.failed = 0
+
+    def run_task(self, task):
+        """
+        Runs a single task.
+        :param task: The claimed task.
+        :return: The result of the task.
+        :raises ValueError: If the task was made with other parameters or its ad could not be processed.
+        """
+        payload = task['payload']
+        if payload['signature'] != self.ai.job_signature(task['kind']):
+            raise ValueError(f'`{self.name}` runs with `{self.ai.job_signature(task["kind"])}` instead of '
+                             f'`{payload["signature"]}`, check the .env of the worker')
+        if task['kind'] == 'transcribe':
+            text, language, speech, model = self.ai.transcribe(payload['video_path'], payload['id'])
+            return {'text': text, 'language': language, 'speech': speech, 'model': model}
+        if task['kind'] == 'criteria':
+            classification, _ = self.ai.criteria(payload['ad'])
+            if classification is None:
+                raise ValueError(f'Could not generate criteria for ad: {payload["ad"]["id"]}')
+            return classification
+        if task['kind'] == 'label':
+            return self.ai.label(payload['ad'])
+        raise ValueError(f'Unknown kind of task `{task["kind"]}`')
+
+    def run(self, until_empty=False):
+        """
+        Pulls and runs tasks until stop is called.
+        :param until_empty: Whether to stop once the queue has no task for this worker.
+        """
+        while not self.stopped.is_set():
+            task = self.queue.claim(self.name, self.kinds)
+            if task is None:
+                if until_empty:
+                    break
+                self.stopped.wait(self.poll_seconds)
+                continue
+            try:
+                result = self.run_task(task)
+            except Exception as e:
+                self.failed += 1
+                print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Task `{task["key"]}` failed '
+                      f'(attempt {task["attempts"]}): {e}')
+                self.queue.fail(task['key'], e)
+                continue
+            self.queue.complete(task['key'], result)
+            self.done += 1
+
+    def start(self):
+        """
+        Runs the worker in a background thread, used for the in-process workers of the pipeline.
+        :return: The thread.
+        """
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """
+        Makes the worker stop after its current task.
+        """
+        self.stopped.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the job queue or run a worker.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='Serve an SQLite job queue to workers on other machines')
+    serve.add_argument('--path', default='output/jobs.sqlite')
+    serve.add_argument('--host', default='127.0.0.1',
+                       help='Interface to listen on, 0.0.0.0 for other machines (only on a trusted network)')
+    serve.add_argument('--port', type=int, default=8010)
+    work = commands.add_parser('work', help='Run tasks from the job queue')
+    work.add_argument('--queue', default=None, help='SQLite path or URL of the queue (JOB_QUEUE)')
+    work.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    work.add_argument('--until-empty', action='store_true', help='Stop when there is nothing to do')
+    args = parser.parse_args()
+    if args.command == 'serve':
+        QueueServer(JobQueue(args.path), args.host, args.port).serve()
+    else:
+        from dotenv import load_dotenv
+        load_dotenv()
+        worker = Worker(open_queue(args.queue or os.getenv('JOB_QUEUE') or 'output/jobs.sqlite'), args.kinds)
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Worker `{worker.name}` running '
+              f'{", ".join(args.kinds)} tasks (press Ctrl+C to stop)')
+        try:
+            worker.run(args.until_empty)
+        except KeyboardInterrupt:
+            pass
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Worker `{worker.name}` stopped: {worker.done} tasks '
+              f'done, {worker.failed} failed')
@@ -0,0 +1,414 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the local web app for manual labeling. It serves the ads from an in-memory index,
+              the page prefetches the next ads and is fully keyboard driven (y = scam, n = not a scam, s = skip,
+              u = undo, Y / N = label the whole campaign of the ad). Labels are appended to output/labels.jsonl, so
+              nothing is rewritten per label and multiple reviewers can label concurrently: every reviewer leases a
+              disjoint part of the queue.
+@date: 19-10-2026
+"""
+import datetime
+import json
+import os
+import threading
+import time
+import webbrowser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+LEASE_SECONDS = 600
+DISPLAY_FIELDS = ['id', 'page_id', 'page_name', 'search_term', 'ad_creative_bodies', 'ad_creative_link_titles',
+                  'ad_creative_link_descriptions', 'ad_creative_link_captions', 'video_transcription', 'languages']
+
+
+class LabelLog:
+    """
+    This class is the append-only log of manual labels. The last label of an ad wins when the log is replayed.
+    """
+
+    def __init__(self, path='output/labels.jsonl'):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def append(self, ad_id, scam, reviewer):
+        """
+        Appends a label to the log and flushes it to disk immediately.
+        :param ad_id: The id of the labeled ad.
+        :param scam: The label, None to undo an earlier label.
+        :param reviewer: The name of the reviewer.
+        """
+        entry = {'id': ad_id, 'scam': scam, 'reviewer': reviewer, 'at': datetime.datetime.now().isoformat()}
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+
+    def replay(self):
+        """
+        Reads the log.
+        :return: A dictionary of ad id -> label entry (scam None means the label was undone).
+        """
+        labels = {}
+        if not os.path.exists(self.path):
+            return labels
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    labels[entry['id']] = entry
+        return labels
+
+    def apply(self, ads):
+        """
+        Applies the logged labels to a list of ads as 'manual_label'.
+        :param ads: The ads to update in place.
+        :return: The amount of ads of which the label changed.
+        """
+        labels = self.replay()
+        changed = 0
+        for ad in ads:
+            entry = labels.get(ad['id'])
+            if entry is None:
+                continue
+            if entry['scam'] is None:
+                changed += 'manual_label' in ad
+                ad.pop('manual_label', None)
+            elif ad.get('manual_label', {}).get('scam') != entry['scam']:
+                ad['manual_label'] = {'scam': entry['scam'], 'reviewer': entry['reviewer']}
+                changed += 1
+        return changed
+
+
+class LabelingServer:
+    """
+    This class serves the labeling app. The queue is the list of ads in the given order, or the order of a ReviewQueue
+    when a ranking is given, ads that already have a manual label are skipped. A reviewer leases the ads it receives
+    for LEASE_SECONDS, so reviewers never get the same ad. A skipped ad is released to the other reviewers and not
+    served to the reviewer that skipped it again. With campaigns (see campaigns.py) the app shows the size of
+    the campaign of an ad and a reviewer can label all unlabeled ads of the campaign at once.
+    """
+
+    def __init__(self, ads, log=None, host='127.0.0.1', port=8000, on_label=None, ranking=None, campaigns=None):
+        self.ads = {ad['id']: ad for ad in ads}
+        self.queue = [ad['id'] for ad in ads]
+        self.log = log or LabelLog()
+        self.log.apply(ads)
+        self.ranking = ranking
+        self.leases = {}  # ad id -> (reviewer, expiry)
+        self.skipped = {}  # reviewer -> ids of the ads the reviewer skipped
+        self.lock = threading.Lock()
+        self.on_label = on_label
+        self.campaigns = campaigns
+        self.labeled = 0
+        self.started = time.time()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        """
+        :return: The URL of the labeling app.
+        """
+        return f'http://{self.server.server_address[0]}:{self.server.server_address[1]}/'
+
+    def next(self, reviewer, n=5, exclude=()):
+        """
+        Leases the next unlabeled ads of the queue to a reviewer.
+        :param reviewer: The name of the reviewer.
+        :param n: The amount of ads.
+        :param exclude: Ids the reviewer already has, e.g. prefetched ads.
+        :return: The list of ads, with only the fields the app displays.
+        """
+        now = time.time()
+        result = []
+        with self.lock:
+            if self.ranking is not None:
+                return self.next_ranked(reviewer, n, now)
+            skipped = self.skipped.get(reviewer, set())
+            for ad_id in self.queue:
+                if len(result) == n:
+                    break
+                ad = self.ads[ad_id]
+                lease = self.leases.get(ad_id)
+                if 'scam' in ad.get('manual_label', {}) or ad_id in exclude or ad_id in skipped or \
+                        (lease and lease[0] != reviewer and lease[1] > now):
+                    continue
+                self.leases[ad_id] = (reviewer, now + LEASE_SECONDS)
+                result.append(self.display(ad_id))
+        return result
+
+    def next_ranked(self, reviewer, n, now):
+        """
+        Leases the most informative ads of the ranking to a reviewer. Ads of which the lease expired without a label
+        go back into the ranking first, the ads the reviewer skipped go back after the lease. Must be called while
+        holding the lock.
+        :return: The list of ads, with only the fields the app displays.
+        """
+        for ad_id, (_, expiry) in list(self.leases.items()):
+            if expiry <= now:
+                del self.leases[ad_id]
+                self.ranking.push(ad_id)
+        skipped = self.skipped.get(reviewer, set())
+        result, passed = [], []
+        while len(result) < n:
+            taken = self.ranking.take(n - len(result))
+            if not taken:
+                break
+            for ad_id in taken:
+                if ad_id in skipped:
+                    passed.append(ad_id)
+                    continue
+                self.leases[ad_id] = (reviewer, now + LEASE_SECONDS)
+                result.append(self.display(ad_id))
+        for ad_id in passed:
+            self.ranking.push(ad_id)
+        return result
+
+    def display(self, ad_id):
+        """
+        :return: The fields of an ad that the app displays, with the size of its campaign.
+        """
+        ad = self.ads[ad_id]
+        result = {key: ad[key] for key in DISPLAY_FIELDS if key in ad}
+        if self.campaigns is not None:
+            result['campaign_size'] = len(self.campaigns.siblings(ad_id))
+        return result
+
+    def label(self, ad_id, scam, reviewer):
+        """
+        Stores a label: appends it to the log, updates the in-memory ad and releases the lease.
+        :param ad_id: The id of the ad.
+        :param scam: True, False or None to undo.
+        :param reviewer: The name of the reviewer.
+        """
+        if ad_id not in self.ads:
+            raise KeyError(ad_id)
+        self.log.append(ad_id, scam, reviewer)
+        with self.lock:
+            ad = self.ads[ad_id]
+            if self.ranking is not None:
+                self.ranking.label(ad_id, scam)
+            if scam is None:
+                ad.pop('manual_label', None)
+                self.leases[ad_id] = (reviewer, time.time() + LEASE_SECONDS)
+            else:
+                ad['manual_label'] = {'scam': scam, 'reviewer': reviewer}
+                self.leases.pop(ad_id, None)
+                self.labeled += 1
+        if self.on_label:
+            self.on_label(ad)
+
+    def skip(self, ad_id, reviewer):
+        """
+        Skips an ad: the reviewer is not served it again and its lease is released, so other reviewers get it.
+        :param ad_id: The id of the ad.
+        :param reviewer: The name of the reviewer.
+        """
+        if ad_id not in self.ads:
+            raise KeyError(ad_id)
+        with self.lock:
+            self.skipped.setdefault(reviewer, set()).add(ad_id)
+            lease = self.leases.get(ad_id)
+            if lease and lease[0] == reviewer:
+                del self.leases[ad_id]
+                if self.ranking is not None:
+                    self.ranking.push(ad_id)
+
+    def label_campaign(self, ad_id, scam, reviewer):
+        """
+        Labels an ad and every ad of its campaign that does not have a manual label yet.
+        :param ad_id: The id of the ad.
+        :param scam: True or False.
+        :param reviewer: The name of the reviewer.
+        :return: The ids of the labeled ads, so the label can be undone per ad.
+        """
+        if ad_id not in self.ads:
+            raise KeyError(ad_id)
+        siblings = self.campaigns.siblings(ad_id) if self.campaigns is not None else [ad_id]
+        with self.lock:
+            ids = [other for other in siblings if other == ad_id or
+                   'scam' not in self.ads[other].get('manual_label', {})]
+        for other in ids:
+            self.label(other, scam, reviewer)
+        return ids
+
+    def stats(self):
+        """
+        :return: The progress of the labeling session.
+        """
+        with self.lock:
+            done = sum('scam' in ad.get('manual_label', {}) for ad in self.ads.values())
+        hours = max(time.time() - self.started, 60) / 3600
+        return {'labeled': done, 'total': len(self.ads), 'session': self.labeled,
+                'per_hour': round(self.labeled / hours, 1)}
+
+    def serve(self, open_browser=True):
+        """
+        Serves the app until the user presses Ctrl+C.
+        :param open_browser: Whether to open the app in the browser once.
+        """
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Labeling app running at {self.url} '
+              f'(press Ctrl+C to stop)')
+        if open_browser:
+            webbrowser.open(self.url)
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Stopped labeling: {self.stats()}')
+
+    def handler(self):
+        """
+        :return: The request handler class bound to this server.
+        """
+        app = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, payload, content_type='application/json'):
+                data = payload.encode('utf-8') if isinstance(payload, str) else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == '/':
+                    return self.send(200, PAGE, 'text/html')
+                if url.path == '/api/next':
+                    reviewer = query.get('reviewer', ['anonymous'])[0]
+                    exclude = set(query.get('exclude', [''])[0].split(','))
+                    return self.send(200, app.next(reviewer, int(query.get('n', [5])[0]), exclude))
+                if url.path == '/api/stats':
+                    return self.send(200, app.stats())
+                self.send(404, {'error': 'not found'})
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path not in ('/api/label', '/api/skip'):
+                    return self.send(404, {'error': 'not found'})
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                ids = [body.get('id')]
+                try:
+                    if path == '/api/skip':
+                        app.skip(body['id'], body.get('reviewer', 'anonymous'))
+                    elif body.get('campaign') and body.get('scam') is not None:
+                        ids = app.label_campaign(body['id'], body['scam'], body.get('reviewer', 'anonymous'))
+                    else:
+                        app.label(body['id'], body.get('scam'), body.get('reviewer', 'anonymous'))
+                except KeyError:
+                    return self.send(400, {'error': 'unknown ad'})
+                self.send(200, {**app.stats(), 'ids': ids})
+
+        return Handler
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+  <head>
+    <title>MAD - Manual labeling</title>
+    <style>
+      * { background-color: #0f0f0f; color: #808080; font-size: 1.15rem; border-radius: 1rem; }
+      body { padding: 0 1rem; }
+      .ad { display: grid; grid-template-columns: repeat(2, 1fr); gap: 1rem; }
+      h1, h3, h4 { background: transparent; text-align: center; color: white; }
+      .title, .desc, .links, .help { grid-column: span 2; text-align: center; }
+      .bodies, .transcription { background: #1a1a1f; color: #8181b1; padding: 1rem; white-space: pre-wrap; }
+      a { color: #5f4af0; text-decoration: none; margin: 0 1rem; }
+      .help { color: #505050; }
+    </style>
+  </head>
+  <body>
+    <div class="ad">
+      <h1 class="title" id="title">Loading...</h1>
+      <h3 class="desc" id="desc"></h3>
+      <div class="bodies"><h4>Ad Creative Bodies:</h4><div id="bodies"></div></div>
+      <div class="transcription"><h4>Video Transcription:</h4><div id="transcription"></div></div>
+      <div class="links" id="links"></div>
+      <div class="help" id="help">y = scam, n = not a scam, s = skip, u = undo last label, Y / N = whole campaign</div>
+    </div>
+    <script>
+      const reviewer = new URLSearchParams(location.search).get('reviewer') ||
+        localStorage.getItem('reviewer') || prompt('Reviewer name?') || 'anonymous';
+      localStorage.setItem('reviewer', reviewer);
+      let buffer = [], current = null, history = [], fetching = false;
+
+      async function prefetch() {
+        if (fetching || buffer.length >= 3) return;
+        fetching = true;
+        const exclude = buffer.map(ad => ad.id).concat(current ? [current.id] : []).join(',');
+        const response = await fetch(`/api/next?reviewer=${encodeURIComponent(reviewer)}&n=10&exclude=${exclude}`);
+        buffer = buffer.concat(await response.json());
+        fetching = false;
+        if (!current) show();
+      }
+
+      function text(id, value) { document.getElementById(id).textContent = value || ''; }
+
+      function show() {
+        current = buffer.shift() || null;
+        if (!current) {
+          text('title', 'Nothing left to label in your queue'); text('bodies'); text('transcription'); return;
+        }
+        text('title', `${(current.ad_creative_link_titles || []).join(' ')} - ${current.id}`);
+        text('desc', `${(current.ad_creative_link_descriptions || []).join(' ')} ${current.search_term || ''}` +
+          (current.campaign_size > 1 ? ` - campaign of ${current.campaign_size} ads` : ''));
+        text('bodies', (current.ad_creative_bodies || []).join('\\n\\n'));
+        text('transcription', current.video_transcription);
+        const links = document.getElementById('links');
+        links.replaceChildren();
+        const add = (href, label) => {
+          const a = document.createElement('a'); a.href = href; a.target = '_blank'; a.textContent = label;
+          links.appendChild(a);
+        };
+        add(`https://www.facebook.com/ads/library/?id=${current.id}`, 'Ad URL');
+        if (current.page_id) add(`https://www.facebook.com/ads/library/?active_status=all&ad_type=all&country=ALL` +
+          `&media_type=all&search_type=page&view_all_page_id=${current.page_id}`, 'Page URL');
+        (current.ad_creative_link_captions || []).forEach((caption, i) => add(`https://${caption}`, `Link ${i + 1}`));
+        prefetch();
+      }
+
+      async function label(id, scam, campaign = false) {
+        const response = await fetch('/api/label', {method: 'POST', headers: {'Content-Type': 'application/json'},
+          body: JSON.stringify({id: id, scam: scam, reviewer: reviewer, campaign: campaign})});
+        const stats = await response.json();
+        text('help', `y = scam, n = not a scam, s = skip, u = undo last label, Y / N = whole campaign - ` +
+          `${stats.labeled} / ${stats.total} labeled, ${stats.per_hour} per hour`);
+        return stats.ids;
+      }
+
+      document.addEventListener('keydown', event => {
+        if (event.key === 'u' && history.length) {
+          const ad = history.pop();
+          ad.ids.then(ids => ids.forEach(id => label(id, null)));
+          if (current) buffer.unshift(current);
+          buffer.unshift(ad);
+          current = null;
+          return show();
+        }
+        if (!current || !['y', 'n', 's', 'Y', 'N'].includes(event.key)) return;
+        if (event.key !== 's') {
+          const campaign = event.key === 'Y' || event.key === 'N';
+          current.ids = label(current.id, event.key.toLowerCase() === 'y', campaign);
+          history.push(current);
+          // The other ads of the campaign are labeled now, so they are dropped from the prefetched ads
+          if (campaign) current.ids.then(ids => { buffer = buffer.filter(ad => !ids.includes(ad.id)); });
+        } else {
+          fetch('/api/skip', {method: 'POST', headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({id: current.id, reviewer: reviewer})});
+        }
+        show();
+      });
+      prefetch();
+    </script>
+  </body>
+</html>
+"""
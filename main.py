@@ -1,13 +1,110 @@
 """
 @author: Luuk Kablan
 @description: Main code that provides Console User Interface to perform the steps of the project.
+              The steps can also be run without the menu, e.g. `python main.py label --concurrency 8`.
+              The collector, filter, AI toolbox and inspector are only created (and their heavy dependencies such as
+              Whisper, pandas and matplotlib only imported) when a step needs them.
 @date: 31-7-2024
 """
+import argparse
+import importlib
 
-from ai import AIToolBox
-from collect import Collector
-from filter import Filter
-from manual import Inspector
+import archive
+
+SUBSYSTEMS = {
+    'collector': ('collect', 'Collector'),
+    'crypto_filter': ('filter', 'Filter'),
+    'classifier': ('ai', 'AIToolBox'),
+    'inspector': ('manual', 'Inspector'),
+}
+
+
+class Subsystems:
+    """
+    This class creates the subsystems on first access, e.g. `subsystems.classifier` imports ai.py and creates the
+    AIToolBox the first time and returns the same instance afterwards.
+    """
+
+    def __getattr__(self, name):
+        if name not in SUBSYSTEMS:
+            raise AttributeError(name)
+        module, cls = SUBSYSTEMS[name]
+        instance = getattr(importlib.import_module(module), cls)()
+        setattr(self, name, instance)  # Later accesses find the attribute and skip __getattr__
+        return instance
+
+
+def pipeline(s, concurrency=None):
+    """
+    Executes all steps, the inspector is created after labeling so it reads the latest data.
+    """
+    s.collector.collect()
+    s.classifier.transcribe_all()
+    if archive.enabled():
+        # The transcribed videos can be replaced by their audio
+        archive.Archiver(transcribed=s.classifier.has_transcription).run()
+    s.classifier.generate_criteria()
+    s.crypto_filter.filter()
+    s.classifier.label_all(concurrency=concurrency)
+    s.inspector.inspect()
+
+
+def run(command, s, args):
+    """
+    Runs a command of the command line interface.
+    :param command: The name of the command.
+    :param s: The subsystems.
+    :param args: The parsed arguments.
+    """
+    if command == 'collect':
+        s.collector.collect()
+    elif command == 'transcribe':
+        s.classifier.transcribe_all()
+    elif command == 'criteria':
+        s.classifier.generate_criteria()
+    elif command == 'filter':
+        s.crypto_filter.filter()
+    elif command == 'label':
+        s.classifier.label_all(args.path, concurrency=args.concurrency)
+    elif command == 'inspect':
+        s.inspector.inspect(args.port, active=args.active)
+    elif command == 'stats':
+        s.inspector.print_stats()
+    elif command == 'relabel':
+        s.inspector.relabel(args.ids, args.confidence, args.disagreement, args.concurrency)
+    elif command == 'archive':
+        archive.Archiver(videos=args.videos, transcribed=s.classifier.has_transcription).run()
+    elif command == 'pipeline':
+        pipeline(s, args.concurrency)
+
+
+def parser():
+    """
+    :return: The argument parser of the command line interface.
+    """
+    result = argparse.ArgumentParser(description='Misleading Ad Detection, run without a command to open the menu.')
+    commands = result.add_subparsers(dest='command')
+    for name, description in [('collect', 'Collect data'), ('transcribe', 'Start video transcription'),
+                              ('criteria', 'Start criteria generation'), ('filter', 'Start crypto ad filtering'),
+                              ('stats', 'Show statistics')]:
+        commands.add_parser(name, help=description)
+    label = commands.add_parser('label', help='Start binary labeling')
+    label.add_argument('--path', default='output/filtered-unique.json')
+    label.add_argument('--concurrency', type=int, default=None, help='Concurrent requests (LABEL_CONCURRENCY)')
+    inspect = commands.add_parser('inspect', help='Open manual labeling tool')
+    inspect.add_argument('--port', type=int, default=None, help='Port of the labeling app (LABELING_PORT)')
+    inspect.add_argument('--active', action='store_true', help='Review the most uncertain unique ads')
+    relabel = commands.add_parser('relabel', help='Relabel samples')
+    relabel.add_argument('--concurrency', type=int, default=None, help='Concurrent requests (RELABEL_CONCURRENCY)')
+    relabel.add_argument('--ids', nargs='+', default=None, help='Only relabel these ads')
+    relabel.add_argument('--confidence', nargs='+', default=None, help='Only relabel ads with these confidences')
+    relabel.add_argument('--disagreement', action='store_true', help='Only relabel ads that differ from manual')
+    archiving = commands.add_parser('archive', help='Compress the collected JSON and archive transcribed videos')
+    archiving.add_argument('--videos', choices=archive.VIDEO_POLICIES, default=None,
+                           help='What happens to transcribed videos (ARCHIVE_VIDEOS)')
+    everything = commands.add_parser('pipeline', help='Execute all steps')
+    everything.add_argument('--concurrency', type=int, default=None, help='Concurrent label requests')
+    return result
 
 
 def main():
@@ -15,10 +112,10 @@ def main():
     Main function to open the console user interface.
     :return: None
     """
-    collector = Collector()
-    crypto_filter = Filter()
-    classifier = AIToolBox()
-    inspector = Inspector()
+    args = parser().parse_args()
+    s = Subsystems()
+    if args.command:
+        return run(args.command, s, args)
     while True:
         print('1. [AddDownloaderAPI]    Collect data')
         print('2. [Whisper STT]         Start video transcription')
@@ -32,28 +129,24 @@ def main():
         print('x. Exit')
         choice = input('» Enter your choice: ')
         if choice == '1':
-            collector.collect()
+            s.collector.collect()
         elif choice == '2':
-            classifier.transcribe_all()
+            s.classifier.transcribe_all()
         elif choice == '3':
-            classifier.generate_criteria()
+            s.classifier.generate_criteria()
         elif choice == '4':
-            crypto_filter.filter()
+            s.crypto_filter.filter()
         elif choice == '5':
-            classifier.label_all()
+            s.classifier.label_all()
         elif choice == '6':
-            inspector.inspect()
+            s.inspector.inspect(active=input('» Review the most uncertain unique ads instead of the samples? (y/n): ')
+                                .lower() == 'y')
         elif choice == '7':
-            inspector.print_stats()
+            s.inspector.print_stats()
         elif choice == '8':
-            inspector.relabel()
+            s.inspector.relabel()
         elif choice == '9':
-            collector.collect()
-            classifier.transcribe_all()
-            classifier.generate_criteria()
-            crypto_filter.filter()
-            classifier.label_all()
-            inspector.inspect()
+            pipeline(s)
         else:
             print('» Closing the program...')
             break
@@ -62,4 +155,3 @@ def main():
 # Press the green button in the gutter to run the script.
 if __name__ == '__main__':
     main()
-
@@ -1,16 +1,19 @@
 import datetime
 import json
 import os
-import webbrowser
 import random
-from collections import defaultdict
-
-from ai import AIToolBox
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from active import ReviewQueue
+from archive import resolve
+from campaigns import Campaigns
+from labeling import LabelLog, LabelingServer
+from pipeline import Manifest
+from records import AdStore
+from stats import SEARCH_TERMS, StatsAccumulator, matrix
 from tqdm import tqdm
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 class Inspector:
     """
@@ -18,47 +21,127 @@ class Inspector:
     And it also provides statistics about the data which is available after the manual labeling.
     """
     def __init__(self, path='output/filtered.json', sample_path='output/samples.json'):
-        self.data = []
+        path = resolve(path)  # output/filtered.jsonl.zst in archive mode
         self.samples = []
-        self.unique_data = []
-        self.labeled_unique_data = []
-        if os.path.exists(path):
-            with open(path, 'r') as f:
-                self.data = json.load(f)['data']
         if os.path.exists(sample_path):
             self.samples = json.load(open(sample_path, 'r'))['data']
-        if os.path.exists('output/filtered-unique.json'):
-            self.unique_data = json.load(open('output/filtered-unique.json', 'r'))['data']
-        body_set = set()
-        if not os.path.exists('output/filtered-unique.json'):
-            for ad in self.data:
-                b = ad.get('ad_creative_bodies', [None])[0]
-                if b not in body_set:
-                    self.unique_data.append(ad)
-                    body_set.add(b)
+        self.manifest = Manifest()
+        if self.manifest.is_stale('unique', [path], outputs=['output/filtered-unique.json']):
+            previous = AdStore('output/filtered-unique.json').full()
+            unique_data = self.build_unique(AdStore(path).full(), previous)
             with open('output/filtered-unique.json', 'w') as f:
-                json.dump({"data": self.unique_data}, f, indent=4)
-        self.unique_data = [ad for ad in self.unique_data if ad['id'] not in [s['id'] for s in self.samples]]
-        self.labeled_unique_data = [ad for ad in self.unique_data if 'manual_label' in ad]
-
-    def inspect(self):
-        """
-        Opens the manual labeling tool to inspect the ads and label them.
+                json.dump({"data": unique_data}, f, indent=4)
+            del unique_data, previous
+            self.manifest.record('unique', [path], outputs=['output/filtered-unique.json'])
+        # The statistics only need a few fields, so the filtered and unique data are kept as compact records
+        self.store = AdStore.load(path)
+        self.unique_store = AdStore.load('output/filtered-unique.json')
+        self.data = self.store.records
+        self.toolbox = None
+        self.label_log = LabelLog()
+        self.label_log.apply(self.samples + self.unique_store.records)
+        self.unique_data = [ad for ad in self.unique_store.records if ad['id'] not in self.sample_ids()]
+        # The counters of the statistics, updated per ad when it is labeled or relabeled
+        self.data_stats = StatsAccumulator(self.data, key=id)
+        self.sample_stats = StatsAccumulator(self.samples)
+        self.unique_stats = StatsAccumulator(self.unique_data)
+
+    @property
+    def labeled_unique_data(self):
+        """
+        :return: The unique ads that have a manual label.
+        """
+        return [ad for ad in self.unique_data if 'manual_label' in ad]
+
+    @staticmethod
+    def build_unique(data, previous):
+        """
+        Builds the unique data from the filtered data by keeping the first ad of every ad body.
+        The AI labels and manual labels of the previous unique data are carried over, so labels only have to be
+        regenerated for the ads that are new or of which the text changed.
+        :param data: The full filtered data.
+        :param previous: The previous unique data, possibly empty.
+        :return: The list of unique ads.
+        """
+        # The source of a label decides whether it is still valid and whether the cascade may train on it
+        label_keys = ['scam', 'reason', 'confidence', 'classifier', 'label_input', 'label_source', 'campaign',
+                      'undecided']
+        previous = {ad['id']: ad for ad in previous}
+        unique_data = []
+        body_set = set()
+        for ad in data:
+            b = ad.get('ad_creative_bodies', [None])[0]
+            if b in body_set:
+                continue
+            body_set.add(b)
+            old = previous.get(ad['id'])
+            if old is not None:
+                for key in label_keys:
+                    if key in old.get('classification', {}):
+                        ad.setdefault('classification', {})[key] = old['classification'][key]
+                if 'manual_label' in old:
+                    ad['manual_label'] = old['manual_label']
+            unique_data.append(ad)
+        return unique_data
+
+    def inspect(self, port=None, active=False):
+        """
+        Opens the manual labeling app to inspect the ads and label them. The app runs until Ctrl+C is pressed, other
+        reviewers can join by opening the same URL (with ?reviewer=<name>) and get a disjoint part of the queue.
+        Labels are appended to output/labels.jsonl while labeling and written to the JSON files once afterwards.
+        :param port: The port of the app, LABELING_PORT or 8000 by default.
+        :param active: Whether to label the unique ads in the order of the active learning queue (most uncertain
+                       first) instead of the samples.
         """
         start_time = datetime.datetime.now()
         print(f'[{start_time.strftime("%H:%M")}] » Opening the manual labeling tool...')
-        self.samples = self.get_samples() if not self.samples else self.samples
-        for i, ad in enumerate(self.samples):
-            if 'manual_label' in ad and 'scam' in ad['manual_label']:
-                continue
-            self.open_ad_in_browser(ad, i, len(self.samples))
-            ad['manual_label'] = {
-                'scam': input(f'[{datetime.datetime.now().strftime("%H:%M")}] » Is ad {i + 1} a scam? (y/n): ').lower() == 'y'
-            }
+        self.load_samples()
+        ads = self.unique_store.full([ad['id'] for ad in self.unique_data]) if active else self.samples
+        ranking = ReviewQueue(ads) if active else None
+        stats = self.unique_stats if active else self.sample_stats
+        campaigns = Campaigns(ads) if os.getenv('CAMPAIGNS', 'false').lower() == 'true' else None
+        port = int(os.getenv('LABELING_PORT', 8000)) if port is None else port
+        LabelingServer(ads, self.label_log, os.getenv('LABELING_HOST', '127.0.0.1'), port, on_label=stats.update,
+                       ranking=ranking, campaigns=campaigns).serve()
+        if active:
+            self.label_log.apply(self.unique_data)
+            self.save_unique_labels()
+        else:
             with open('output/samples.json', 'w') as f:
                 json.dump({"data": self.samples}, f, indent=4)
         self.print_stats()
 
+    def save_unique_labels(self):
+        """
+        Writes the manual labels of the unique ads to output/filtered-unique.json.
+        """
+        labels = {ad['id']: ad['manual_label'] for ad in self.unique_data if 'manual_label' in ad}
+        with open('output/filtered-unique.json', 'r') as f:
+            data = json.load(f)['data']
+        for ad in data:
+            if ad['id'] in labels:
+                ad['manual_label'] = labels[ad['id']]
+            elif ad['id'] not in self.sample_ids():
+                ad.pop('manual_label', None)
+        with open('output/filtered-unique.json', 'w') as f:
+            json.dump({"data": data}, f, indent=4)
+
+    def load_samples(self):
+        """
+        Samples the ads if there are no samples yet.
+        :return: The samples.
+        """
+        if not self.samples:
+            self.samples = self.get_samples()
+            self.sample_stats = StatsAccumulator(self.samples)
+        return self.samples
+
+    def sample_ids(self):
+        """
+        :return: The set of ids of the samples.
+        """
+        return {s['id'] for s in self.samples}
+
     def get_samples(self, n=100, amount_with_transcription=50):
         """
         Returns a sample of n random ads or the data in output/samples.json if it exists.
@@ -95,136 +178,122 @@ class Inspector:
                 result.append(ad)
                 dup_check.add(ad['ad_creative_bodies'][0])
         print(f'{datetime.datetime.now().strftime("%H:%M")} » Sampled {len(result)} unique ads.')
+        result = self.store.full([ad['id'] for ad in result])
         with open('output/samples.json', 'w') as f:
             json.dump({"data": result}, f, indent=4)
         return result
 
     def print_stats(self):
         """
-        Prints the statistics of the data.
+        Prints the statistics of the data from the snapshots of the counters.
         """
         start_time = datetime.datetime.now()
+        self.load_samples()
+        data, samples, unique = self.data_stats.snapshot(), self.sample_stats.snapshot(), self.unique_stats.snapshot()
+        scores, very_likely = self.get_scores(), self.get_scores(True)
+        tp, fp, fn, tn = matrix(unique['labeled_confusion'])
+        terms = {name: '\n'.join(f"            - #ads from '{term}':{' ' * (12 - len(term))}{stats['terms'][term]}"
+                                 for term in SEARCH_TERMS) for name, stats in [('data', data), ('samples', samples)]}
+        criteria = {name: '\n'.join(f"            - #ads with {label}:{' ' * (14 - len(label))}{stats['criteria'][key]}"
+                                    for key, label in [('about_crypto', 'about crypto'), ('free_crypto', 'free crypto'),
+                                                       ('giveaway', 'giveaway'), ('bio_link', 'bio link'),
+                                                       ('limited_time', 'limited time'),
+                                                       ('unrealistic', 'unrealistic')])
+                    for name, stats in [('data', data), ('unique', unique)]}
         print(f'''[{start_time.strftime("%H:%M")}] » Filtered data statistics:
-            - #ads:                    {len(self.data)}
-            - #ads from 'airdrop':     {len([ad for ad in self.data if 'airdrop' in ad['search_term']])}
-            - #ads from 'bitcoin':     {len([ad for ad in self.data if 'bitcoin' in ad['search_term']])}
-            - #ads from 'crypto':      {len([ad for ad in self.data if 'crypto' in ad['search_term']])}
-            - #ads from 'elon':        {len([ad for ad in self.data if 'elon' in ad['search_term']])}
-            - #ads from 'ethereum':    {len([ad for ad in self.data if 'ethereum' in ad['search_term']])}
-            - #ads from 'giveaway':    {len([ad for ad in self.data if 'giveaway' in ad['search_term']])}
-            - #ads from 'invest':      {len([ad for ad in self.data if 'invest' in ad['search_term']])}
-            - #ads from 'musk':        {len([ad for ad in self.data if 'musk' in ad['search_term']])}
-            - #ads from 'profit':      {len([ad for ad in self.data if 'profit' in ad['search_term']])}
-            - #ads from 'scam':        {len([ad for ad in self.data if 'scam' in ad['search_term']])}
-            - #ads with about crypto:  {len([ad for ad in self.data if ad['classification'].get('about_crypto', False)])}
-            - #ads with free crypto:   {len([ad for ad in self.data if ad['classification'].get('free_crypto', False)])}
-            - #ads with giveaway:      {len([ad for ad in self.data if ad['classification'].get('giveaway', False)])}
-            - #ads with bio link:      {len([ad for ad in self.data if ad['classification'].get('bio_link', False)])}
-            - #ads with limited time:  {len([ad for ad in self.data if ad['classification'].get('limited_time', False)])}
-            - #ads with unrealistic:   {len([ad for ad in self.data if ad['classification'].get('unrealistic', False)])}
-            - #ads Scam by AI:         {len([ad for ad in self.data if self.get_label(ad, False)])}
-            - #ads Not-Scam by AI:     {len([ad for ad in self.data if not self.get_label(ad, False)])}
+            - #ads:                    {data['ads']}
+{terms['data']}
+{criteria['data']}
+            - #ads Scam by AI:         {data['scam_ai']}
+            - #ads Not-Scam by AI:     {data['ads'] - data['scam_ai']}
             
             Sample statistics:
-            - #ads from 'airdrop':     {len([ad for ad in self.samples if 'airdrop' in ad['search_term']])}
-            - #ads from 'bitcoin':     {len([ad for ad in self.samples if 'bitcoin' in ad['search_term']])}
-            - #ads from 'crypto':      {len([ad for ad in self.samples if 'crypto' in ad['search_term']])}
-            - #ads from 'elon':        {len([ad for ad in self.samples if 'elon' in ad['search_term']])}
-            - #ads from 'ethereum':    {len([ad for ad in self.samples if 'ethereum' in ad['search_term']])}
-            - #ads from 'giveaway':    {len([ad for ad in self.samples if 'giveaway' in ad['search_term']])}
-            - #ads from 'invest':      {len([ad for ad in self.samples if 'invest' in ad['search_term']])}
-            - #ads from 'musk':        {len([ad for ad in self.samples if 'musk' in ad['search_term']])}
-            - #ads from 'profit':      {len([ad for ad in self.samples if 'profit' in ad['search_term']])}
-            - #ads from 'scam':        {len([ad for ad in self.samples if 'scam' in ad['search_term']])}
-            - #ads Scam by manual:     {len([ad for ad in self.samples if self.get_label(ad, True)])}
-            - #ads Not-Scam by manual: {len([ad for ad in self.samples if not self.get_label(ad, True)])}
-            - #ads Scam by AI:         {len([ad for ad in self.samples if self.get_label(ad, False)])}
-            - #ads Not-Scam by AI:     {len([ad for ad in self.samples if not self.get_label(ad, False)])}
-            - #ads unique (u-ads):     {len(set([ad.get('ad_creative_bodies', [None])[0] for ad in self.samples]))}
-            - #ads transcribed:        {len([ad for ad in self.samples if 'video_transcription' in ad])}
-            - #unique page names:      {len(set([ad.get('page_name', None) for ad in self.samples]))}
-            - True positives:          {self.get_scores()[0]}
-            - False positives:         {self.get_scores()[1]}
-            - False negatives:         {self.get_scores()[2]}
-            - True negatives:          {self.get_scores()[3]}
-            - F1 score:                {self.get_scores()[4]}
-            - Precision:               {self.get_scores()[5]}
-            - Recall:                  {self.get_scores()[6]}
-            - Accuracy:                {self.get_scores()[7]}
-            - Specificity:             {self.get_scores()[8]}
-            - NPV:                     {self.get_scores()[9]}
-            - MCC:                     {self.get_scores()[10]}
-            - Balanced accuracy:       {self.get_scores()[11]}
-            - F2 score:                {self.get_scores()[12]}
-            - G-mean:                  {self.get_scores()[13]}
+{terms['samples']}
+            - #ads Scam by manual:     {samples['scam_manual']}
+            - #ads Not-Scam by manual: {samples['ads'] - samples['scam_manual']}
+            - #ads Scam by AI:         {samples['scam_ai']}
+            - #ads Not-Scam by AI:     {samples['ads'] - samples['scam_ai']}
+            - #ads unique (u-ads):     {samples['unique_bodies']}
+            - #ads transcribed:        {samples['transcribed']}
+            - #unique page names:      {samples['unique_pages']}
+            - True positives:          {scores[0]}
+            - False positives:         {scores[1]}
+            - False negatives:         {scores[2]}
+            - True negatives:          {scores[3]}
+            - F1 score:                {scores[4]}
+            - Precision:               {scores[5]}
+            - Recall:                  {scores[6]}
+            - Accuracy:                {scores[7]}
+            - Specificity:             {scores[8]}
+            - NPV:                     {scores[9]}
+            - MCC:                     {scores[10]}
+            - Balanced accuracy:       {scores[11]}
+            - F2 score:                {scores[12]}
+            - G-mean:                  {scores[13]}
             Confusion matrix (of the samples):
                   AI
             Manual   True  False
-               True    {self.get_scores()[0]}     {self.get_scores()[2]}
-               False   {self.get_scores()[1]}     {self.get_scores()[3]}
+               True    {scores[0]}     {scores[2]}
+               False   {scores[1]}     {scores[3]}
                
              "Very likely" statistics:
-            - #ads Scam by AI:         {self.get_scores(True)[0]+self.get_scores(True)[2]}
-            - #ads Not-Scam by AI:     {self.get_scores(True)[1]+self.get_scores(True)[3]}
-            - True positives:          {self.get_scores(True)[0]}
-            - False positives:         {self.get_scores(True)[1]}
-            - False negatives:         {self.get_scores(True)[2]}
-            - True negatives:          {self.get_scores(True)[3]}
-            - F1 score:                {self.get_scores(True)[4]}
-            - Precision:               {self.get_scores(True)[5]}
-            - Recall:                  {self.get_scores(True)[6]}
-            - Accuracy:                {self.get_scores(True)[7]}
-            - Specificity:             {self.get_scores(True)[8]}
-            - NPV:                     {self.get_scores(True)[9]}
-            - MCC:                     {self.get_scores(True)[10]}
-            - Balanced accuracy:       {self.get_scores(True)[11]}
-            - F2 score:                {self.get_scores(True)[12]}
-            - G-mean:                  {self.get_scores(True)[13]}
+            - #ads Scam by AI:         {very_likely[0] + very_likely[2]}
+            - #ads Not-Scam by AI:     {very_likely[1] + very_likely[3]}
+            - True positives:          {very_likely[0]}
+            - False positives:         {very_likely[1]}
+            - False negatives:         {very_likely[2]}
+            - True negatives:          {very_likely[3]}
+            - F1 score:                {very_likely[4]}
+            - Precision:               {very_likely[5]}
+            - Recall:                  {very_likely[6]}
+            - Accuracy:                {very_likely[7]}
+            - Specificity:             {very_likely[8]}
+            - NPV:                     {very_likely[9]}
+            - MCC:                     {very_likely[10]}
+            - Balanced accuracy:       {very_likely[11]}
+            - F2 score:                {very_likely[12]}
+            - G-mean:                  {very_likely[13]}
             Confusion matrix (of the samples):
                   AI
             Manual   True  False
-               True    {self.get_scores(True)[0]}     {self.get_scores(True)[2]}
-               False   {self.get_scores(True)[1]}     {self.get_scores(True)[3]}
+               True    {very_likely[0]}     {very_likely[2]}
+               False   {very_likely[1]}     {very_likely[3]}
             
             Filtered Unique data statistics:
-            - #ads unique (u-ads):     {len(self.unique_data)} / {len(self.data)}
-            - #ads with about crypto:  {len([ad for ad in self.unique_data if ad['classification'].get('about_crypto', False)])}
-            - #ads with free crypto:   {len([ad for ad in self.unique_data if ad['classification'].get('free_crypto', False)])}
-            - #ads with giveaway:      {len([ad for ad in self.unique_data if ad['classification'].get('giveaway', False)])}
-            - #ads with bio link:      {len([ad for ad in self.unique_data if ad['classification'].get('bio_link', False)])}
-            - #ads with limited time:  {len([ad for ad in self.unique_data if ad['classification'].get('limited_time', False)])}
-            - #ads with unrealistic:   {len([ad for ad in self.unique_data if ad['classification'].get('unrealistic', False)])}
-            - #ads Scam by AI:         {len([ad for ad in self.unique_data if self.get_label(ad, False)])}
-            - #ads Not-Scam by AI:     {len([ad for ad in self.unique_data if not self.get_label(ad, False)])}
-            - #ads transcribed:        {len([ad for ad in self.unique_data if 'video_transcription' in ad])}
-            - #unique page names:      {len(set([ad.get('page_name', None) for ad in self.unique_data]))}
-            - #ads without body:       {len([ad for ad in self.unique_data if not ad.get('ad_creative_bodies', [None])[0]])}
-            - #ads labeled:            {len(self.labeled_unique_data)} / {len(self.unique_data)}
-            - #ads Scam by manual:     {len([ad for ad in self.labeled_unique_data if self.get_label(ad, True)])}
-            - #ads Not-Scam by manual: {len([ad for ad in self.labeled_unique_data if not self.get_label(ad, True)])}
-            - True positives:          {len([ad for ad in self.labeled_unique_data if self.get_label(ad, True) and self.get_label(ad, False)])}
-            - False positives:         {len([ad for ad in self.labeled_unique_data if not self.get_label(ad, True) and self.get_label(ad, False)])}
-            - False negatives:         {len([ad for ad in self.labeled_unique_data if self.get_label(ad, True) and not self.get_label(ad, False)])}
-            - True negatives:          {len([ad for ad in self.labeled_unique_data if not self.get_label(ad, True) and not self.get_label(ad, False)])}
+            - #ads unique (u-ads):     {unique['ads']} / {data['ads']}
+{criteria['unique']}
+            - #ads Scam by AI:         {unique['scam_ai']}
+            - #ads Not-Scam by AI:     {unique['ads'] - unique['scam_ai']}
+            - #ads transcribed:        {unique['transcribed']}
+            - #unique page names:      {unique['unique_pages']}
+            - #ads without body:       {unique['without_body']}
+            - #ads labeled:            {unique['labeled']} / {unique['ads']}
+            - #ads Scam by manual:     {unique['labeled_scam_manual']}
+            - #ads Not-Scam by manual: {unique['labeled'] - unique['labeled_scam_manual']}
+            - True positives:          {tp}
+            - False positives:         {fp}
+            - False negatives:         {fn}
+            - True negatives:          {tn}
             ''')
         self.generate_graphs()
 
     def get_scores(self, very_likely=False):
         """
-        Calculates the F1 score of the manual and AI labels.
+        Calculates the F1 score of the manual and AI labels of the samples.
         :param very_likely: Whether to calculate the scores for the "very likely" ads.
             Meaning that an ad is considered labeled a scam by AI if the confidence is "Very likely" and the label is True.
             If labeled as true and the confidence is not "Very likely", it is considered labeled as not a scam.
         :return: Tuple of (tp, fp, fn, tn, f1, precision, recall, accuracy)
         """
-        self.samples = self.get_samples() # update the samples, just in case
-        manual_labels = [self.get_label(ad, True) for ad in self.samples]
-        ai_labels = [self.get_label(ad, False) and ad['classification']['confidence'] == 'Very likely' for ad in self.samples] \
-            if very_likely else  [self.get_label(ad, False) for ad in self.samples]
-        tp = sum([1 for i in range(len(manual_labels)) if     manual_labels[i] and ai_labels[i]])
-        fp = sum([1 for i in range(len(manual_labels)) if not manual_labels[i] and ai_labels[i]])
-        fn = sum([1 for i in range(len(manual_labels)) if     manual_labels[i] and not ai_labels[i]])
-        tn = sum([1 for i in range(len(manual_labels)) if not manual_labels[i] and not ai_labels[i]])
+        return self.scores(*matrix(self.sample_stats.snapshot()['confusion'], very_likely))
+
+    @staticmethod
+    def scores(tp, fp, fn, tn):
+        """
+        Calculates the scores of a confusion matrix.
+        :return: Tuple of (tp, fp, fn, tn, f1, precision, recall, accuracy, specificity, npv, mcc, balanced_accuracy,
+                 f2, g_mean), 'NaN' for the scores that are undefined.
+        """
         precision = tp / (tp + fp) if tp + fp != 0 else 'NaN'
         recall = tp / (tp + fn) if tp + fn != 0 else 'NaN'
         f1 = 2 * tp / (2 * tp + fp + fn) if 2 * tp + fp + fn != 0 else 'NaN'
@@ -239,82 +308,6 @@ class Inspector:
         return tp, fp, fn, tn, f1, precision, recall, accuracy, specificity, npv, mcc, balanced_accuracy, f2, g_mean
 
 
-    def create_html(self, ad, index, total):
-        title = "\n\t\t".join(ad['ad_creative_link_titles']) if 'ad_creative_link_titles' in ad else ''
-        desc = "<br>".join(ad['ad_creative_link_descriptions']) if 'ad_creative_link_descriptions' in ad else ''
-        bodies = "<br>".join(ad['ad_creative_bodies']) if 'ad_creative_bodies' in ad else ''
-        transcript = f"{ad['video_transcription']}" if 'video_transcription' in ad else ''
-        page_url = (f'https://www.facebook.com/ads/library/?active_status=all&ad_type=all&country=ALL'
-                    f'&media_type=all&search_type=page&view_all_page_id={ad["page_id"]}') if 'page_id' in ad else ''
-        url = f'https://www.facebook.com/ads/library/?id={ad["id"]}' if 'id' in ad else ''
-        ad_urls = '<br>'.join([f'<a href="{url}" target="_blank">Ad {i + 1}</a>' for i, url in enumerate(ad['ad_creative_link_captions'])]) \
-            if 'ad_creative_link_captions' in ad else ''
-        html_content = f"""
-        	<!DOCTYPE html>
-          <html>
-            <head>
-              <title> Ad {index+1} / {total}</title>
-              <style>
-                * {{
-                  background-color: #0f0f0f;
-                  color: #808080;
-                  font-size: 1.15rem;
-                  border-radius: 1rem;
-                  padding: 0 1rem;
-                }}
-                .ad {{
-                  display: grid;
-                  grid-template-columns: repeat(2, 1fr);
-                  gap: 1rem;
-                }}
-                h1, h3, h4 {{
-                  background: transparent;
-                  text-align: center;
-                  color: white;
-                }}
-                .title, .desc {{
-                  grid-column: span 2;
-                }}
-                .bodies, .transcription {{
-                  background: #1a1a1f;
-                  color: #8181b1;
-                  padding: 1rem;
-                }}
-                a {{
-                  text-align: center;
-                  color: #5f4af0;
-                  text-decoration: none;
-                }}
-              </style>
-            </head>
-            <body>
-              <div class='ad'>
-                <h1 class='title'>{title} - {ad['id']} - {index+1} / {total}</h1>
-                <h3 class='desc'>{desc}<br>{ad['search_term']} </h3>
-                <div class='bodies'>
-                  <h4>Ad Creative Bodies:</h4>
-                  {bodies}
-                </div>
-                <div class='transcription'>
-                  <h4>Video Transcription:</h4>
-                  {transcript}
-                </div>
-                <a href="{page_url}" target="_blank">Page URL</a>
-                <a href="{url}" target="_blank">Ad URL</a>
-                {ad_urls}
-              </div>
-            </body>
-          </html>
-        """
-        return html_content
-
-    def open_ad_in_browser(self, ad, index, total):
-        html_content = self.create_html(ad, index, total)
-        file_path = f'manual/ad_{index + 1}.html'
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        webbrowser.open(f'file://{os.path.realpath(file_path)}')
-
     def get_label(self, ad, manual):
         """
         Returns the label of an ad.
@@ -324,67 +317,178 @@ class Inspector:
         """
         return ad.get('manual_label', {}).get('scam', False) if manual else ad.get('classification', {}).get('scam', False)
 
-    def relabel(self):
+    def relabel(self, ids=None, confidence=None, disagreement=False, concurrency=None,
+                checkpoint='output/relabel.jsonl'):
         """
-        Relabels the ads with AI in the samples.json file.
+        Relabels (a subset of) the ads in the samples.json file with AI. The requests run concurrently and every label
+        is appended to a checkpoint file as soon as it is generated, so a crashed run continues where it stopped.
+        samples.json is written once at the end, after which the checkpoint is removed.
+        :param ids: Only relabel the ads with these ids.
+        :param confidence: Only relabel the ads of which the AI label has one of these confidence levels.
+        :param disagreement: Only relabel the ads of which the AI label differs from the manual label.
+        :param concurrency: The amount of concurrent requests, RELABEL_CONCURRENCY or 4 by default.
+        :param checkpoint: The path of the checkpoint file.
         """
         start = datetime.datetime.now()
-        print(f'[{start.strftime("%H:%M")}] » Relabeling the ads with AI...')
-        self.samples = self.get_samples() if not self.samples else self.samples
-        ai = AIToolBox()
-        for i, ad in enumerate(tqdm(self.samples, desc="Relabeling ads")):
-            label = ai.generate_label(ad)
-            ad['classification']['scam'] = label.get('scam', False)
-            ad['classification']['reason'] = label.get('reason', '')
-            ad['classification']['confidence'] = label.get('confidence', '')
+        self.load_samples()
+        ads = self.select(self.samples, ids, confidence, disagreement)
+        concurrency = int(os.getenv('RELABEL_CONCURRENCY', 4)) if concurrency is None else concurrency
+        ai = self.ai()
+        done = self.read_checkpoint(checkpoint, ai.classifier_signature())
+        todo = []
+        for ad in ads:
+            result = done.get(ad['id'])
+            if result is not None and result['label_input'] == Manifest.ad_hash(ad):
+                ad.setdefault('classification', {}).update(result)
+                self.sample_stats.update(ad)
+            else:
+                todo.append(ad)
+        print(f'[{start.strftime("%H:%M")}] » Relabeling {len(todo)} of {len(self.samples)} ads with AI '
+              f'({len(ads) - len(todo)} restored from `{checkpoint}`, {concurrency} concurrent requests)...')
+        lock = threading.Lock()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            futures = {executor.submit(ai.generate_label, ad): ad for ad in todo}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Relabeling ads"):
+                ad = futures[future]
+                try:
+                    label = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Could not relabel ad {ad["id"]}: {e}')
+                    continue
+                result = {'scam': label.get('scam', False), 'reason': label.get('reason', ''),
+                          'confidence': label.get('confidence', ''), 'classifier': ai.classifier_signature(),
+                          'label_input': Manifest.ad_hash(ad), 'label_source': 'llm'}
+                ad.setdefault('classification', {}).update(result)
+                self.sample_stats.update(ad)
+                with lock, open(checkpoint, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'id': ad['id'], **result}) + '\n')
         with open('output/samples.json', 'w') as f:
             json.dump({"data": self.samples}, f, indent=4)
+        if failed == 0 and os.path.exists(checkpoint):
+            os.remove(checkpoint)
         end = datetime.datetime.now()
-        print(f'[{end.strftime("%H:%M")}] » Relabeled the ads with AI. {end-start}')
+        print(f'[{end.strftime("%H:%M")}] » Relabeled the ads with AI. {end-start} ({failed} failed, {ai.json.stats()})')
+
+    @staticmethod
+    def select(ads, ids=None, confidence=None, disagreement=False):
+        """
+        Selects a subset of ads, every given filter has to match.
+        :param ads: The ads to select from.
+        :param ids: The ids of the ads to select.
+        :param confidence: The confidence levels of the AI label to select.
+        :param disagreement: Whether to only select ads of which the AI label differs from the manual label.
+        :return: The selected ads.
+        """
+        ids = set(ids) if ids is not None else None
+        return [ad for ad in ads if (ids is None or ad['id'] in ids) and
+                (confidence is None or ad.get('classification', {}).get('confidence') in confidence) and
+                (not disagreement or ('scam' in ad.get('manual_label', {}) and
+                                      ad['manual_label']['scam'] != ad.get('classification', {}).get('scam')))]
+
+    @staticmethod
+    def read_checkpoint(path, signature):
+        """
+        Reads the labels of an unfinished relabel run.
+        :param path: The path of the checkpoint file.
+        :param signature: The current classifier signature, labels of another classifier are ignored.
+        :return: A dictionary of ad id -> classification fields.
+        """
+        results = {}
+        if not os.path.exists(path):
+            return results
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    if result.get('classifier') == signature:
+                        results[result.pop('id')] = result
+        return results
+
+    def ai(self):
+        """
+        :return: The AIToolBox used for labeling, created on first use (Whisper is only loaded when transcribing).
+        """
+        if self.toolbox is None:
+            from ai import AIToolBox  # Imports ollama, only needed when labeling
+            self.toolbox = AIToolBox()
+        return self.toolbox
+
+    def find_similar(self, ad_id=None, text=None, k=10):
+        """
+        Finds the ads most similar to a (confirmed scam) ad or to a text using the embedding index, and ranks the
+        remaining unlabeled ads by the scam score propagated from the manual labels.
+        :param ad_id: The id of the ad to find similar ads for.
+        :param text: A text to find similar ads for, used if no ad id is given.
+        :param k: The amount of similar ads to return.
+        :return: Tuple of (similar ads as (id, similarity), unlabeled ads as (id, scam score) most likely scam first)
+        """
+        from embeddings import EmbeddingIndex
+        ads = self.unique_store.full([ad['id'] for ad in self.unique_data]) + self.samples
+        self.label_log.apply(ads)
+        index = EmbeddingIndex()
+        index.build(ads)
+        similar = index.query_by_id(ad_id, k) if ad_id is not None else index.query_by_text(text, k) if text else []
+        ranking = index.propagate(EmbeddingIndex.manual_labels(ads))
+        for similar_id, similarity in similar:
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » {similar_id}: {similarity:.3f} - '
+                  f'https://www.facebook.com/ads/library/?id={similar_id}')
+        return similar, ranking
 
     def generate_graphs(self):
         """
-        Generates graphs for the data.
+        Generates graphs for the data. The graphs are only regenerated if the unique data or samples changed.
         """
+        inputs = ['output/filtered-unique.json', 'output/samples.json']
+        outputs = ['output/graphs/ad_duration.png', 'output/graphs/ad_duration_labeled.png']
+        if not self.manifest.is_stale('graphs', inputs, outputs=outputs):
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Graphs are up to date, skipping...')
+            return
+        from aggregates import ScamTables
         scams = [ad for ad in self.unique_data if self.get_label(ad, False)]
+        # The ads that only have a manual label are a subset of the scams, both share the same aggregation tables
+        labeled = [ad['id'] for ad in self.labeled_unique_data
+                   if self.get_label(ad, True) and self.get_label(ad, False)]
+        tables = ScamTables(scams, labeled)
         graphs = []
-        graphs.append(('language_distribution', self.plot_language_distribution(scams)))
-        graphs.append(('target_locations', self.plot_target_locations(scams)))
-        graphs.append(('excluded_target_locations', self.plot_target_locations(scams, excluded=True)))
-        graphs.append(('country_reach_distribution', self.plot_country_reach_distribution(scams)))
-        graphs.append(('country_scam_count_distribution', self.plot_country_scam_count_distribution(scams)))
-        graphs.append(('search_term_distribution_unique', self.plot_search_term_distribution(unique=True)))
-        graphs.append(('search_term_distribution', self.plot_search_term_distribution()))
-        graphs.append(('acc_target_ages', self.plot_acc_target_ages(scams)))
-        graphs.append(('target_ages', self.plot_target_ages(scams)))
-        graphs.append(('target_gender', self.plot_target_gender(scams)))
-        graphs.append(('ad_duration', self.plot_ad_duration(scams)))
-        # And now we also print it for the ads that only have a manual label:
-        labeled_scams = [ad for ad in self.labeled_unique_data if self.get_label(ad, True) and self.get_label(ad, False)]
-        graphs.append(('language_distribution_labeled', self.plot_language_distribution(labeled_scams)))
-        graphs.append(('target_locations_labeled', self.plot_target_locations(labeled_scams)))
-        graphs.append(('excluded_target_locations_labeled', self.plot_target_locations(labeled_scams, excluded=True)))
-        graphs.append(('country_reach_distribution_labeled', self.plot_country_reach_distribution(labeled_scams)))
-        graphs.append(('country_scam_count_distribution_labeled', self.plot_country_scam_count_distribution(labeled_scams)))
-        graphs.append(('search_term_distribution_unique_labeled', self.plot_search_term_distribution(unique=True, only_labeled=True)))
-        graphs.append(('acc_target_ages_labeled', self.plot_acc_target_ages(labeled_scams)))
-        graphs.append(('target_ages_labeled', self.plot_target_ages(labeled_scams)))
-        graphs.append(('target_gender_labeled', self.plot_target_gender(labeled_scams)))
-        graphs.append(('ad_duration_labeled', self.plot_ad_duration(labeled_scams)))
+        for suffix, only_labeled in [('', False), ('_labeled', True)]:
+            if not (labeled if only_labeled else scams):
+                # The histograms and the pie chart can not be drawn without any scam ad
+                print(f'[{datetime.datetime.now().strftime("%H:%M")}] » No {"manually labeled " * only_labeled}'
+                      f'scam ads yet, skipping the{" labeled" * only_labeled} graphs...')
+                continue
+            graphs.append((f'language_distribution{suffix}', self.plot_language_distribution(tables, only_labeled)))
+            graphs.append((f'target_locations{suffix}', self.plot_target_locations(tables, only_labeled)))
+            graphs.append((f'excluded_target_locations{suffix}',
+                           self.plot_target_locations(tables, only_labeled, excluded=True)))
+            graphs.append((f'country_reach_distribution{suffix}',
+                           self.plot_country_reach_distribution(tables, only_labeled)))
+            graphs.append((f'country_scam_count_distribution{suffix}',
+                           self.plot_country_scam_count_distribution(tables, only_labeled)))
+            graphs.append((f'search_term_distribution_unique{suffix}',
+                           self.plot_search_term_distribution(unique=True, only_labeled=only_labeled)))
+            if not only_labeled:
+                graphs.append(('search_term_distribution', self.plot_search_term_distribution()))
+            graphs.append((f'acc_target_ages{suffix}', self.plot_acc_target_ages(tables, only_labeled)))
+            graphs.append((f'target_ages{suffix}', self.plot_target_ages(tables, only_labeled)))
+            graphs.append((f'target_gender{suffix}', self.plot_target_gender(tables, only_labeled)))
+            graphs.append((f'ad_duration{suffix}', self.plot_ad_duration(tables, only_labeled)))
+        os.makedirs('output/graphs', exist_ok=True)
         for name, (plt, fig) in graphs:
             fig.savefig(f'output/graphs/{name}.png')
             plt.close(fig)
+        self.manifest.record('graphs', inputs, outputs=outputs)
 
-    def plot_language_distribution(self, scams):
+    def plot_language_distribution(self, tables, labeled=False):
         """
         Plots the distribution of scam ads by language.
+        :param tables: The ScamTables of the scam ads.
+        :param labeled: Whether to only plot the scam ads that are also manually labeled as scam.
         """
-        languages = []
-        for ad in scams:
-            languages += ad.get('languages', [])
-        df_languages = pd.DataFrame(languages, columns=['language'])
-        language_counts = df_languages['language'].value_counts().reset_index()
-        language_counts.columns = ['language', 'count']
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        language_counts = tables.language_counts(labeled)
         fig = plt.figure(figsize=(10, 6))
         sns.barplot(x='language', y='count', data=language_counts)
         plt.title('Count of Scam Ads by Language - Filtered Unique data')
@@ -393,16 +497,13 @@ class Inspector:
         plt.show()
         return plt, fig
 
-    def plot_target_locations(self, scams, excluded=False):
+    def plot_target_locations(self, tables, labeled=False, excluded=False):
         """
         Plots the distribution of target locations for scam ads.
         """
-        locations = defaultdict(int)
-        for ad in scams:
-            for loc in ad.get('target_locations', []):
-                locations[loc.get("name", "N/A")] += 1 if excluded == loc.get("excluded") else 0
-        df_locations = pd.DataFrame(list(locations.items()), columns=['location', 'count'])
-        df_locations = df_locations.sort_values(by='count', ascending=False)
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        df_locations = tables.location_counts(labeled, excluded)
         fig = plt.figure(figsize=(20, 12))
         sns.barplot(x='location', y='count', data=df_locations)
         incl = 'Excluded' if excluded else 'Included'
@@ -413,21 +514,13 @@ class Inspector:
         plt.show()
         return plt, fig
 
-    def plot_country_reach_distribution(self, scams):
+    def plot_country_reach_distribution(self, tables, labeled=False):
         """
         Plots the reach of scam ads by country.
         """
-        countries = []
-        for ad in scams:
-            countries += [(a.get('country'), len(a.get('age_gender_breakdowns', []))) for a in ad.get('age_country_gender_reach_breakdown', [])]
-        country_count = defaultdict(int)
-        for country, reach in countries:
-            country_count[country] += reach
-        reach_per_country = list(country_count.items())
-        df_country_reach = pd.DataFrame(reach_per_country, columns=['country', 'reach'])
-        country_counts = df_country_reach.groupby('country')['reach'].sum().reset_index()
-        country_counts.columns = ['country', 'reach']
-        country_counts = country_counts.sort_values(by='reach', ascending=False)
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        country_counts = tables.country_reach(labeled)
         fig = plt.figure(figsize=(10, 6))
         sns.barplot(x='country', y='reach', data=country_counts)
         plt.title('Reach of Scam Ads by Country - Filtered Unique data')
@@ -436,21 +529,13 @@ class Inspector:
         plt.show()
         return plt, fig
 
-    def plot_country_scam_count_distribution(self, scams):
+    def plot_country_scam_count_distribution(self, tables, labeled=False):
         """
         Plots the count of scam ads by country.
         """
-        countries = []
-        for ad in scams:
-            countries += [(a.get('country'), len(a.get('age_gender_breakdowns', []))) for a in ad.get('age_country_gender_reach_breakdown', [])]
-        scam_count = defaultdict(int)
-        for country, _ in countries:
-            scam_count[country] += 1
-        scam_count_per_country = list(scam_count.items())
-        df_country_scam_count = pd.DataFrame(scam_count_per_country, columns=['country', 'scam_count'])
-        country_scam_counts = df_country_scam_count.groupby('country')['scam_count'].sum().reset_index()
-        country_scam_counts.columns = ['country', 'scam_count']
-        country_scam_counts = country_scam_counts.sort_values(by='scam_count', ascending=False)
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        country_scam_counts = tables.country_counts(labeled)
         fig = plt.figure(figsize=(10, 6))
         sns.barplot(x='country', y='scam_count', data=country_scam_counts)
         plt.title('Count of Scam Ads by Country - Filtered Unique data')
@@ -463,6 +548,9 @@ class Inspector:
         """
         Plots the distribution of scam ads by search term.
         """
+        import pandas as pd
+        import matplotlib.pyplot as plt
+        import seaborn as sns
         data = self.unique_data if unique else self.data
         search_terms = [ad['search_term'] for ad in data if 'search_term' in ad and self.get_label(ad, False)]
         if only_labeled:
@@ -480,24 +568,14 @@ class Inspector:
         plt.show()
         return plt, fig
 
-    def plot_acc_target_ages(self, scams):
+    def plot_acc_target_ages(self, tables, labeled=False):
         """
         Plots the distribution of target ages for scam ads. (Accumulated)
         """
-        age_counts = defaultdict(int)
-        for adv in scams:
-            ages = sorted(map(int, adv.get('target_ages', [])))
-            if len(ages) >= 2:
-                for age in range(ages[0], ages[1] + 1):
-                    age_counts[age] += 1
-            elif len(ages) == 1:
-                 age_counts[ages[0]] += 1
-        # Prepare data for plotting
-        df_ages = pd.DataFrame(list(age_counts.items()), columns=['age', 'count']).sort_values(by='age')
-
-        # Ensure all ages from min to max are included
-        all_ages = pd.DataFrame({'age': range(df_ages['age'].min(), df_ages['age'].max() + 1)})
-        df_ages = all_ages.merge(df_ages, on='age', how='left').fillna(0)
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        # All ages from min to max are included
+        df_ages = tables.accumulated_ages(labeled)
 
         # Plot the data
         fig = plt.figure(figsize=(10, 6))
@@ -508,19 +586,16 @@ class Inspector:
         plt.show()
         return plt, fig
 
-    def plot_target_ages(self, scams):
+    def plot_target_ages(self, tables, labeled=False):
         """
         Plots a bar graph per age range string key
-        :param scams:  list of scam ads
+        :param tables: The ScamTables of the scam ads.
+        :param labeled: Whether to only plot the scam ads that are also manually labeled as scam.
         :return:
         """
-        age_dict = defaultdict(int)
-        for ad in scams:
-            keys = ad.get('target_ages', [])
-            key = '-'.join(keys) if len(keys) > 1 else keys[0] if len(keys) == 1 else 'N/A'
-            age_dict[key] = age_dict.get(key, 0) + 1
-        df_ages = pd.DataFrame(list(age_dict.items()), columns=['age', 'count'])
-        df_ages = df_ages.sort_values(by='count', ascending=False)
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        df_ages = tables.age_range_counts(labeled)
         fig = plt.figure(figsize=(10, 6))
         ax = sns.barplot(x='age', y='count', data=df_ages)
         plt.title('Distribution of Target Age ranges for Scam Ads - Filtered Unique data')
@@ -534,58 +609,26 @@ class Inspector:
         plt.show()
         return plt, fig
 
-    def plot_target_gender(self, scams):
+    def plot_target_gender(self, tables, labeled=False):
         """
         Plots the distribution of target gender for scam ads.
         """
-        genders = [ad.get('target_gender', 'Unknown') for ad in scams]
-        df_genders = pd.DataFrame(genders, columns=['gender'])
-        gender_counts = df_genders['gender'].value_counts().reset_index()
-        gender_counts.columns = ['gender', 'count']
+        import matplotlib.pyplot as plt
+        gender_counts = tables.gender_counts(labeled)
         fig = plt.figure(figsize=(10, 6))
         plt.pie(gender_counts['count'], labels=gender_counts['gender'], autopct='%1.1f%%', startangle=140)
         plt.title('Distribution of Target Gender for Scam Ads - Filtered Unique data')
         plt.show()
         return plt, fig
 
-    def plot_ad_duration(self, scams):
+    def plot_ad_duration(self, tables, labeled=False):
         """
         Plots the distribution of ad durations grouped into specified categories.
         """
-        durations = []
-        for ad in scams:
-            if 'ad_delivery_start_time' in ad:
-                start_time = datetime.datetime.strptime(ad['ad_delivery_start_time'], '%Y-%m-%d')
-                if 'ad_delivery_stop_time' in ad:
-                    stop_time = datetime.datetime.strptime(ad['ad_delivery_stop_time'], '%Y-%m-%d')
-                    duration = (stop_time - start_time).days
-                else:
-                    duration = 1826 # more than 5 years for unending ads
-                durations.append(duration)
-
-        # Define the duration categories
-        categories = {
-            '< 1 week': 7,
-            '< 2 weeks': 14,
-            '< 1 month': 30,
-            '< 1 quarter': 90,
-            '< 1 half': 180,
-            '< 1 year': 365,
-            '< 2 years': 730,
-            '< 5 years': 1825,
-            'infinite': float('inf')
-        }
-
-        # Group durations into categories
-        duration_counts = {category: 0 for category in categories}
-        for duration in durations:
-            for category, max_days in categories.items():
-                if duration < max_days:
-                    duration_counts[category] += 1
-                    break
-
-        # Prepare data for plotting
-        df_duration = pd.DataFrame(list(duration_counts.items()), columns=['Duration', 'Count'])
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        # Durations grouped into the categories of aggregates.DURATION_CATEGORIES
+        df_duration = tables.duration_counts(labeled)
 
         # Plot the data
         fig = plt.figure(figsize=(10, 6))
@@ -601,5 +644,3 @@ class Inspector:
 
         plt.show()
         return plt, fig
-
-
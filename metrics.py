@@ -0,0 +1,200 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the instrumentation that records how long every stage takes per ad.
+              Timings are measured with a monotonic high resolution clock, the Ollama token statistics (prefill and
+              eval tokens and durations) are taken from the response metadata. At the end of a run the records are
+              exported as JSONL and Prometheus text and a p50/p95/throughput summary is printed.
+@date: 19-10-2026
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def format_duration(seconds):
+    """
+    Formats a duration without losing sub-minute precision or days, e.g. '1d 02:03:04.5' or '00:00:12.3'.
+    :param seconds: The duration in seconds.
+    :return: The formatted duration.
+    """
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    text = f'{int(hours):02d}:{int(minutes):02d}:{seconds:04.1f}'
+    return f'{int(days)}d {text}' if days else text
+
+
+def percentile(values, fraction):
+    """
+    Returns the percentile of a list of values using linear interpolation.
+    :param values: The values, they do not have to be sorted.
+    :param fraction: The percentile as fraction, e.g. 0.95.
+    :return: The percentile or 0.0 if there are no values.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class Metrics:
+    """
+    This class collects timing records of a single run of a stage, e.g. the transcription of all ads.
+    Every record has a stage name (e.g. 'transcribe.whisper'), the duration in seconds, an optional ad id and extra
+    numeric fields such as token counts. It is thread safe, so concurrent workers can share one instance.
+    """
+
+    def __init__(self, name, directory='output/metrics'):
+        self.name = name
+        self.directory = directory
+        self.records = []
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.run_id = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    def reset(self):
+        """
+        Starts a new run, forgetting the records of the previous one.
+        """
+        with self.lock:
+            self.records = []
+            self.started = time.perf_counter()
+            self.run_id = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    def record(self, stage, seconds, ad_id=None, **extra):
+        """
+        Adds a timing record.
+        :param stage: The name of the (sub)stage.
+        :param seconds: The duration in seconds.
+        :param ad_id: The id of the ad, if the record belongs to a single ad.
+        :param extra: Extra numeric fields, e.g. prompt_tokens=512.
+        """
+        with self.lock:
+            self.records.append({'stage': stage, 'seconds': seconds, 'ad_id': ad_id,
+                                 'at': time.perf_counter() - self.started, **extra})
+
+    @contextmanager
+    def timer(self, stage, ad_id=None, **extra):
+        """
+        Measures the duration of the with-block and records it, also when the block raises an exception.
+        :param stage: The name of the (sub)stage.
+        :param ad_id: The id of the ad, if the block handles a single ad.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, ad_id, **extra)
+
+    @staticmethod
+    def field(response, key):
+        """
+        Reads a field of an Ollama response, which is either a dictionary or a response object.
+        :return: The value or None if the field is not present.
+        """
+        try:
+            return response[key]
+        except (KeyError, AttributeError, TypeError):
+            return None
+
+    def record_ollama(self, stage, response, seconds, ad_id=None):
+        """
+        Records the latency of an Ollama request together with the prefill and eval statistics of the response.
+        Ollama reports durations in nanoseconds.
+        :param stage: The name of the stage, '.prefill' and '.eval' records are added for the token statistics.
+        :param response: The response of client.chat or client.generate.
+        :param seconds: The latency as measured by the client.
+        :param ad_id: The id of the ad.
+        """
+        prompt_tokens = self.field(response, 'prompt_eval_count') or 0
+        eval_tokens = self.field(response, 'eval_count') or 0
+        self.record(stage, seconds, ad_id, prompt_tokens=prompt_tokens, eval_tokens=eval_tokens,
+                    load_seconds=(self.field(response, 'load_duration') or 0) / 1e9)
+        if self.field(response, 'prompt_eval_duration') is not None:
+            self.record(f'{stage}.prefill', self.field(response, 'prompt_eval_duration') / 1e9, ad_id,
+                        tokens=prompt_tokens)
+        if self.field(response, 'eval_duration') is not None:
+            self.record(f'{stage}.eval', self.field(response, 'eval_duration') / 1e9, ad_id, tokens=eval_tokens)
+
+    def summary(self):
+        """
+        Summarizes the records per stage.
+        :return: A dictionary of stage -> {count, total, p50, p95, max, throughput (per second of wall time),
+                 tokens_per_second (if the records have tokens)}.
+        """
+        with self.lock:
+            records = list(self.records)
+        wall = max(time.perf_counter() - self.started, 1e-9)
+        stages = {}
+        for record in records:
+            stages.setdefault(record['stage'], []).append(record)
+        result = {}
+        for stage, stage_records in stages.items():
+            seconds = [record['seconds'] for record in stage_records]
+            result[stage] = {
+                'count': len(seconds),
+                'total': sum(seconds),
+                'p50': percentile(seconds, 0.5),
+                'p95': percentile(seconds, 0.95),
+                'max': max(seconds),
+                'throughput': len(seconds) / wall,
+            }
+            tokens = sum(record.get('tokens', 0) for record in stage_records)
+            if tokens:
+                result[stage]['tokens_per_second'] = tokens / max(sum(seconds), 1e-9)
+        return result
+
+    def export_jsonl(self, path=None):
+        """
+        Writes every record as a JSON line.
+        :return: The path of the written file.
+        """
+        path = path or f'{self.directory}/{self.name}-{self.run_id}.jsonl'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self.lock:
+            records = list(self.records)
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps({'run': self.run_id, **record}) + '\n')
+        return path
+
+    def export_prometheus(self, path=None):
+        """
+        Writes the summary in the Prometheus text exposition format, so it can be picked up by a node exporter.
+        :return: The path of the written file.
+        """
+        path = path or f'{self.directory}/{self.name}.prom'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        lines = ['# HELP mad_stage_seconds Duration of a pipeline stage per ad or request.',
+                 '# TYPE mad_stage_seconds summary']
+        for stage, summary in self.summary().items():
+            labels = f'run="{self.name}",stage="{stage}"'
+            lines.append(f'mad_stage_seconds{{{labels},quantile="0.5"}} {summary["p50"]:.6f}')
+            lines.append(f'mad_stage_seconds{{{labels},quantile="0.95"}} {summary["p95"]:.6f}')
+            lines.append(f'mad_stage_seconds_sum{{{labels}}} {summary["total"]:.6f}')
+            lines.append(f'mad_stage_seconds_count{{{labels}}} {summary["count"]}')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def report(self):
+        """
+        Prints the p50/p95/throughput summary of the run and exports the records. Does nothing if nothing was recorded.
+        """
+        summary = self.summary()
+        if not summary:
+            return
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Performance of `{self.name}` '
+              f'(wall time {format_duration(time.perf_counter() - self.started)}):')
+        print(f'\t{"stage":<28} {"count":>7} {"total":>12} {"p50 (s)":>9} {"p95 (s)":>9} {"per s":>8} {"tok/s":>8}')
+        for stage, s in sorted(summary.items()):
+            tokens = f'{s["tokens_per_second"]:.1f}' if 'tokens_per_second' in s else '-'
+            print(f'\t{stage:<28} {s["count"]:>7} {format_duration(s["total"]):>12} {s["p50"]:>9.3f} '
+                  f'{s["p95"]:>9.3f} {s["throughput"]:>8.2f} {tokens:>8}')
+        print(f'\t» Exported to `{self.export_jsonl()}` and `{self.export_prometheus()}`')
@@ -0,0 +1,240 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the JSON extractor for the responses of the LLMs. It scans a response once, parses
+              the first balanced JSON object while tolerating the usual LLM mistakes (single quotes, trailing commas,
+              Python literals) and validates the result against the criteria or label schema.
+              The schemas are plain JSON schemas, so they can also be passed as Ollama `format` to constrain a re-ask.
+@date: 19-10-2026
+"""
+import json
+import threading
+
+CRITERIA_KEYS = ['free_crypto', 'giveaway', 'unrealistic', 'bio_link', 'limited_time', 'about_crypto']
+CONFIDENCE_LEVELS = ['Very unlikely', 'Unlikely', 'Unsure', 'Likely', 'Very likely']
+
+CRITERIA_SCHEMA = {
+    'type': 'object',
+    'properties': {key: {'type': 'boolean'} for key in CRITERIA_KEYS},
+    'required': CRITERIA_KEYS,
+}
+
+# The constrained criteria mode generates the criteria in this order, so the criteria the filter needs come first and
+# the generation can stop as soon as they reject the ad (see Filter.rejects)
+CRITERIA_ORDER = ['about_crypto', 'free_crypto', 'giveaway', 'unrealistic', 'bio_link', 'limited_time']
+CONSTRAINED_CRITERIA_SCHEMA = {
+    'type': 'object',
+    'properties': {key: {'type': 'boolean'} for key in CRITERIA_ORDER},
+    'required': CRITERIA_ORDER,
+}
+
+LABEL_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'scam': {'type': 'boolean'},
+        'reason': {'type': 'string'},
+        'confidence': {'type': 'string', 'enum': CONFIDENCE_LEVELS},
+    },
+    'required': ['scam', 'reason', 'confidence'],
+}
+
+LITERALS = {'true': True, 'false': False, 'null': None, 'none': None}
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '/': '/', '\\': '\\', '"': '"', "'": "'"}
+
+
+class JsonExtractor:
+    """
+    This class extracts and validates JSON objects from LLM responses and counts how often that fails. The counters
+    are shared by the concurrent label requests, so they are only updated through count.
+    """
+
+    def __init__(self):
+        self.parsed = 0
+        self.failures = 0
+        self.retries = 0
+        self.retry_failures = 0
+        self.lock = threading.Lock()
+
+    def count(self, counter):
+        """
+        Increments a counter: 'parsed', 'failures', 'retries' or 'retry_failures'. Safe to call from multiple threads.
+        """
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def parse(self, text, schema=None):
+        """
+        Extracts the first JSON object of a text and validates it against a schema.
+        :param text: The response of the LLM.
+        :param schema: CRITERIA_SCHEMA, LABEL_SCHEMA or None to skip validation.
+        :return: The (validated) dictionary.
+        :raises ValueError: If no (valid) JSON object could be found, the failure is counted.
+        """
+        try:
+            result = self.extract(text)
+            result = self.validate(result, schema) if schema else result
+            self.count('parsed')
+            return result
+        except ValueError:
+            self.count('failures')
+            raise
+
+    def extract(self, text):
+        """
+        Parses the first balanced JSON object in the text in a single pass.
+        :param text: The text to scan.
+        :return: The parsed dictionary.
+        :raises ValueError: If the text does not contain a JSON object.
+        """
+        if text.lstrip().startswith('{'):
+            try:
+                return json.loads(text)  # Fast path for well-formed responses, e.g. with an Ollama `format`
+            except json.JSONDecodeError:
+                pass
+        start = text.find('{')
+        if start == -1:
+            raise ValueError(f'No JSON object found in: {text[:200]}')
+        value, _ = self.parse_value(text, start)
+        return value
+
+    def skip(self, text, i):
+        """
+        :return: The index of the first non-whitespace character at or after i.
+        """
+        while i < len(text) and text[i] in ' \t\r\n':
+            i += 1
+        return i
+
+    def parse_value(self, text, i):
+        """
+        Parses any JSON value (object, array, string, number or literal) starting at index i.
+        :return: Tuple of (value, index after the value).
+        """
+        i = self.skip(text, i)
+        if i >= len(text):
+            raise ValueError('Unexpected end of JSON')
+        char = text[i]
+        if char == '{':
+            return self.parse_object(text, i + 1)
+        if char == '[':
+            return self.parse_array(text, i + 1)
+        if char in '"\'':
+            return self.parse_string(text, i)
+        end = i
+        while end < len(text) and text[end] not in ',}] \t\r\n':
+            end += 1
+        token = text[i:end]
+        if token.lower() in LITERALS:
+            return LITERALS[token.lower()], end
+        try:
+            return (float(token) if any(c in token for c in '.eE') else int(token)), end
+        except ValueError:
+            raise ValueError(f'Unexpected token `{token[:50]}` at {i}')
+
+    def parse_object(self, text, i):
+        """
+        Parses the members of an object, i points just after the opening brace. Trailing commas are allowed.
+        :return: Tuple of (dictionary, index after the closing brace).
+        """
+        result = {}
+        while True:
+            i = self.skip(text, i)
+            if i < len(text) and text[i] == '}':
+                return result, i + 1
+            key, i = self.parse_value(text, i)
+            i = self.skip(text, i)
+            if i >= len(text) or text[i] != ':':
+                raise ValueError(f'Expected `:` after key `{key}`')
+            value, i = self.parse_value(text, i + 1)
+            result[str(key)] = value
+            i = self.skip(text, i)
+            if i < len(text) and text[i] == ',':  # A trailing comma is handled by the `}` check above
+                i += 1
+            elif i >= len(text) or text[i] != '}':
+                raise ValueError(f'Expected `,` or `}}` after value of `{key}`')
+
+    def parse_array(self, text, i):
+        """
+        Parses the values of an array, i points just after the opening bracket. Trailing commas are allowed.
+        :return: Tuple of (list, index after the closing bracket).
+        """
+        result = []
+        while True:
+            i = self.skip(text, i)
+            if i < len(text) and text[i] == ']':
+                return result, i + 1
+            value, i = self.parse_value(text, i)
+            result.append(value)
+            i = self.skip(text, i)
+            if i < len(text) and text[i] == ',':
+                i += 1
+            elif i >= len(text) or text[i] != ']':
+                raise ValueError('Expected `,` or `]` in array')
+
+    def parse_string(self, text, i):
+        """
+        Parses a string delimited by double or single quotes starting at index i. The content is kept as is.
+        :return: Tuple of (string, index after the closing quote).
+        """
+        quote = text[i]
+        chars = []
+        i += 1
+        while i < len(text):
+            char = text[i]
+            if char == quote:
+                return ''.join(chars), i + 1
+            if char == '\\' and i + 1 < len(text):
+                escaped = text[i + 1]
+                if escaped == 'u' and i + 5 < len(text):
+                    chars.append(chr(int(text[i + 2:i + 6], 16)))
+                    i += 6
+                    continue
+                chars.append(ESCAPES.get(escaped, escaped))
+                i += 2
+                continue
+            chars.append(char)
+            i += 1
+        raise ValueError('Unterminated string in JSON')
+
+    @staticmethod
+    def validate(obj, schema):
+        """
+        Validates a parsed object against a schema. Booleans written as strings ('true', 'yes') and confidence levels
+        in the wrong case are normalized, other mismatches are rejected rather than guessed.
+        :param obj: The parsed object.
+        :param schema: The schema to validate against.
+        :return: The object with normalized values.
+        :raises ValueError: If a required key is missing or a value has the wrong type.
+        """
+        if not isinstance(obj, dict):
+            raise ValueError('Expected a JSON object')
+        result = dict(obj)
+        for key in schema['required']:
+            if key not in obj:
+                raise ValueError(f'Missing key `{key}`')
+        for key, spec in schema['properties'].items():
+            if key not in obj:
+                continue
+            value = obj[key]
+            if spec['type'] == 'boolean':
+                if isinstance(value, str) and value.strip().lower() in ['true', 'yes', 'false', 'no']:
+                    value = value.strip().lower() in ['true', 'yes']
+                if not isinstance(value, bool):
+                    raise ValueError(f'Expected a boolean for `{key}`, got `{value}`')
+            elif spec['type'] == 'string':
+                if not isinstance(value, str):
+                    raise ValueError(f'Expected a string for `{key}`, got `{value}`')
+                if 'enum' in spec:
+                    matches = [option for option in spec['enum'] if option.lower() == value.strip().lower()]
+                    if not matches:
+                        raise ValueError(f'Unexpected value `{value}` for `{key}`')
+                    value = matches[0]
+            result[key] = value
+        return result
+
+    def stats(self):
+        """
+        :return: A short summary of the parse failures and re-asks.
+        """
+        with self.lock:
+            return (f'{self.parsed} parsed, {self.failures} parse failures, {self.retries} re-asks '
+                    f'({self.retry_failures} failed)')
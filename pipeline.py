@@ -0,0 +1,120 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the pipeline manifest that keeps track of the inputs and parameters of every stage.
+              Using the manifest a stage (or a single JSON file within a stage) is only recomputed when its inputs
+              or parameters changed since the last run, similar to how Make compares targets with their sources.
+@date: 19-10-2026
+"""
+import hashlib
+import json
+import os
+
+
+class Manifest:
+    """
+    This class stores per-stage fingerprints in output/manifest.json. A fingerprint is a hash over the content of the
+    input files and the parameters (model, temperature, top_k, top_p, MAX_VIDEO_LENGTH, ...) of the stage.
+    """
+
+    def __init__(self, path='output/manifest.json'):
+        self.path = path
+        self.stages = {}
+        self.files = {}  # path -> {size, mtime, sha1}: avoids rehashing files that did not change on disk
+        self.load()
+
+    def load(self):
+        """
+        (Re)loads the manifest from disk, other processes or classes might have updated it in the meantime.
+        """
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            self.stages = manifest.get('stages', {})
+            self.files = manifest.get('files', {})
+
+    def save(self):
+        """
+        Writes the manifest to disk. It first writes to a temporary file so a crash never leaves a broken manifest.
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'stages': self.stages, 'files': self.files}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def file_hash(self, path):
+        """
+        Returns the SHA1 hash of the content of a file. The hash is cached by size and modification time so unchanged
+        files are not read again.
+        :param path: The path of the file to hash.
+        :return: The hex digest or None if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+            return cached['sha1']
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        self.files[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1.hexdigest()}
+        return self.files[path]['sha1']
+
+    def fingerprint(self, inputs, params=None):
+        """
+        Combines the hashes of the input files and the parameters into a single fingerprint.
+        :param inputs: The list of input file paths.
+        :param params: A JSON serializable dictionary with the parameters of the stage.
+        :return: The fingerprint as hex digest.
+        """
+        sha1 = hashlib.sha1()
+        for path in sorted(inputs):
+            sha1.update(f'{path}:{self.file_hash(path)};'.encode('utf-8'))
+        sha1.update(json.dumps(params or {}, sort_keys=True).encode('utf-8'))
+        return sha1.hexdigest()
+
+    def is_stale(self, stage, inputs, params=None, outputs=()):
+        """
+        Checks whether a stage has to be recomputed.
+        :param stage: The name of the stage, e.g. 'filter' or 'criteria:output/ads_crypto/json/file.json'.
+        :param inputs: The list of input file paths.
+        :param params: The parameters of the stage.
+        :param outputs: The files the stage produces, if one of them is missing the stage is stale.
+        :return: True if the stage never ran, its inputs or parameters changed or an output is missing.
+        """
+        self.load()
+        record = self.stages.get(stage)
+        if record is None or any(not os.path.exists(output) for output in outputs):
+            return True
+        return record['fingerprint'] != self.fingerprint(inputs, params)
+
+    def record(self, stage, inputs, params=None, outputs=()):
+        """
+        Stores the fingerprint of a stage after it successfully ran. Note that the inputs are hashed AFTER the stage
+        ran, so stages that update their input files in place (e.g. criteria generation) are not seen as stale.
+        :param stage: The name of the stage.
+        :param inputs: The list of input file paths.
+        :param params: The parameters of the stage.
+        :param outputs: The files the stage produced.
+        """
+        self.load()
+        self.stages[stage] = {
+            'fingerprint': self.fingerprint(inputs, params),
+            'inputs': sorted(inputs),
+            'params': params or {},
+            'outputs': list(outputs),
+        }
+        self.save()
+
+    @staticmethod
+    def ad_hash(ad, keys=('ad_creative_bodies', 'video_transcription')):
+        """
+        Hashes the fields of an ad that are used as input for a stage, so a single ad can be checked for changes.
+        :param ad: The ad to hash.
+        :param keys: The fields of the ad that are used as input.
+        :return: A short hex digest of the fields.
+        """
+        content = json.dumps([ad.get(key) for key in keys], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
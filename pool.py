@@ -0,0 +1,206 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the pool of Ollama endpoints, so the LLM requests can be spread over several inference
+              hosts. Every endpoint has the models it serves and the amount of requests it handles at once. A request
+              goes to the least loaded endpoint that serves its model, a failed request is retried on another endpoint
+              and an endpoint that failed is avoided for a while. The pool has the chat and generate methods of the
+              ollama.Client, so the AIToolBox uses it the same way. Configure it with OLLAMA_ENDPOINTS, either a
+              comma separated list of hosts or a JSON file like:
+                  [{"host": "http://gpu1:11434", "models": ["qwen2.5:32b"], "concurrency": 2},
+                   {"host": "http://gpu2:11434", "models": ["qwen2.5:32b", "llama3.2"], "concurrency": 4}]
+@date: 19-10-2026
+"""
+import datetime
+import json
+import os
+import threading
+import time
+
+from metrics import percentile
+
+
+class Endpoint:
+    """
+    This class is a single Ollama host of the pool with its load and statistics.
+    """
+
+    def __init__(self, host, models=None, concurrency=1, client=None):
+        """
+        :param host: The URL of the Ollama host.
+        :param models: The models the host serves, None if it serves every model.
+        :param concurrency: The maximum amount of requests at once, match OLLAMA_NUM_PARALLEL of the host.
+        :param client: The client to send the requests with, an ollama.Client for the host by default.
+        """
+        if client is None:
+            import ollama
+            client = ollama.Client(host=host)
+        self.host = host
+        self.models = set(models) if models else None
+        self.concurrency = max(int(concurrency), 1)
+        self.client = client
+        self.in_flight = 0
+        self.latencies = []
+        self.failures = 0
+        self.down_until = 0.0
+
+    def serves(self, model):
+        """
+        :return: True if the endpoint serves the model.
+        """
+        return self.models is None or model in self.models
+
+    @property
+    def load(self):
+        """
+        :return: The share of the capacity of the endpoint that is in use.
+        """
+        return self.in_flight / self.concurrency
+
+    def stats(self):
+        """
+        :return: A dictionary with the requests, failures, in-flight requests and latencies of the endpoint.
+        """
+        return {'host': self.host, 'requests': len(self.latencies), 'failures': self.failures,
+                'in_flight': self.in_flight, 'p50': percentile(self.latencies, 0.5),
+                'p95': percentile(self.latencies, 0.95), 'mean': sum(self.latencies) / max(len(self.latencies), 1)}
+
+
+class OllamaPool:
+    """
+    This class routes the requests over the endpoints. A request waits when every endpoint that serves its model is
+    at its concurrency, so the pool never overloads a host.
+    """
+
+    def __init__(self, endpoints, retries=None, cooldown=None):
+        """
+        :param endpoints: The list of Endpoints.
+        :param retries: How many other endpoints a failed request is tried on, OLLAMA_RETRIES or 2 by default.
+        :param cooldown: How many seconds a failed endpoint is avoided, OLLAMA_COOLDOWN or 30 by default.
+        """
+        if not endpoints:
+            raise ValueError('An Ollama pool needs at least one endpoint')
+        self.endpoints = endpoints
+        self.retries = int(os.getenv('OLLAMA_RETRIES', 2)) if retries is None else retries
+        self.cooldown = float(os.getenv('OLLAMA_COOLDOWN', 30)) if cooldown is None else cooldown
+        self.condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates the pool of the endpoints in OLLAMA_ENDPOINTS.
+        :return: The pool, None if OLLAMA_ENDPOINTS is not set.
+        """
+        spec = os.getenv('OLLAMA_ENDPOINTS', '').strip()
+        if not spec:
+            return None
+        if spec.endswith('.json'):
+            with open(spec, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            return cls([Endpoint(e['host'], e.get('models'), e.get('concurrency', 1)) for e in config])
+        return cls([Endpoint(host.strip()) for host in spec.split(',') if host.strip()])
+
+    def acquire(self, model, tried):
+        """
+        Reserves a slot on the least loaded endpoint that serves the model, waiting until one is free.
+        Endpoints that failed recently are only used if no other endpoint serves the model.
+        :param model: The model of the request.
+        :param tried: The endpoints this request already failed on.
+        :return: The endpoint.
+        :raises ValueError: If no endpoint (that was not tried yet) serves the model.
+        """
+        with self.condition:
+            while True:
+                candidates = [e for e in self.endpoints if e.serves(model) and e not in tried]
+                if not candidates:
+                    raise ValueError(f'No{" other" if tried else ""} Ollama endpoint serves `{model}`')
+                now = time.monotonic()
+                healthy = [e for e in candidates if e.down_until <= now] or candidates
+                free = [e for e in healthy if e.in_flight < e.concurrency]
+                if free:
+                    endpoint = min(free, key=lambda e: (e.load, e.down_until))
+                    endpoint.in_flight += 1
+                    return endpoint
+                self.condition.wait()
+
+    def release(self, endpoint, seconds=None, failed=False):
+        """
+        Frees the slot of a request and records its latency or failure.
+        """
+        with self.condition:
+            endpoint.in_flight -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.down_until = time.monotonic() + self.cooldown
+            else:
+                endpoint.latencies.append(seconds)
+                endpoint.down_until = 0.0
+            self.condition.notify_all()
+
+    def request(self, method, model, **kwargs):
+        """
+        Sends a request to an endpoint and retries it on other endpoints when it fails.
+        :param method: The method of the ollama.Client, 'chat' or 'generate'.
+        :param model: The model of the request.
+        :return: The response.
+        """
+        tried, last_error = [], None
+        while True:
+            try:
+                endpoint = self.acquire(model, tried)
+            except ValueError:
+                if last_error is not None:
+                    raise last_error from None  # All endpoints failed, the last error is the most relevant
+                raise
+            start = time.perf_counter()
+            try:
+                response = getattr(endpoint.client, method)(model=model, **kwargs)
+            except Exception as e:
+                self.release(endpoint, failed=True)
+                print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Ollama request to `{endpoint.host}` '
+                      f'failed: {e}')
+                tried.append(endpoint)
+                last_error = e
+                if len(tried) > self.retries:
+                    raise
+                continue
+            if kwargs.get('stream'):
+                return self.stream(endpoint, response, start)
+            self.release(endpoint, time.perf_counter() - start)
+            return response
+
+    def stream(self, endpoint, chunks, start):
+        """
+        Passes the chunks of a streamed response on and frees the slot once the stream is consumed or closed, so a
+        request that is stopped early frees its slot right away. Streamed requests are not retried.
+        """
+        failed = False
+        try:
+            yield from chunks
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(endpoint, time.perf_counter() - start, failed=failed)
+
+    def chat(self, model, **kwargs):
+        return self.request('chat', model, **kwargs)
+
+    def generate(self, model, **kwargs):
+        return self.request('generate', model, **kwargs)
+
+    def stats(self):
+        """
+        :return: The statistics per endpoint.
+        """
+        with self.condition:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+    def report(self):
+        """
+        Prints the requests, failures and latencies per endpoint.
+        """
+        print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Ollama endpoints:')
+        print(f'\t{"host":<32} {"requests":>8} {"failures":>8} {"p50 (s)":>8} {"p95 (s)":>8} {"mean (s)":>8}')
+        for s in self.stats():
+            print(f'\t{s["host"]:<32} {s["requests"]:>8} {s["failures"]:>8} {s["p50"]:>8.2f} {s["p95"]:>8.2f} '
+                  f'{s["mean"]:>8.2f}')
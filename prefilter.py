@@ -0,0 +1,249 @@
+"""
+@author: Luuk Kablan
+@description: This file contains a cheap rule-based pre-filter that runs before the LLM criteria generation.
+              It scores the text of an ad with an Aho-Corasick automaton over a multilingual crypto vocabulary and a
+              few compiled regular expressions (coin tickers and wallet addresses). Only ads that could plausibly be
+              about cryptocurrency are sent to the LLM.
+@date: 19-10-2026
+"""
+import datetime
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import deque
+
+from archive import is_ads_file, load_ads
+
+# Vocabulary matched as substrings of the normalized (NFKC + casefolded) text, with its weight
+VOCABULARY = {
+    # English
+    'crypto': 2, 'bitcoin': 3, 'ethereum': 3, 'blockchain': 2, 'airdrop': 2, 'altcoin': 3, 'stablecoin': 3,
+    'memecoin': 3, 'dogecoin': 3, 'litecoin': 3, 'solana': 2, 'ripple': 1, 'cardano': 2, 'polkadot': 2,
+    'tether': 2, 'binance': 3, 'coinbase': 3, 'kraken': 1, 'metamask': 3, 'trust wallet': 3, 'wallet': 1,
+    'token': 1.5, 'presale': 2, 'pre-sale': 2, 'digital currenc': 3, 'digital asset': 2, 'digital coin': 3,
+    'claim': 1, 'x return': 1, 'nft': 1, 'defi': 2, 'staking': 2, 'mining': 1, 'satoshi': 2, 'web3': 2, 'dex': 0.5,
+    'seed phrase': 3, 'private key': 2, 'coin': 0.5, 'trading bot': 1, 'elon': 0.5, 'musk': 0.5,
+    # Dutch / German / Scandinavian
+    'cryptomunt': 3, 'kryptowährung': 3, 'krypto': 2, 'kryptovaluta': 3, 'munten': 0.5, 'münzen': 0.5,
+    # French / Spanish / Portuguese / Italian
+    'cryptomonnaie': 3, 'criptomoneda': 3, 'criptomoeda': 3, 'criptovaluta': 3, 'cripto': 2, 'monnaie': 0.5,
+    'moneda': 0.5,
+    # Polish / Czech / Romanian / Turkish
+    'kryptowalut': 3, 'kryptoměn': 3, 'criptomonede': 3, 'kripto': 2,
+    # Russian / Ukrainian / Greek
+    'криптовалют': 3, 'крипто': 2, 'биткоин': 3, 'біткоїн': 3, 'эфириум': 3, 'блокчейн': 2, 'κρυπτονομ': 3,
+    # Arabic / Hebrew / Asian languages
+    'عملات رقمية': 3, 'بيتكوين': 3, 'ביטקוין': 3, '比特币': 3, '比特幣': 3, '加密货币': 3, '加密貨幣': 3,
+    'ビットコイン': 3, '仮想通貨': 3, '암호화폐': 3, '비트코인': 3, 'tiền điện tử': 3, 'mata uang kripto': 3,
+}
+
+# Short or common vocabulary words that are also parts of unrelated words (e.g. 'elon' in 'belong', 'dex' in 'index'),
+# these only count as whole words, optionally in plural
+WHOLE_WORDS = {'elon', 'musk', 'dex', 'nft', 'defi', 'coin', 'claim', 'token', 'wallet', 'mining', 'ripple', 'kraken',
+               'tether', 'solana', 'munten', 'monnaie', 'moneda'}
+
+# Coin tickers, matched case-sensitively as whole words (optionally prefixed with $) to avoid hits in words like 'method'
+TICKERS = ['BTC', 'ETH', 'USDT', 'USDC', 'BNB', 'SOL', 'XRP', 'ADA', 'DOGE', 'SHIB', 'TRX', 'LTC', 'DOT', 'AVAX',
+           'MATIC', 'TON', 'PEPE', 'XLM', 'LINK']
+
+# Wallet address patterns with their weight
+WALLET_PATTERNS = {
+    'btc_wallet': (r'\b(?:bc1[a-z0-9]{25,59}|[13][a-km-zA-HJ-NP-Z1-9]{25,34})\b', 4),
+    'eth_wallet': (r'\b0x[a-fA-F0-9]{40}\b', 4),
+    'tron_wallet': (r'\bT[1-9A-HJ-NP-Za-km-z]{33}\b', 4),
+}
+
+# Scammers like to write in small capitals (e.g. 'ʙɪᴛᴄᴏɪɴ') which NFKC does not normalize, or hide keywords with
+# zero width characters and combining underlines, which are removed
+SMALL_CAPS = str.maketrans('ᴀʙᴄᴅᴇꜰɢʜɪᴊᴋʟᴍɴᴏᴘʀꜱᴛᴜᴠᴡʏᴢ', 'abcdefghijklmnoprstuvwyz',
+                           '\u200b\u200c\u200d\u2060\ufeff\u0332\u0331\u0336')
+
+
+class AhoCorasick:
+    """
+    This class is a minimal Aho-Corasick automaton which finds all occurrences of a set of keywords in a single pass
+    over the text, regardless of the amount of keywords.
+    """
+
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword in keywords:
+            self.add(keyword)
+        self.build()
+
+    def add(self, keyword):
+        """
+        Adds a keyword to the trie of the automaton.
+        :param keyword: The keyword to add.
+        """
+        state = 0
+        for char in keyword:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(keyword)
+
+    def build(self):
+        """
+        Computes the failure links of the trie with a breadth first traversal.
+        """
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text):
+        """
+        Finds all keywords in the text.
+        :param text: The text to search.
+        :return: A list of (end index, keyword) tuples, one per occurrence of a keyword.
+        """
+        state = 0
+        matches = []
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                matches += [(i + 1, keyword) for keyword in self.output[state]]
+        return matches
+
+
+class PreFilter:
+    """
+    This class scores ads on how plausible it is that they are about cryptocurrency. Ads with a score below the
+    threshold are not sent to the LLM for criteria generation, they get all criteria set to false instead.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = float(os.getenv('PREFILTER_THRESHOLD', 2)) if threshold is None else threshold
+        self.automaton = AhoCorasick(VOCABULARY.keys())
+        self.ticker_regex = re.compile(r'(?<![A-Za-z0-9])\$?(?:' + '|'.join(TICKERS) + r')(?![A-Za-z0-9])')
+        self.wallet_regexes = {name: (re.compile(pattern), weight) for name, (pattern, weight)
+                               in WALLET_PATTERNS.items()}
+
+    @staticmethod
+    def ad_text(ad):
+        """
+        Concatenates all text of an ad that is also given to the LLM, plus the link captions, titles and descriptions.
+        :param ad: The ad to get the text from.
+        :return: The raw text of the ad.
+        """
+        parts = []
+        for key in ['ad_creative_bodies', 'ad_creative_link_titles', 'ad_creative_link_descriptions',
+                    'ad_creative_link_captions']:
+            parts += [text for text in ad.get(key, []) if text]
+        parts.append(ad.get('video_transcription') or '')
+        return '\n'.join(parts)
+
+    @staticmethod
+    def is_whole_word(text, start, end):
+        """
+        Checks whether a match in the text is a whole word, a plural 's' is allowed.
+        :return: True if the match is not surrounded by other letters or digits.
+        """
+        if end < len(text) and text[end] == 's':
+            end += 1
+        return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+    def score(self, ad):
+        """
+        Scores an ad by summing the weights of the distinct vocabulary words, tickers and wallet addresses it contains.
+        :param ad: The ad to score.
+        :return: Tuple of (score, list of matched features).
+        """
+        raw = self.ad_text(ad)
+        text = unicodedata.normalize('NFKC', raw).translate(SMALL_CAPS).casefold()
+        raw = raw.translate(SMALL_CAPS)
+        features = {keyword for end, keyword in self.automaton.find(text)
+                    if keyword not in WHOLE_WORDS or self.is_whole_word(text, end - len(keyword), end)}
+        score = sum(VOCABULARY[word] for word in features)
+        tickers = set(match.lstrip('$') for match in self.ticker_regex.findall(raw))
+        score += 2 * len(tickers)
+        features |= {f'${ticker}' for ticker in tickers}
+        for name, (regex, weight) in self.wallet_regexes.items():
+            if regex.search(raw):
+                score += weight
+                features.add(name)
+        return score, sorted(features)
+
+    def is_candidate(self, ad):
+        """
+        Checks whether an ad should be sent to the LLM for criteria generation.
+        :param ad: The ad to check.
+        :return: True if the score of the ad reaches the threshold.
+        """
+        return self.score(ad)[0] >= self.threshold
+
+    def evaluate(self, ads):
+        """
+        Measures how well the pre-filter agrees with the LLM criteria that were already generated. Ads without
+        criteria are ignored. The 'kept' recall is the most important number: it is the fraction of the ads that would
+        pass the Filter that are still sent to the LLM, so a recall of 1.0 means no relevant ad gets lost. For ads with a
+        manual label the recall of the manually confirmed scams is reported as well.
+        :param ads: The ads with a 'classification' dictionary.
+        :return: A dictionary with the precision, recall, kept recall, reduction of LLM calls and time per ad.
+        """
+        tp = fp = fn = tn = kept = kept_found = scams = scams_found = 0
+        ads = [ad for ad in ads if 'about_crypto' in ad.get('classification', {})]
+        start = time.perf_counter()
+        predictions = [self.is_candidate(ad) for ad in ads]
+        elapsed = time.perf_counter() - start
+        for ad, predicted in zip(ads, predictions):
+            actual = bool(ad['classification']['about_crypto'])
+            tp += predicted and actual
+            fp += predicted and not actual
+            fn += actual and not predicted
+            tn += not predicted and not actual
+            if actual and any(ad['classification'].get(key, False) for key in ['free_crypto', 'giveaway']):
+                kept += 1
+                kept_found += predicted
+            if ad.get('manual_label', {}).get('scam', False):
+                scams += 1
+                scams_found += predicted
+        return {
+            'ads': len(ads),
+            'precision': tp / (tp + fp) if tp + fp else 'NaN',
+            'recall': tp / (tp + fn) if tp + fn else 'NaN',
+            'kept_recall': kept_found / kept if kept else 'NaN',
+            'scam_recall': scams_found / scams if scams else 'NaN',
+            'llm_calls_avoided': (tn + fn) / len(ads) if ads else 'NaN',
+            'us_per_ad': elapsed / len(ads) * 1e6 if ads else 'NaN',
+        }
+
+    def evaluate_output(self, output_dir='output'):
+        """
+        Evaluates the pre-filter on all collected ads with criteria and on the samples and prints the results.
+        """
+        ads = []
+        for folder in sorted(os.listdir(output_dir)):
+            if not os.path.isdir(f'{output_dir}/{folder}/json'):
+                continue
+            for json_file in sorted(os.listdir(f'{output_dir}/{folder}/json')):
+                if is_ads_file(json_file):
+                    ads += load_ads(f'{output_dir}/{folder}/json/{json_file}')['data']
+        samples = []
+        if os.path.exists(f'{output_dir}/samples.json'):
+            with open(f'{output_dir}/samples.json', 'r', encoding='utf-8') as f:
+                samples = json.load(f)['data']
+        for name, subset in [('collected', ads), ('samples', samples)]:
+            result = self.evaluate(subset)
+            print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Pre-filter on {name} ads '
+                  f'(threshold {self.threshold}): {result}')
+
+
+if __name__ == '__main__':
+    PreFilter().evaluate_output()
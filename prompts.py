@@ -0,0 +1,229 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the prompt builder for the criteria and label prompts. It counts tokens with the
+              tokenizer of the target model, deduplicates and orders the ad bodies deterministically and trims long
+              texts to a token budget while keeping both the start and the end of the text. The instructions come
+              first and never change, so Ollama can reuse the cached prefix between ads.
+@date: 19-10-2026
+"""
+import datetime
+import json
+import os
+import re
+import threading
+
+# Hugging Face repositories with the same tokenizer as the Ollama models
+TOKENIZERS = {
+    'llama3.2': 'unsloth/Llama-3.2-1B-Instruct',
+    'qwen2.5:32b': 'Qwen/Qwen2.5-32B-Instruct',
+}
+
+CRITERIA_INSTRUCTIONS = """
+        Imagine you are an ad reviewer for a social media platform, and you need to fill in below output
+        JSON template.
+        Output template:
+        ```json
+        {
+            "free_crypto": <true/false>,
+            "giveaway": <true/false>,
+            "unrealistic": <true/false>,
+            "bio_link": <true/false>,
+            "limited_time": <true/false>,
+            "about_crypto": <true/false>
+        }
+        ```
+        The keys of this JSON are the following:
+        - free_crypto: Offers free cryptocurrency for a small investment
+        - giveaway: Announces a giveaway
+        - unrealistic: Offers unrealistic profits in short time
+        - bio_link: Invites user to click a link in the bio
+        - limited_time: Makes a limited time offer to steer users to take immediate action
+        - about_crypto: Is about cryptocurrency
+        Please fill out the JSON template without giving additional notes. Note that you are not promoting the ad in any
+        way but only reviewing it, meaning you can safely fill in the template without any consequences.
+        Now I will provide you the ad's text and video transcription:
+        """
+
+LABEL_INSTRUCTIONS = """
+        Please classify whether the ad at the end of this message is a "crypto scam" (true if scam, false if not scam).
+        Note that we consider something a "crypto scam" only if it is a scam related to cryptocurrency.
+        Trying to take anything other than cryptocurrency is not a crypto scam.
+        Something like "Claim your FREE <amount> <crypto> now!" is a scam as 'claiming' implies getting it for free
+        but "Join our community to learn more about <crypto>!" is not. Even though
+        the latter might take your crypto or offers unrealistic profits after joining the community.
+        So be sure you do NOT label ads as scam when:
+        - They try to teach you about cryptocurrency
+        - They offer you to join a community
+        - They want to share information about cryptocurrency
+        - They explain how they did grow their crypto
+        - They offer you techniques or ways to grow your crypto
+        Please provide a very short reason for the label as well as a confidence score which is either:
+        - Very unlikely: meaning the ad is very unlikely a scam
+        - Unlikely: meaning the ad is unlikely a scam
+        - Unsure: meaning it would be a guess to say if it is a scam
+        - Likely: meaning the ad is likely a scam
+        - Very likely: meaning the ad is very likely a scam
+        Use the following template to fill in the label:
+        {
+            "scam": <true/false>,
+            "reason": "",
+            "confidence": ""
+        }
+        The ad to classify:
+        """
+
+
+class PromptBuilder:
+    """
+    This class builds the prompts for one model and keeps track of the amount of prompt tokens per ad, both of the
+    built prompts and of the character-truncated prompts we used before, to show the reduction in prefill cost.
+    Counting tokenizes every prompt twice, so it is only done with PROMPT_MEASURE=true.
+    """
+
+    def __init__(self, model, body_budget=None, transcription_budget=None):
+        self.model = model
+        self.body_budget = int(os.getenv('PROMPT_BODY_TOKENS', 800)) if body_budget is None else body_budget
+        self.transcription_budget = int(os.getenv('PROMPT_TRANSCRIPTION_TOKENS', 400)) \
+            if transcription_budget is None else transcription_budget
+        self.measure_tokens = os.getenv('PROMPT_MEASURE', 'false').lower() == 'true'
+        self.tokenizer = None
+        self.tokenizer_loaded = False
+        self.lock = threading.Lock()
+        self.measured = 0
+        self.before = 0  # Running sums of the prompt tokens, so memory does not grow with the amount of ads
+        self.after = 0
+
+    def load_tokenizer(self):
+        """
+        Loads the tokenizer of the model on first use. Without transformers or network access the tokens are estimated
+        by counting words and punctuation, which is good enough for budgeting. Safe to call from concurrent requests.
+        """
+        if self.tokenizer_loaded:
+            return self.tokenizer
+        with self.lock:
+            if not self.tokenizer_loaded:
+                try:
+                    from transformers import AutoTokenizer
+                    self.tokenizer = AutoTokenizer.from_pretrained(TOKENIZERS.get(self.model, self.model))
+                except Exception as e:
+                    print(f'[{datetime.datetime.now().strftime("%H:%M")}] » Could not load the tokenizer of '
+                          f'`{self.model}`, estimating tokens instead: {e}')
+                self.tokenizer_loaded = True
+        return self.tokenizer
+
+    def tokens(self, text):
+        """
+        Splits a text into tokens.
+        :param text: The text to tokenize.
+        :return: The list of tokens (ids if the tokenizer is available, otherwise word and punctuation pieces).
+        """
+        tokenizer = self.load_tokenizer()
+        if tokenizer is not None:
+            return tokenizer.encode(text, add_special_tokens=False)
+        return re.findall(r'\w+|[^\w\s]', text)
+
+    def count(self, text):
+        """
+        :return: The amount of tokens in a text.
+        """
+        return len(self.tokens(text))
+
+    def trim(self, text, budget):
+        """
+        Trims a text to a token budget. Two thirds of the budget is spent on the start of the text and the rest on the
+        end, as transcriptions usually end with the call to action.
+        :param text: The text to trim.
+        :param budget: The maximum amount of tokens.
+        :return: The (trimmed) text.
+        """
+        text = ' '.join(text.split())
+        budget = max(budget, 3)
+        tokens = self.tokens(text)
+        if len(tokens) <= budget:
+            return text
+        head, tail = budget * 2 // 3, budget - budget * 2 // 3
+        if self.tokenizer is not None:
+            return f'{self.tokenizer.decode(tokens[:head])} [...] {self.tokenizer.decode(tokens[-tail:])}'
+        # Without a tokenizer we cut the original text at the character position of the estimated tokens
+        spans = [match.span() for match in re.finditer(r'\w+|[^\w\s]', text)]
+        return f'{text[:spans[head - 1][1]]} [...] {text[spans[-tail][0]:]}'
+
+    @staticmethod
+    def bodies(ad):
+        """
+        Deduplicates the ad bodies (ignoring whitespace differences) while keeping their original order, so the same ad
+        always results in the same prompt. A set does not guarantee that between runs.
+        :param ad: The ad.
+        :return: The list of unique bodies.
+        """
+        return list(dict.fromkeys(' '.join(body.split()) for body in ad.get('ad_creative_bodies') or [] if body))
+
+    def content(self, ad):
+        """
+        Builds the ad part of a prompt as JSON, within the token budgets.
+        :param ad: The ad.
+        :return: The JSON text with the ad text and video transcription.
+        """
+        bodies = self.bodies(ad)
+        transcription = ad.get('video_transcription')
+        return json.dumps({
+            'ad_text': self.trim(' | '.join(bodies), self.body_budget) if bodies else None,
+            'video_transcription': self.trim(transcription, self.transcription_budget) if transcription else None,
+        }, ensure_ascii=False)
+
+    @staticmethod
+    def legacy_content(ad, body_limit, transcription_limit=None):
+        """
+        Builds the ad part of a prompt as it was done before: a set of bodies truncated by characters.
+        Only used to measure the reduction in prompt tokens.
+        :param ad: The ad.
+        :param body_limit: The maximum amount of characters of the bodies.
+        :param transcription_limit: The maximum amount of characters of the transcription, None for no limit.
+        :return: The ad part of the legacy prompt.
+        """
+        text = ' '.join(set(ad['ad_creative_bodies'])) if 'ad_creative_bodies' in ad else 'None'
+        text = text.replace('\n', ' ').replace('\t', ' ').replace('\r', ' ')[:body_limit]
+        transcription = ad.get('video_transcription', 'None')
+        transcription = transcription[:transcription_limit] if transcription_limit else transcription
+        return f'{{\n"ad_text": {text},\n"video_transcription": "{transcription}"\n}}'
+
+    def criteria(self, ad):
+        """
+        Builds the criteria prompt of an ad.
+        :param ad: The ad.
+        :return: The prompt.
+        """
+        return self.measure(f'{CRITERIA_INSTRUCTIONS}```json\n{self.content(ad)}\n```',
+                            f'{CRITERIA_INSTRUCTIONS}{self.legacy_content(ad, 4000)}')
+
+    def label(self, ad):
+        """
+        Builds the label prompt of an ad.
+        :param ad: The ad.
+        :return: The prompt.
+        """
+        return self.measure(f'{LABEL_INSTRUCTIONS}{self.content(ad)}',
+                            f'{LABEL_INSTRUCTIONS}{self.legacy_content(ad, 3000, 2000)}')
+
+    def measure(self, prompt, legacy):
+        """
+        Counts the tokens of a prompt and of its legacy variant if PROMPT_MEASURE is true.
+        :return: The prompt.
+        """
+        if self.measure_tokens:
+            after, before = self.count(prompt), self.count(legacy)
+            with self.lock:
+                self.measured += 1
+                self.after += after
+                self.before += before
+        return prompt
+
+    def report(self):
+        """
+        :return: A summary of the average prompt tokens per ad before and after the prompt builder.
+        """
+        if not self.measured:
+            return f'no {self.model} prompts measured'
+        after, before = self.after / self.measured, self.before / self.measured
+        return (f'{after:.0f} prompt tokens per ad instead of {before:.0f} '
+                f'({(1 - after / before) * 100:.1f}% less, {self.model})')
@@ -0,0 +1,210 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the indexed reader for the JSON files of ads ({"data": [ad, ...]}). The byte range of
+              every ad is stored in a sidecar index next to the file, which is built once and rebuilt when the file
+              changes. The file is memory-mapped, so reading a single ad by id or scanning a subset only parses those
+              ads instead of the whole dump. Compressed JSONL files of the archive mode (see archive.py) are
+              decompressed into memory once, after which they are read the same way.
+@date: 19-10-2026
+"""
+import json
+import mmap
+import os
+
+from archive import JSONL_SUFFIX, read_bytes
+
+INDEX_VERSION = 1
+WINDOW_BYTES = 1 << 22  # The index is built from windows of the file, so only a window is decoded at a time
+
+
+class AdReader:
+    """
+    This class gives random access to the ads of a JSON file by id. Use it as a context manager or call close.
+    """
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or f'{path}.idx'
+        self.file = None
+        self.map = None
+        self.offsets = {}
+        self.order = []
+        self.ranges = []  # The byte range of every ad in file order, an id can occur more than once
+        if not os.path.exists(path):
+            return
+        self.file = open(path, 'rb')
+        if path.endswith(JSONL_SUFFIX):
+            self.map = read_bytes(path)
+        elif os.path.getsize(path) > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Closes the memory map and the file.
+        """
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stamp(self):
+        """
+        :return: The size and modification time of the file, the index is only valid for this stamp.
+        """
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def load_index(self):
+        """
+        Loads the sidecar index, or builds and stores it if it is missing or outdated.
+        """
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get('version') == INDEX_VERSION and index.get('stamp') == self.stamp():
+                    self.order = index['ids']
+                    self.ranges = list(zip(index['starts'], index['ends']))
+                    self.offsets = {}
+                    for ad_id, byte_range in zip(self.order, self.ranges):
+                        self.offsets.setdefault(ad_id, byte_range)
+                    return
+            except (ValueError, KeyError):
+                pass  # A corrupt index is rebuilt
+        self.build_index()
+
+    def build_index(self):
+        """
+        Scans the file once and stores the byte range of every ad in the sidecar index.
+        """
+        self.order, self.offsets, self.ranges = [], {}, []
+        if self.map is None:
+            return
+        if self.path.endswith(JSONL_SUFFIX):
+            self.index_lines()
+            return
+        key = self.map.find(b'"data"')
+        i = self.map.find(b'[', key) if key != -1 else -1
+        if i == -1:
+            raise ValueError(f'`{self.path}` is not a JSON file of ads')
+        decoder = json.JSONDecoder()
+        size, window_size = len(self.map), WINDOW_BYTES
+        position = i + 1  # The byte offset of text[i]
+        text, i, window_end, ascii_only, fresh = '', 0, position, True, False
+        starts, ends = [], []
+        while True:
+            while i < len(text) and text[i] in ' \t\r\n,':
+                i, position = i + 1, position + 1
+            if i < len(text) and text[i] == ']':
+                break
+            try:
+                ad, end = decoder.raw_decode(text, i)
+            except json.JSONDecodeError:
+                if window_end >= size:
+                    if i >= len(text):
+                        break
+                    raise
+                # The ad continues after the window, so the next window starts at the ad and is larger if the ad
+                # alone does not fit in it
+                window_size = window_size * 2 if fresh else window_size
+                text, window_end, ascii_only = self.window(position, window_size)
+                i, fresh = 0, True
+                continue
+            starts.append(position)
+            # json.dump escapes non-ASCII by default, then characters are bytes
+            position += end - i if ascii_only else len(text[i:end].encode('utf-8'))
+            ends.append(position)
+            self.order.append(ad['id'])
+            i, fresh = end, False
+        self.store_index(starts, ends)
+
+    def window(self, start, size):
+        """
+        Decodes a window of the file. A character that is cut off at the end of the window is left for the next one.
+        :param start: The byte offset of the window.
+        :param size: The maximum amount of bytes.
+        :return: Tuple of (text, byte offset after the window, whether the text is ASCII only).
+        """
+        data = self.map[start:start + size]
+        end = len(data)
+        if start + end < len(self.map):
+            while end and data[end - 1] & 0xC0 == 0x80:  # Continuation bytes of a multibyte character
+                end -= 1
+            if end and data[end - 1] >= 0xC0:  # The first byte of the character
+                end -= 1
+        text = data[:end].decode('utf-8')
+        return text, start + end, len(text) == end
+
+    def index_lines(self):
+        """
+        Indexes a JSONL file, every line is an ad.
+        """
+        starts, ends = [], []
+        start = 0
+        for line in self.map.split(b'\n'):
+            if line.strip():
+                self.order.append(json.loads(line)['id'])
+                starts.append(start)
+                ends.append(start + len(line))
+            start += len(line) + 1
+        self.store_index(starts, ends)
+
+    def store_index(self, starts, ends):
+        """
+        Sets the byte ranges of the ads and stores them in the sidecar index.
+        """
+        self.ranges = list(zip(starts, ends))
+        for ad_id, byte_range in zip(self.order, self.ranges):
+            self.offsets.setdefault(ad_id, byte_range)  # get returns the first ad with an id
+        with open(f'{self.index_path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'stamp': self.stamp(), 'ids': self.order, 'starts': starts,
+                       'ends': ends}, f)
+        os.replace(f'{self.index_path}.tmp', self.index_path)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, ad_id):
+        return ad_id in self.offsets
+
+    def ids(self):
+        """
+        :return: The ids of the ads in file order.
+        """
+        return list(self.order)
+
+    def get(self, ad_id, default=None):
+        """
+        Parses a single ad.
+        :param ad_id: The id of the ad.
+        :param default: The value to return if the ad is not in the file.
+        :return: The ad.
+        """
+        if ad_id not in self.offsets:
+            return default
+        start, end = self.offsets[ad_id]
+        return json.loads(self.map[start:end])
+
+    def scan(self, ids=None):
+        """
+        Parses the ads one by one, so only a single ad is in memory at a time.
+        :param ids: The ids of the ads to read (in this order), all ads in file order if None. Without ids an ad that
+                    occurs more than once (e.g. found with two search terms) is returned every time.
+        :return: A generator of ads.
+        """
+        if ids is None:
+            for start, end in self.ranges:
+                yield json.loads(self.map[start:end])
+            return
+        for ad_id in ids:
+            if ad_id in self.offsets:
+                yield self.get(ad_id)
@@ -0,0 +1,173 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the compact in-memory representation of the ads used for statistics and graphs.
+              An AdRecord only keeps the fields the statistics need in __slots__, with interned strings, the six
+              criteria packed in a bitfield and nested breakdowns as tuples. It can be read like the ad dictionary
+              for those fields, so the statistics code works on both. The full ad is read from disk on demand.
+@date: 19-10-2026
+"""
+import sys
+
+from parsing import CRITERIA_KEYS
+from reader import AdReader
+
+MISSING = object()
+
+
+def intern(value):
+    """
+    :return: The interned string, or the value itself if it is not a string.
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class AdRecord:
+    """
+    This class is the read-only projection of an ad. Only the manual label can be changed, so labels can be applied
+    to the records directly. Accessing a field that is not projected raises a KeyError, use AdStore.full instead.
+    The first ad body is kept as a fingerprint, which is enough to count unique bodies and ads without a body.
+    """
+    __slots__ = ('id', 'search_term', 'page_name', 'target_gender', 'ad_delivery_start_time', 'ad_delivery_stop_time',
+                 'languages', 'target_ages', 'target_locations', 'reach', 'criteria', 'scam', 'confidence',
+                 'manual_label', 'body', 'transcribed')
+    STRINGS = ('search_term', 'page_name', 'target_gender', 'ad_delivery_start_time', 'ad_delivery_stop_time')
+
+    def __init__(self, ad):
+        self.id = ad['id']
+        for key in self.STRINGS:
+            setattr(self, key, intern(ad[key]) if key in ad else MISSING)
+        self.languages = tuple(map(intern, ad['languages'])) if 'languages' in ad else MISSING
+        self.target_ages = tuple(map(intern, ad['target_ages'])) if 'target_ages' in ad else MISSING
+        self.target_locations = tuple((intern(location.get('name', 'N/A')), location.get('excluded'))
+                                      for location in ad['target_locations']) if 'target_locations' in ad else MISSING
+        self.reach = tuple((intern(breakdown.get('country')), len(breakdown.get('age_gender_breakdowns', [])))
+                           for breakdown in ad['age_country_gender_reach_breakdown']) \
+            if 'age_country_gender_reach_breakdown' in ad else MISSING
+        classification = ad.get('classification')
+        self.criteria = self.pack(classification) if classification is not None else MISSING
+        self.scam = classification.get('scam', MISSING) if classification is not None else MISSING
+        self.confidence = intern(classification.get('confidence', MISSING)) if classification is not None else MISSING
+        self.manual_label = ad.get('manual_label', MISSING)
+        if 'ad_creative_bodies' in ad:
+            body = (ad['ad_creative_bodies'] or [None])[0]
+            self.body = hash(body) if body else None
+        else:
+            self.body = MISSING
+        self.transcribed = 'video_transcription' in ad
+
+    @staticmethod
+    def pack(classification):
+        """
+        Packs the criteria in a bitfield: bit i is set if criterion i is present, bit i + 6 if it is true.
+        :return: The bitfield.
+        """
+        bits = 0
+        for i, key in enumerate(CRITERIA_KEYS):
+            if key in classification:
+                bits |= 1 << i
+                if classification[key]:
+                    bits |= 1 << (i + len(CRITERIA_KEYS))
+        return bits
+
+    def classification(self):
+        """
+        :return: A new dictionary with the criteria, scam label and confidence, as in the ad.
+        """
+        result = {key: bool(self.criteria >> (i + len(CRITERIA_KEYS)) & 1)
+                  for i, key in enumerate(CRITERIA_KEYS) if self.criteria >> i & 1}
+        if self.scam is not MISSING:
+            result['scam'] = self.scam
+        if self.confidence is not MISSING:
+            result['confidence'] = self.confidence
+        return result
+
+    def get(self, key, default=None):
+        """
+        Reads a field like dict.get, nested fields are rebuilt as lists and dictionaries.
+        :raises KeyError: If the field is not part of the projection.
+        """
+        if key == 'id' or key in self.STRINGS or key == 'manual_label':
+            value = getattr(self, key)
+        elif key in ('languages', 'target_ages'):
+            value = getattr(self, key)
+            value = list(value) if value is not MISSING else value
+        elif key == 'target_locations':
+            value = [{'name': name, 'excluded': excluded} for name, excluded in self.target_locations] \
+                if self.target_locations is not MISSING else MISSING
+        elif key == 'age_country_gender_reach_breakdown':
+            value = [{'country': country, 'age_gender_breakdowns': [None] * size} for country, size in self.reach] \
+                if self.reach is not MISSING else MISSING
+        elif key == 'classification':
+            value = self.classification() if self.criteria is not MISSING else MISSING
+        elif key == 'ad_creative_bodies':
+            value = [self.body] if self.body is not MISSING else MISSING
+        elif key == 'video_transcription' and not self.transcribed:
+            value = MISSING
+        else:
+            raise KeyError(f'`{key}` is not kept in memory for ad {self.id}, use AdStore.full to read the full ad')
+        return default if value is MISSING else value
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        if key == 'video_transcription':
+            return self.transcribed
+        return self.get(key, MISSING) is not MISSING
+
+    def __setitem__(self, key, value):
+        if key != 'manual_label':
+            raise KeyError(f'Only the manual label of an AdRecord can be changed, not `{key}`')
+        self.manual_label = value
+
+    def pop(self, key, default=None):
+        """
+        Removes the manual label, like dict.pop.
+        """
+        if key != 'manual_label':
+            raise KeyError(f'Only the manual label of an AdRecord can be removed, not `{key}`')
+        value, self.manual_label = self.manual_label, MISSING
+        return default if value is MISSING else value
+
+
+class AdStore:
+    """
+    This class holds the records of one JSON file of ads and reads the full ads from that file when they are needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self.index = {}
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads the records of a JSON file of ads. Once the file is indexed the ads are parsed one by one with the
+        indexed reader, so the full data is never in memory at once.
+        :param path: The path of the JSON file, a missing file results in an empty store.
+        :return: The store.
+        """
+        store = cls(path)
+        with AdReader(path) as reader:
+            store.records = [AdRecord(ad) for ad in reader.scan()]
+        store.index = {record.id: record for record in store.records}
+        return store
+
+    def get(self, ad_id):
+        """
+        :return: The record of an ad or None if the ad is not in the store.
+        """
+        return self.index.get(ad_id)
+
+    def full(self, ids=None):
+        """
+        Reads the full ads from the file, only the requested ads are parsed.
+        :param ids: The ids of the ads to read, all ads if None.
+        :return: The list of full ads in the order of the ids (file order if no ids are given).
+        """
+        with AdReader(self.path) as reader:
+            return list(reader.scan(ids))
@@ -0,0 +1,152 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the statistics accumulator of the Inspector. It keeps the counters of a set of ads
+              (per search term, per criterion, AI and manual labels, confusion matrices per confidence level, unique
+              page names and bodies) and updates them per ad when an ad is labeled, classified or relabeled, by
+              removing the old contribution of the ad and adding the new one. A snapshot is a copy of the counters,
+              so printing the statistics does not scan the data.
+@date: 19-10-2026
+"""
+import threading
+from collections import Counter
+
+from parsing import CRITERIA_KEYS
+
+SEARCH_TERMS = ['airdrop', 'bitcoin', 'crypto', 'elon', 'ethereum', 'giveaway', 'invest', 'musk', 'profit', 'scam']
+
+
+def contribution(ad):
+    """
+    Determines what an ad adds to the counters.
+    :param ad: The ad (dictionary or AdRecord).
+    :return: Tuple of (the counter keys of the ad, its page name, the fingerprint of its first body).
+    """
+    classification = ad.get('classification', {})
+    manual_label = ad.get('manual_label', {})
+    ai, manual = classification.get('scam', False), manual_label.get('scam', False)
+    body = (ad.get('ad_creative_bodies') or [None])[0]
+    body = hash(body) if isinstance(body, str) else body  # AdRecords already keep the hash of the body
+    keys = [('term', term) for term in SEARCH_TERMS if term in ad.get('search_term', '')]
+    keys += [('criterion', key) for key in CRITERIA_KEYS if classification.get(key, False)]
+    keys.append(('confusion', classification.get('confidence'), manual, ai))
+    if 'manual_label' in ad:
+        keys.append(('labeled', classification.get('confidence'), manual, ai))
+    if 'video_transcription' in ad:
+        keys.append(('transcribed',))
+    if not body:
+        keys.append(('without_body',))
+    return tuple(keys), ad.get('page_name', None), body or None
+
+
+def matrix(confusion, very_likely=False):
+    """
+    Sums the confusion matrices of the confidence levels.
+    :param confusion: A dictionary of (confidence, manual, ai) -> amount of ads.
+    :param very_likely: Whether an ad only counts as scam by AI if the confidence is "Very likely".
+    :return: Tuple of (tp, fp, fn, tn).
+    """
+    tp, fp, fn, tn = 0, 0, 0, 0
+    for (confidence, manual, ai), amount in confusion.items():
+        ai = ai and (not very_likely or confidence == 'Very likely')
+        if manual and ai:
+            tp += amount
+        elif ai:
+            fp += amount
+        elif manual:
+            fn += amount
+        else:
+            tn += amount
+    return tp, fp, fn, tn
+
+
+class StatsAccumulator:
+    """
+    This class holds the counters of a set of ads. Every change of an ad costs a constant amount of work, independent
+    of the amount of ads.
+    """
+
+    def __init__(self, ads=(), key=None):
+        """
+        :param ads: The ads to count.
+        :param key: The function that identifies an ad, its id by default. The filtered data can hold an ad more than
+                    once (once per search term), so it is counted per object with key=id.
+        """
+        self.key = key or (lambda ad: ad['id'])
+        self.counts = Counter()
+        self.pages = Counter()
+        self.bodies = Counter()
+        self.contributions = {}  # key of the ad -> contribution
+        self.lock = threading.Lock()  # The labeling app updates from its request threads
+        for ad in ads:
+            self.update(ad)
+
+    def update(self, ad):
+        """
+        Adds an ad or replaces its previous state, call it whenever an ad is labeled, classified or relabeled.
+        :param ad: The ad in its current state.
+        """
+        new = contribution(ad)
+        with self.lock:
+            old = self.contributions.get(self.key(ad))
+            if old is not None:
+                self.subtract(old)
+            self.contributions[self.key(ad)] = new
+            keys, page, body = new
+            self.counts.update(keys)
+            self.pages[page] += 1
+            self.bodies[body] += 1
+
+    def remove(self, ad):
+        """
+        Removes an ad from the counters.
+        :param ad: The ad.
+        """
+        with self.lock:
+            old = self.contributions.pop(self.key(ad), None)
+            if old is not None:
+                self.subtract(old)
+
+    def subtract(self, old):
+        """
+        Subtracts a contribution, keys that drop to zero are removed so the unique counts stay correct.
+        """
+        keys, page, body = old
+        for key in keys:
+            self.counts[key] -= 1
+            if self.counts[key] == 0:
+                del self.counts[key]
+        for counter, value in ((self.pages, page), (self.bodies, body)):
+            counter[value] -= 1
+            if counter[value] == 0:
+                del counter[value]
+
+    def __len__(self):
+        return len(self.contributions)
+
+    def snapshot(self):
+        """
+        :return: A dictionary with the current statistics: ads, terms, criteria, scam_ai, scam_manual, labeled,
+                 labeled_scam_manual, transcribed, without_body, unique_pages, unique_bodies, confusion (of all ads,
+                 an ad without manual label counts as not a scam) and labeled_confusion (of the labeled ads), both
+                 as (confidence, manual, ai) -> amount, see matrix.
+        """
+        with self.lock:
+            counts = dict(self.counts)
+            ads, pages, bodies = len(self.contributions), len(self.pages), len(self.bodies)
+        confusion = {key[1:]: amount for key, amount in counts.items() if key[0] == 'confusion'}
+        labeled = {key[1:]: amount for key, amount in counts.items() if key[0] == 'labeled'}
+        return {
+            'ads': ads,
+            'terms': {term: counts.get(('term', term), 0) for term in SEARCH_TERMS},
+            'criteria': {key: counts.get(('criterion', key), 0) for key in CRITERIA_KEYS},
+            'scam_ai': sum(amount for (_, _, ai), amount in confusion.items() if ai),
+            'scam_manual': sum(amount for (_, manual, _), amount in confusion.items() if manual),
+            'labeled': sum(labeled.values()),
+            'labeled_scam_manual': sum(amount for (_, manual, _), amount in labeled.items() if manual),
+            'transcribed': counts.get(('transcribed',), 0),
+            'without_body': counts.get(('without_body',), 0),
+            'unique_pages': pages,
+            'unique_bodies': bodies,
+            'confusion': confusion,
+            'labeled_confusion': labeled,
+        }
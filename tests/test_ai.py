@@ -0,0 +1,83 @@
+import json
+import threading
+
+import numpy as np
+
+from ai import AIToolBox
+from benchmark import FakeOllamaServer
+from metrics import Metrics
+from parsing import CONSTRAINED_CRITERIA_SCHEMA, CRITERIA_ORDER
+from prompts import PromptBuilder
+
+
+class SilentVad:
+    def trim(self, audio):
+        return None, 0.0
+
+
+def test_vad_record_keeps_seconds_for_timing():
+    toolbox = AIToolBox.__new__(AIToolBox)
+    toolbox.metrics = Metrics('test')
+    toolbox.vad = SilentVad()
+    toolbox.whisper_name = 'base'
+    toolbox.decode_audio = lambda video_path, ad_id=None: np.zeros(16000 * 30, dtype=np.float32)
+    assert toolbox.transcribe('video.mp4', '1') == (None, None, 0.0, 'base')
+    record, = [record for record in toolbox.metrics.records if record['stage'] == 'transcribe.vad']
+    assert (record['audio_seconds'], record['speech_seconds']) == (30, 0.0)
+    assert 0 <= record['seconds'] < 1
+
+
+def criteria_toolbox(client):
+    toolbox = AIToolBox.__new__(AIToolBox)
+    toolbox.metrics = Metrics('test')
+    toolbox.ollama_client = client
+    toolbox.client_lock = threading.Lock()
+    toolbox.criteria_model = 'llama3.2'
+    toolbox.criteria_prompts = PromptBuilder('llama3.2')
+    toolbox.top_k, toolbox.top_p, toolbox.temp = 1, 0.2, 0.1
+    toolbox.criteria_num_predict = 64
+    toolbox.max_ollama_history = 2
+    return toolbox
+
+
+class StreamingClient:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def chat(self, **kwargs):
+        return iter(self.chunks)
+
+
+def test_constrained_prompt_counts_the_tokens_of_the_final_chunk():
+    answer = json.dumps({key: True for key in CRITERIA_ORDER})
+    chunks = [{'message': {'content': answer[i:i + 4]}, 'done': False} for i in range(0, len(answer), 4)]
+    chunks.append({'message': {'content': ''}, 'done': True, 'eval_count': 7, 'prompt_eval_count': 100})
+    toolbox = criteria_toolbox(StreamingClient(chunks))
+    messages, undecided = toolbox.constrained_prompt([], {'id': '1', 'ad_creative_bodies': ['Free BTC']})
+    record, = [record for record in toolbox.metrics.records if record['stage'] == 'criteria.llm']
+    assert (record['eval_tokens'], record['prompt_tokens'], undecided) == (7, 100, [])
+    assert messages[-1]['content'] == answer
+
+
+def test_constrained_prompt_counts_the_chunks_of_a_stopped_stream():
+    chunks = [{'message': {'content': piece}, 'done': False} for piece in ['{"about', '_crypto"', ': false', ',']]
+    chunks.append({'message': {'content': ''}, 'done': True, 'eval_count': 99})
+    toolbox = criteria_toolbox(StreamingClient(chunks))
+    messages, undecided = toolbox.constrained_prompt([], {'id': '1', 'ad_creative_bodies': ['Running shoes']})
+    record, = [record for record in toolbox.metrics.records if record['stage'] == 'criteria.llm']
+    assert record['eval_tokens'] == 3
+    assert 'about_crypto' not in undecided and len(undecided) == 5
+
+
+def test_fake_server_streams_the_criteria_in_the_order_of_the_format():
+    import ollama
+    server = FakeOllamaServer().start()
+    try:
+        chunks = list(ollama.Client(host=server.url).chat(model='llama3.2', messages=[{'role': 'user', 'content': 'ad'}],
+                                                          stream=True, format=CONSTRAINED_CRITERIA_SCHEMA))
+    finally:
+        server.stop()
+    content = ''.join(chunk['message']['content'] for chunk in chunks)
+    assert list(json.loads(content)) == CRITERIA_ORDER
+    assert len(chunks) > 2 and chunks[-1]['done'] and not any(chunk['done'] for chunk in chunks[:-1])
+    assert chunks[-1]['eval_count'] == len(content) // 4
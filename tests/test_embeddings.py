@@ -0,0 +1,85 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from embeddings import EmbeddingIndex
+
+
+class FakeEncoder:
+    """
+    Encodes texts into deterministic normalized vectors from their hash, in place of the sentence transformer.
+    """
+
+    def __init__(self, dim=16):
+        self.dim = dim
+        self.encoded = 0
+
+    def encode(self, texts, **kwargs):
+        self.encoded += len(texts)
+        vectors = np.array([np.random.default_rng(int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:8], 16))
+                            .standard_normal(self.dim) for text in texts])
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def index(tmp_path, amount=200, dim=16):
+    """
+    :return: An index of random normalized vectors, without the sentence transformer.
+    """
+    result = EmbeddingIndex(directory=str(tmp_path), model_name='test')
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((amount, dim)).astype(np.float32)
+    result.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    result.ids = [str(i) for i in range(amount)]
+    result.rows = {ad_id: row for row, ad_id in enumerate(result.ids)}
+    result.build_lsh()
+    return result
+
+
+def test_query_with_missing_buckets(tmp_path):
+    result = index(tmp_path)
+    # Only one table still has its buckets, the query vector misses them in all other tables
+    for table in range(1, result.tables):
+        result.buckets[table] = {}
+    neighbors = result.query_by_id('0', k=5)
+    assert len(neighbors) == 5
+    assert all(ad_id != '0' for ad_id, _ in neighbors)
+
+
+def test_query_without_any_bucket(tmp_path):
+    result = index(tmp_path)
+    result.buckets = [{} for _ in range(result.tables)]
+    vector = np.asarray(result.vectors[3])
+    neighbors = result.query_vector(vector, k=3)
+    assert neighbors[0][0] == '3'
+    assert neighbors[0][1] == pytest.approx(1.0, abs=1e-5)
+
+
+def ads(amount):
+    return [{'id': str(i), 'ad_creative_bodies': [f'Claim your free coins number {i}']} for i in range(amount)]
+
+
+def test_build_only_encodes_changed_ads(tmp_path):
+    result = EmbeddingIndex(directory=str(tmp_path), model_name='test')
+    result.model = FakeEncoder()
+    result.build(ads(50))
+    assert result.model.encoded == 50
+    assert result.vectors.shape == (50, 16)
+    changed = ads(50)
+    changed[7]['ad_creative_bodies'] = ['Something else entirely']
+    rebuilt = EmbeddingIndex(directory=str(tmp_path), model_name='test')
+    rebuilt.model = FakeEncoder()
+    rebuilt.build(changed)
+    assert rebuilt.model.encoded == 1
+    assert np.allclose(rebuilt.vectors[3], result.vectors[3])
+    assert rebuilt.query_by_id('3', k=1)[0][0] != '3'
+
+
+def test_build_without_changes_does_not_load_the_model(tmp_path):
+    result = EmbeddingIndex(directory=str(tmp_path), model_name='test')
+    result.model = FakeEncoder()
+    result.build(ads(20))
+    unchanged = EmbeddingIndex(directory=str(tmp_path), model_name='test')
+    unchanged.build(ads(20))
+    assert unchanged.model is None
+    assert unchanged.vectors.shape == (20, 16)
@@ -0,0 +1,23 @@
+from cascade import Cascade
+from manual import Inspector
+
+
+def test_build_unique_keeps_the_label_source():
+    previous = [
+        {'id': '1', 'classification': {'scam': False, 'reason': 'r', 'confidence': 'Unlikely', 'classifier': 'c',
+                                       'label_input': 'h1', 'label_source': 'cascade'}},
+        {'id': '2', 'classification': {'scam': True, 'reason': 'r', 'confidence': 'Likely', 'classifier': 'c',
+                                       'label_input': 'h2', 'label_source': 'campaign', 'campaign': '3'}},
+        {'id': '4', 'classification': {'scam': False, 'reason': 'r', 'confidence': 'Very unlikely', 'classifier': 'c',
+                                       'label_input': 'h4', 'label_source': 'criteria', 'undecided': ['unrealistic']}},
+    ]
+    data = [{'id': ad_id, 'ad_creative_bodies': [f'body {ad_id}'], 'classification': {'about_crypto': True}}
+            for ad_id in ['1', '2', '3', '4']]
+    unique = {ad['id']: ad for ad in Inspector.build_unique(data, previous)}
+    assert unique['1']['classification']['label_source'] == 'cascade'
+    # The cascade must not train on its own predictions after a rebuild
+    assert not Cascade.from_llm(unique['1']['classification'], 'scam')
+    assert unique['2']['classification']['label_source'] == 'campaign'
+    assert unique['2']['classification']['campaign'] == '3'
+    assert unique['4']['classification']['undecided'] == ['unrealistic']
+    assert 'scam' not in unique['3']['classification']
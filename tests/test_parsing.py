@@ -0,0 +1,20 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from parsing import LABEL_SCHEMA, JsonExtractor
+
+
+def test_counts_concurrent_parses():
+    extractor = JsonExtractor()
+    answers = ['{"scam": true, "reason": "r", "confidence": "Likely"}', 'no json here'] * 500
+
+    def parse(answer):
+        try:
+            extractor.parse(answer, LABEL_SCHEMA)
+        except ValueError:
+            extractor.count('retries')
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(parse, answers))
+    assert (extractor.parsed, extractor.failures, extractor.retries) == (500, 500, 500)
+    assert extractor.stats() == '500 parsed, 500 parse failures, 500 re-asks (0 failed)'
+
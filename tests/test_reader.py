@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import reader
+from reader import AdReader
+
+
+def ads(amount):
+    return [{'id': str(i % 40), 'ad_creative_bodies': [f'Gratis bitcoin für alle 🚀 {"x" * (i * 7)}'],
+             'page_name': 'Crypto ✓' if i % 3 else 'Plain'} for i in range(amount)]
+
+
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+@pytest.mark.parametrize('window', [64, 1 << 22])
+def test_index_in_windows(tmp_path, monkeypatch, ensure_ascii, window):
+    # Small windows cut ads and multibyte characters in half and are smaller than most ads
+    monkeypatch.setattr(reader, 'WINDOW_BYTES', window)
+    path = tmp_path / 'ads.json'
+    data = ads(60)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'data': data}, f, indent=4, ensure_ascii=ensure_ascii)
+    with AdReader(str(path)) as r:
+        assert r.ids() == [ad['id'] for ad in data]
+        assert list(r.scan()) == data
+        assert r.get('5') == data[5]
+
+
+def test_index_of_empty_data(tmp_path):
+    path = tmp_path / 'ads.json'
+    path.write_text('{"data": []}')
+    with AdReader(str(path)) as r:
+        assert len(r) == 0
+
+
+def test_index_of_other_json(tmp_path):
+    path = tmp_path / 'other.json'
+    path.write_text('{"ads": {}}')
+    with pytest.raises(ValueError):
+        AdReader(str(path))
@@ -0,0 +1,170 @@
+"""
+@author: Luuk Kablan
+@description: This file contains the voice activity detection that runs before Whisper. It finds the speech regions in
+              the decoded audio with the frame energy and the share of energy in the speech band, computed with NumPy.
+              Videos without speech are not transcribed at all and for the others only the speech regions are sent to
+              Whisper. Run `python vad.py` to compare the trimmed transcriptions with the stored ones of the samples.
+@date: 19-10-2026
+"""
+import datetime
+import json
+import os
+
+import numpy as np
+
+SAMPLE_RATE = 16000  # Whisper works on 16 kHz mono audio
+
+
+def word_error_rate(reference, hypothesis):
+    """
+    Calculates the word error rate (the word level edit distance divided by the length of the reference).
+    :param reference: The reference text.
+    :param hypothesis: The text to compare with the reference.
+    :return: The word error rate, 0.0 if both texts are empty.
+    """
+    reference = reference.lower().split()
+    hypothesis = hypothesis.lower().split()
+    if not reference:
+        return float(bool(hypothesis))
+    previous = list(range(len(hypothesis) + 1))
+    for i, word in enumerate(reference, 1):
+        current = [i]
+        for j, other in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (word != other)))
+        previous = current
+    return previous[-1] / len(reference)
+
+
+class VoiceActivityDetector:
+    """
+    This class detects speech in 16 kHz mono audio. A frame counts as speech if its energy is well above the noise
+    floor of the clip and a large share of its energy lies in the speech band (300 - 3400 Hz). Short gaps are bridged
+    and the regions are padded, so words at the edges are not cut off. The defaults rather keep too much audio than
+    too little.
+    """
+
+    def __init__(self, frame_ms=30, threshold_db=None, band_ratio=0.35, min_speech=0.25, min_gap=0.3, padding=0.2,
+                 min_total=0.5):
+        """
+        :param frame_ms: The length of an analysis frame in milliseconds.
+        :param threshold_db: How many dB a frame has to be above the noise floor, VAD_THRESHOLD_DB or 12 by default.
+        :param band_ratio: The minimum share of the frame energy in the speech band.
+        :param min_speech: Speech regions shorter than this amount of seconds are dropped.
+        :param min_gap: Gaps between speech regions shorter than this amount of seconds are bridged.
+        :param padding: Seconds of audio added before and after every speech region.
+        :param min_total: Clips with less speech than this amount of seconds are considered speechless.
+        """
+        self.frame = SAMPLE_RATE * frame_ms // 1000
+        self.threshold_db = float(os.getenv('VAD_THRESHOLD_DB', 12)) if threshold_db is None else threshold_db
+        self.band_ratio = band_ratio
+        self.min_speech = min_speech
+        self.min_gap = min_gap
+        self.padding = padding
+        self.min_total = min_total
+
+    def speech_frames(self, audio):
+        """
+        Classifies every frame of the audio as speech or not.
+        :param audio: The audio as float32 NumPy array.
+        :return: A boolean array with one value per frame.
+        """
+        count = len(audio) // self.frame
+        if count == 0:
+            return np.zeros(0, dtype=bool)
+        frames = audio[:count * self.frame].reshape(count, self.frame).astype(np.float32)
+        energy = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        spectrum = np.abs(np.fft.rfft(frames * np.hanning(self.frame), axis=1)) ** 2
+        frequencies = np.fft.rfftfreq(self.frame, 1 / SAMPLE_RATE)
+        band = spectrum[:, (frequencies >= 300) & (frequencies <= 3400)].sum(axis=1)
+        ratio = band / (spectrum.sum(axis=1) + 1e-10)
+        # The threshold follows the noise floor, but never exceeds -35 dBFS so a clip that is speech from start to end
+        # (where the floor is the speech itself) is not considered speechless
+        threshold = min(max(np.percentile(energy, 10) + self.threshold_db, -60), -35)
+        return (energy > threshold) & (ratio > self.band_ratio)
+
+    def segments(self, audio):
+        """
+        Finds the speech regions of the audio.
+        :param audio: The audio as float32 NumPy array.
+        :return: A list of (start, end) tuples in seconds.
+        """
+        speech = self.speech_frames(audio)
+        if not speech.any():
+            return []
+        seconds = self.frame / SAMPLE_RATE
+        edges = np.diff(np.concatenate([[0], speech.astype(np.int8), [0]]))
+        starts, ends = np.flatnonzero(edges == 1) * seconds, np.flatnonzero(edges == -1) * seconds
+        merged = []
+        for start, end in zip(starts, ends):
+            if merged and start - merged[-1][1] < self.min_gap:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        duration = len(audio) / SAMPLE_RATE
+        result = []
+        for start, end in merged:
+            if end - start < self.min_speech:
+                continue
+            start, end = max(start - self.padding, 0.0), min(end + self.padding, duration)
+            if result and start <= result[-1][1]:
+                result[-1] = (result[-1][0], end)
+            else:
+                result.append((start, end))
+        return result
+
+    def trim(self, audio):
+        """
+        Keeps only the speech regions of the audio, separated by a short silence so words do not run together.
+        :param audio: The audio as float32 NumPy array.
+        :return: Tuple of (the trimmed audio or None if there is no speech, the seconds of speech).
+        """
+        segments = self.segments(audio)
+        speech = sum(end - start for start, end in segments)
+        if speech < self.min_total:
+            return None, 0.0
+        silence = np.zeros(SAMPLE_RATE // 10, dtype=np.float32)
+        parts = []
+        for start, end in segments:
+            parts += [audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)], silence]
+        return np.concatenate(parts[:-1]).astype(np.float32), speech
+
+
+def evaluate(limit=None):
+    """
+    Transcribes the speech regions of the sample videos and compares the result with the stored transcriptions, which
+    were made from the full audio.
+    :param limit: The maximum amount of samples to transcribe.
+    :return: A dictionary with the audio seconds, speech seconds and the mean word error rate.
+    """
+    from ai import AIToolBox
+    ai = AIToolBox()
+    detector = VoiceActivityDetector()
+    with open('output/samples.json', 'r', encoding='utf-8') as f:
+        samples = [ad for ad in json.load(f)['data'] if ad.get('video_transcription')]
+    audio_seconds, speech_seconds, errors, skipped = 0.0, 0.0, [], 0
+    for ad in samples[:limit]:
+        video_path = f'output/{ad["search_term"]}/ads_videos/ad_{ad["id"]}_video.mp4'
+        audio = ai.decode_audio(video_path, ad['id'])
+        if audio is None:
+            continue
+        trimmed, speech = detector.trim(audio)
+        audio_seconds += len(audio) / SAMPLE_RATE
+        speech_seconds += speech
+        if trimmed is None:
+            skipped += 1  # A video with a transcription that would not have been transcribed
+            errors.append(1.0)
+            continue
+        text = ai.model.transcribe(audio=trimmed)['text']
+        errors.append(word_error_rate(ad['video_transcription'], text))
+    result = {'videos': len(errors), 'audio_seconds': audio_seconds, 'speech_seconds': speech_seconds,
+              'saved': 1 - speech_seconds / audio_seconds if audio_seconds else 0.0,
+              'wer': sum(errors) / len(errors) if errors else 0.0, 'skipped_with_speech': skipped}
+    print(f'[{datetime.datetime.now().strftime("%H:%M")}] » VAD on {result["videos"]} sample videos: '
+          f'{result["speech_seconds"]:.0f} of {result["audio_seconds"]:.0f} audio seconds kept '
+          f'({result["saved"] * 100:.1f}% saved), mean WER {result["wer"]:.3f} against the full transcriptions, '
+          f'{skipped} videos with speech skipped')
+    return result
+
+
+if __name__ == '__main__':
+    evaluate()